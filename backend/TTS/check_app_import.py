@@ -1,6 +1,15 @@
-import importlib, os, sys
-# ensure parent folder (backend) is on sys.path so 'app' can be imported
-sys.path.insert(0, os.path.abspath(os.path.join(os.getcwd(), '..')))
-m = importlib.import_module('app')
-print('Imported app module OK')
-print('HF models folder exists?', os.path.isdir(os.path.join(os.path.abspath(os.path.join(os.getcwd(), '..')), 'hf_models')))
+import importlib, importlib.util, os, sys
+# backend/ holds app.py; resolve it once from this file rather than the cwd
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+if '--exec' in sys.argv:
+    # Actually run app.py's module body, without loading the LLM or preloading TTS
+    os.environ.setdefault('SKIP_LLM_LOAD', '1')
+    os.environ.setdefault('SKIP_TTS_LOAD', '1')
+    importlib.import_module('app')
+    print('Imported app module OK')
+else:
+    # Resolve the module without executing it
+    print('Found app module OK' if importlib.util.find_spec('app') else 'app module NOT found')
+print('HF models folder exists?', os.path.isdir(os.path.join(backend_dir, 'hf_models')))
@@ -2,7 +2,8 @@
 
 - Uses unique filenames for audio (uuid)
 - Saves TTS audio and returns file to client (frontend should play it)
-- Removes Selenium-based server STT; provides a simple /stt endpoint that accepts POSTed text from client
+- Removes Selenium-based server STT; provides a simple /stt endpoint that accepts POSTed text from client,
+  or transcribes an uploaded recording offline with faster-whisper
 - Properly injects RAG context into prompt
 - Adds basic error handling and logging
 
@@ -15,62 +16,121 @@ Harsha / Buddy: this file is a cleaned-up, safer version of your draft.
 import os
 import time
 import sys
-import types
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import logging
-import warnings
 import struct
-from dotenv import dotenv_values
+import functools
+import copy
+import gc
+import math
+import hashlib
+import importlib.util
+import io
 import json
-from flask import Flask, request, send_file, jsonify
-from flask_cors import CORS
-import numpy as np
+import sqlite3
+from collections import OrderedDict
+from flask import Flask, Response, copy_current_request_context, g, request, send_file, send_from_directory, jsonify
+from werkzeug.exceptions import NotFound
+from dotenv import dotenv_values
 import shutil
-import subprocess
-
-# Prevent transformers optional stacks and Flask debug reloader
-os.environ.setdefault("TRANSFORMERS_NO_AUDIO", "1")
-os.environ.setdefault("TRANSFORMERS_NO_TORCHVISION", "1")
-os.environ.setdefault("NUMBA_DISABLE_JIT", "1")
-os.environ.setdefault("FLASK_ENV", "production")
-os.environ.setdefault("FLASK_DEBUG", "0")
-os.environ.setdefault("MODEL_REPO_LOCAL_ONLY", "1")  # default to local-only model loading
-
-# Stub out librosa to avoid importing numba during transformers import path
-if "librosa" not in sys.modules:
-    import importlib.machinery as _machinery
-    _librosa_mod = types.ModuleType("librosa")
-    _librosa_mod.__version__ = "0.0"
-    _librosa_mod.__spec__ = _machinery.ModuleSpec(name="librosa", loader=None)
-    sys.modules["librosa"] = _librosa_mod
-
-# Stub soxr (optional audio resampler) and soundfile used by transformers.audio_utils
-if "soxr" not in sys.modules:
-    import importlib.machinery as _machinery
-    _soxr_mod = types.ModuleType("soxr")
-    _soxr_mod.__version__ = "0.0"
-    _soxr_mod.__spec__ = _machinery.ModuleSpec(name="soxr", loader=None)
-    sys.modules["soxr"] = _soxr_mod
-if "soundfile" not in sys.modules:
-    import importlib.machinery as _machinery
-    _sf_mod = types.ModuleType("soundfile")
-    _sf_mod.__version__ = "0.0"
-    _sf_mod.__spec__ = _machinery.ModuleSpec(name="soundfile", loader=None)
-    sys.modules["soundfile"] = _sf_mod
+
+# Prevent transformers optional stacks and Flask debug reloader; models load local-only by default
+for _env_name, _env_default in (
+    ("TRANSFORMERS_NO_AUDIO", "1"),
+    ("TRANSFORMERS_NO_TORCHVISION", "1"),
+    ("NUMBA_DISABLE_JIT", "1"),
+    ("FLASK_ENV", "production"),
+    ("FLASK_DEBUG", "0"),
+    ("MODEL_REPO_LOCAL_ONLY", "1"),
+):
+    os.environ.setdefault(_env_name, _env_default)
+
+# Keep transformers from importing librosa (and numba), soxr and soundfile. A
+# ``None`` entry makes ``importlib.util.find_spec`` report them as absent and any
+# direct import fail fast, without building stub modules or specs.
+for _stub_name in ("librosa", "soxr", "soundfile"):
+    sys.modules.setdefault(_stub_name, None)
 
 import threading
+import queue
 import re
 
-# Load environment variables early (used by TTS config too)
-env_vars = dotenv_values('.env')
+@functools.cache
+def _env():
+    """``.env`` values, read once. The module-level settings below look themselves up
+    here, so in practice the file is read at import."""
+    return dotenv_values('.env')
+
+class _LRUCache:
+    """Small thread-safe LRU map used for the per-app LLM and TTS result caches."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return None
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> int:
+        with self._lock:
+            n = len(self._data)
+            self._data.clear()
+            return n
+
+def _orjson_provider_class():
+    """Return a Flask JSON provider backed by orjson, or None when orjson is not installed.
+
+    Installed as ``app.json`` it speeds up both ``request.get_json()`` and ``jsonify``;
+    keys stay sorted and unknown types go through Flask's default hook as before.
+    """
+    try:
+        import orjson  # type: ignore
+    except ImportError:
+        return None
+    from flask.json.provider import DefaultJSONProvider
+
+    class OrjsonProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
 
-# Setup logging early so optional imports can safely use `logger`
-logging.basicConfig(level=logging.INFO)
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE
+            if (self.compact is None and self._app.debug) or self.compact is False:
+                option |= orjson.OPT_INDENT_2
+            return self._app.response_class(orjson.dumps(obj, default=self.default, option=option), mimetype=self.mimetype)
+
+    return OrjsonProvider
+
+# Handlers are configured in create_app(); importing this module leaves logging alone
 logger = logging.getLogger(__name__)
 
 # Local Piper TTS integration (optional helper module)
 try:
-    from piper_tts import list_piper_voices, synthesize_with_piper  # type: ignore
+    from piper_tts import (  # type: ignore
+        list_piper_voices, piper_sample_rate, stream_with_piper, synthesize_batch_with_piper, synthesize_with_piper,
+        in_process_available as piper_in_process_available, cuda_available as piper_cuda_available,
+        load_piper_voice, quantize_voice, stream_in_process, synthesize_in_process,
+    )
     import asyncio
 except Exception:
     logger.warning('piper_tts helper not found; falling back to stubs')
@@ -81,34 +141,175 @@ except Exception:
     def synthesize_with_piper(piper_path: str, model_path: str, config_path: str, text: str, out_wav: str):
         raise RuntimeError('piper_tts not installed; cannot synthesize')
 
-_piper_bin = os.environ.get('PIPER_PATH') or env_vars.get('PIPER_PATH') or 'piper'
+    def synthesize_batch_with_piper(piper_path: str, model_path: str, config_path: str, items):
+        raise RuntimeError('piper_tts not installed; cannot synthesize')
+
+    def piper_sample_rate(config_path: str, default: int = 22050) -> int:
+        return default
+
+    def stream_with_piper(piper_path: str, model_path: str, config_path: str, text: str, **kwargs):
+        raise RuntimeError('piper_tts not installed; cannot synthesize')
+
+    def piper_in_process_available() -> bool:
+        return False
+
+    def piper_cuda_available() -> bool:
+        return False
+
+    def stream_in_process(model_path: str, config_path: str, text: str, **kwargs):
+        raise RuntimeError('piper_tts not installed; cannot synthesize')
+
+    def synthesize_in_process(model_path: str, config_path: str, text: str, out_wav: str, **kwargs):
+        raise RuntimeError('piper_tts not installed; cannot synthesize')
+
+    def quantize_voice(model_path: str) -> str:
+        raise RuntimeError('piper_tts not installed; cannot quantize')
+
+    def load_piper_voice(model_path: str, config_path: str, **kwargs):
+        raise RuntimeError('piper_tts not installed; cannot synthesize')
+
+_piper_bin = os.environ.get('PIPER_PATH') or _env().get('PIPER_PATH') or 'piper'
 if not os.path.isabs(_piper_bin):
     which = shutil.which(_piper_bin)
     PIPER_PATH = which or _piper_bin
 else:
     PIPER_PATH = _piper_bin
+# Synthesize through the piper-tts package in this process, keeping one ONNX session per
+# voice; PIPER_IN_PROCESS=0 (or no package) runs the Piper CLI, reloading the model per call
+PIPER_IN_PROCESS = (
+    (os.environ.get('PIPER_IN_PROCESS') or _env().get('PIPER_IN_PROCESS') or '1').strip().lower() not in ('0', 'false', 'no')
+    and piper_in_process_available()
+)
+# In-process Piper sessions use the GPU when onnxruntime has CUDA (onnxruntime-gpu);
+# PIPER_CUDA=0 keeps them on the CPU
+PIPER_CUDA = (
+    PIPER_IN_PROCESS
+    and (os.environ.get('PIPER_CUDA') or _env().get('PIPER_CUDA') or '1').strip().lower() not in ('0', 'false', 'no')
+    and piper_cuda_available()
+)
+
+# Synthesize with int8 copies of the voice models (made once by the TTS preload). Voices
+# listed in TTS_QUANTIZE_EXCLUDE (comma-separated ids) keep FP32, e.g. to A/B a voice;
+# TTS_QUANTIZE=0 disables quantization entirely
+TTS_QUANTIZE = (os.environ.get('TTS_QUANTIZE') or _env().get('TTS_QUANTIZE') or '1').strip().lower() not in ('0', 'false', 'no')
+TTS_QUANTIZE_EXCLUDE = {
+    v.strip() for v in (os.environ.get('TTS_QUANTIZE_EXCLUDE') or _env().get('TTS_QUANTIZE_EXCLUDE') or '').split(',') if v.strip()
+}
+
+def _piper_model_path(voice: dict) -> str:
+    # Dynamically quantized ops have no CUDA kernels, so GPU sessions stay on FP32
+    q8_path = voice['paths'].get('model_q8')
+    if q8_path and TTS_QUANTIZE and not PIPER_CUDA and voice.get('id') not in TTS_QUANTIZE_EXCLUDE:
+        return q8_path
+    return voice['paths']['model']
+
+def _piper_session_ready(model_path: str, config_path: str) -> bool:
+    """Load the voice's in-process session; if the piper package cannot be imported, switch
+    to the Piper CLI for the rest of the process and return False."""
+    global PIPER_IN_PROCESS, PIPER_CUDA
+    if not PIPER_IN_PROCESS:
+        return False
+    try:
+        load_piper_voice(model_path, config_path, use_cuda=PIPER_CUDA)
+        return True
+    except ImportError as e:
+        logger.warning(f"In-process Piper unavailable ({e}); falling back to the Piper CLI")
+        PIPER_IN_PROCESS = PIPER_CUDA = False
+        return False
+
+def _piper_to_file(model_path: str, config_path: str, text: str, out_wav: str) -> None:
+    if _piper_session_ready(model_path, config_path):
+        synthesize_in_process(model_path, config_path, text, out_wav, use_cuda=PIPER_CUDA)
+    else:
+        synthesize_with_piper(PIPER_PATH, model_path, config_path, text, out_wav)
+
+def _piper_to_files(model_path: str, config_path: str, items) -> None:
+    if _piper_session_ready(model_path, config_path):
+        for text, out_wav in items:
+            synthesize_in_process(model_path, config_path, text, out_wav, use_cuda=PIPER_CUDA)
+    else:
+        synthesize_batch_with_piper(PIPER_PATH, model_path, config_path, items)
+
+def _piper_stream(model_path: str, config_path: str, text: str):
+    if _piper_session_ready(model_path, config_path):
+        return stream_in_process(model_path, config_path, text, use_cuda=PIPER_CUDA)
+    return stream_with_piper(PIPER_PATH, model_path, config_path, text)
 PIPER_VOICES_DIR = os.path.join(os.getcwd(), 'voices', 'piper')
 os.makedirs(PIPER_VOICES_DIR, exist_ok=True)
 
-TTS_ENGINE = (os.environ.get('TTS_ENGINE') or env_vars.get('TTS_ENGINE') or 'piper').strip().lower()
+TTS_ENGINE = (os.environ.get('TTS_ENGINE') or _env().get('TTS_ENGINE') or 'piper').strip().lower()
+
+# Voice list keyed on a stat-only signature of the voices tree: a rescan (which parses every
+# config JSON) happens only when a folder or model/config file changes. The last scan is
+# also kept in DATA_DIR/piper_voices.json so restarts skip the rescan too. Within
+# PIPER_VOICES_TTL seconds of the last check even the stat walk is skipped.
+PIPER_VOICES_TTL = float(os.environ.get('PIPER_VOICES_TTL') or _env().get('PIPER_VOICES_TTL') or '30')
+# Voice picks are keyed by the client-supplied id, so only the most recent few are kept
+PIPER_PICKS_MAX = 32
+_PIPER_CACHE = {"sig": None, "list": [], "picks": _LRUCache(PIPER_PICKS_MAX), "checked": 0.0}
 
-_PIPER_CACHE = {"time": 0.0, "list": []}
+def _piper_voices_signature() -> list | None:
+    sig = []
+    try:
+        for root, dirs, files in os.walk(PIPER_VOICES_DIR):
+            dirs.sort()
+            sig.append([root, os.stat(root).st_mtime_ns])
+            for name in sorted(files):
+                if name.lower().endswith(('.onnx', '.json')):
+                    path = os.path.join(root, name)
+                    sig.append([path, os.stat(path).st_mtime_ns])
+    except OSError:
+        return None  # changed mid-walk; rescan
+    return sig
 
 def get_piper_voices(force_refresh: bool = False):
-    now = time.time()
-    if not force_refresh and _PIPER_CACHE["list"] and (now - _PIPER_CACHE["time"]) < 300:
+    now = time.monotonic()
+    if (not force_refresh and _PIPER_CACHE["sig"] is not None
+            and now - _PIPER_CACHE["checked"] < PIPER_VOICES_TTL):
         return _PIPER_CACHE["list"]
+    _PIPER_CACHE["checked"] = now
+    sig = _piper_voices_signature()
+    if not force_refresh and sig is not None:
+        if sig == _PIPER_CACHE["sig"]:
+            return _PIPER_CACHE["list"]
+        if _PIPER_CACHE["sig"] is None:
+            try:
+                with open(os.path.join(DATA_DIR, 'piper_voices.json'), 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get("sig") == sig:
+                    _PIPER_CACHE.update(sig=sig, list=saved["voices"], picks=_LRUCache(PIPER_PICKS_MAX))
+                    return _PIPER_CACHE["list"]
+            except (OSError, ValueError, KeyError, AttributeError):
+                pass
     voices = list_piper_voices(PIPER_VOICES_DIR)
-    _PIPER_CACHE["list"] = voices
-    _PIPER_CACHE["time"] = now
+    _PIPER_CACHE.update(sig=sig, list=voices, picks=_LRUCache(PIPER_PICKS_MAX))
+    if sig is not None:
+        tmp = unique_filename('piper_voices', 'tmp')
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({"sig": sig, "voices": voices}, f)
+            os.replace(tmp, os.path.join(DATA_DIR, 'piper_voices.json'))
+        except OSError:
+            logger.warning('Could not persist the Piper voice list')
+            _remove_generated([tmp])
     return voices
 
 def pick_indian_piper_voice(preferred_id: str | None) -> dict | None:
+    # Picks are memoized per requested id until the voice list is rescanned (which resets them)
     voices = get_piper_voices()
+    pref = (preferred_id or '').strip()
+    picks = _PIPER_CACHE["picks"]
+    voice = picks.get(pref)
+    if voice is None:
+        voice = _pick_piper_voice(voices, pref)
+        if voice is not None:
+            picks.put(pref, voice)
+    return voice
+
+def _pick_piper_voice(voices: list, pref: str) -> dict | None:
     print(f"DEBUG: Available voices: {[v['shortName'] for v in voices]}")
     if not voices:
         return None
-    pref = (preferred_id or '').strip()
     for v in voices:
         if v.get('id') == pref or v.get('shortName') == pref:
             print(f"DEBUG: Selected preferred voice: {v['shortName']}")
@@ -127,76 +328,151 @@ def pick_indian_piper_voice(preferred_id: str | None) -> dict | None:
     print(f"DEBUG: Fallback voice: {voices[0]['shortName']}")
     return voices[0]
 
-logging.getLogger("pdfminer").setLevel(logging.ERROR)
-
-try:
-    logging.getLogger("accelerate").setLevel(logging.WARNING)
-    logging.getLogger("transformers").setLevel(logging.WARNING)
-except Exception:
-    pass
-import warnings as _pywarnings
-_pywarnings.filterwarnings(
-    "ignore",
-    message=r"`prompt_attention_mask` is specified but `attention_mask` is not\\.",
-)
-
-warnings.filterwarnings(
-    "ignore",
-    message="Failed to load image Python extension*",
-    category=UserWarning,
-)
-
 try:
     from rag_utils import embedder, index, chunks
 except Exception as e:
     logger.error(f"Failed to import rag_utils components: {e}")
     embedder, index, chunks = None, None, None
 
+# Lightweight local TTS/STT helpers, imported once here rather than in request handlers
+# (their own heavy dependencies - pyttsx3, edge_tts, selenium - still load on first use)
+try:
+    from edge_local_tts_stt import (  # type: ignore
+        tts_edge_stream, speech_recognition_once, tts_local_basic, list_local_basic_voices,
+    )
+    _EDGE_LOCAL_AVAILABLE = True
+except Exception:
+    _EDGE_LOCAL_AVAILABLE = False
+
+# Retrieval (embedder.encode + index.search) runs on these shared workers; NumPy/FAISS
+# release the GIL, so the request thread can assemble the rest of the prompt meanwhile.
+# Threads rather than processes: every process would need its own embedder and index.
+_RAG_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get('RAG_WORKERS', str(os.cpu_count() or 4))),
+                               thread_name_prefix='rag')
+
+# With a SentenceTransformer loaded, concurrent queries are encoded and searched as one
+# batch: the first caller waits up to RAG_BATCH_WAIT_MS (or until RAG_BATCH_MAX queries are
+# waiting) and runs the batch for everyone. The hash embedder gains nothing from batching.
+RAG_BATCH_MAX = int(os.environ.get('RAG_BATCH_MAX', '16'))
+RAG_BATCH_WAIT_S = float(os.environ.get('RAG_BATCH_WAIT_MS', '5')) / 1000.0
+_RAG_PENDING = {}
+_RAG_COND = threading.Condition()
+
+# Query embeddings for recently asked prompts (whitespace-normalized), so repeated
+# questions skip the encoder. RAG_QUERY_CACHE_SIZE=0 disables it.
+PROMPT_EMB_CACHE = _LRUCache(int(os.environ.get('RAG_QUERY_CACHE_SIZE', '2048')))
+
+def _query_embeddings(prompts: list):
+    """``(N, D)`` float32 embeddings for ``prompts``; only cache misses are encoded."""
+    import numpy as np
+    keys = [" ".join(p.split()) for p in prompts]
+    rows = [PROMPT_EMB_CACHE.get(key) for key in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        fresh = embedder.encode([prompts[i] for i in missing])
+        for i, row in zip(missing, fresh):
+            row.flags.writeable = False  # shared between requests
+            rows[i] = row
+            PROMPT_EMB_CACHE.put(keys[i], row)
+    if len(rows) == 1:
+        return rows[0][np.newaxis, :]
+    return np.vstack(rows)
+
+def _rag_search(prompt: str, k: int = 3):
+    """Return ``(D, I)`` for the top-``k`` chunks matching ``prompt``."""
+    if RAG_BATCH_MAX <= 1 or getattr(embedder, '_model', None) is None:
+        return index.search(_query_embeddings([prompt]), k=k)
+    fut = Future()
+    with _RAG_COND:
+        items = _RAG_PENDING.setdefault(k, [])
+        items.append((prompt, fut))
+        leader = len(items) == 1
+        _RAG_COND.notify_all()
+        if leader:
+            _RAG_COND.wait_for(lambda: len(_RAG_PENDING[k]) >= RAG_BATCH_MAX, timeout=RAG_BATCH_WAIT_S)
+            items = _RAG_PENDING.pop(k)
+    if leader:
+        try:
+            D, I = index.search(_query_embeddings([p for p, _ in items]), k=k)
+        except BaseException as e:
+            for _, f in items:
+                f.set_exception(e)
+            raise
+        for row, (_, f) in enumerate(items):
+            f.set_result((D[row:row + 1], I[row:row + 1]))
+    return fut.result()
+
+@functools.cache
+def _warm_rag() -> None:
+    # Load the lazily imported embedder model and run one search so the index is paged in
+    # before the first real query; shared by the LLM and TTS preloads, whichever runs first
+    if embedder is None:
+        return
+    try:
+        if index is not None:
+            _rag_search("warmup", k=1)
+        else:
+            embedder.encode(["warmup"])
+        logger.info('RAG embedder warmed')
+    except Exception:
+        logger.exception('RAG embedder warmup failed')
+
+# Takes effect whenever rag_utils imports pdfplumber (and pdfminer) later; getLogger
+# does not import pdfminer itself
+logging.getLogger("pdfminer").setLevel(logging.ERROR)
+
 try:
     from db import _USING_IN_MEMORY_DB  # type: ignore
 except Exception:
     _USING_IN_MEMORY_DB = True
 
-try:
-    import torch  # noqa: F401
-    from transformers import (
-        AutoTokenizer,
-        AutoModelForCausalLM,
-        BitsAndBytesConfig,
-        TextIteratorStreamer,
-        StoppingCriteria,
-        StoppingCriteriaList,
-    )  # type: ignore
-    _TRANSFORMERS_AVAILABLE = True
-except Exception as _tx_err:
-    logger.warning(f"Transformers/torch not available, LLM disabled: {_tx_err}")
-    AutoTokenizer = AutoModelForCausalLM = BitsAndBytesConfig = None  # type: ignore
-    _TRANSFORMERS_AVAILABLE = False
-
-AssistantVoice = env_vars.get('AssistantVoice', '')
-InputLanguage = env_vars.get('InputLanguage', 'en')
+# torch/transformers are imported lazily by _get_llm(); only probe for them here
+_TRANSFORMERS_AVAILABLE = (
+    importlib.util.find_spec('torch') is not None
+    and importlib.util.find_spec('transformers') is not None
+)
+
+AssistantVoice = _env().get('AssistantVoice', '')
+InputLanguage = _env().get('InputLanguage', 'en')
 os.environ.setdefault('HF_HUB_OFFLINE', '1')
 MODEL_REPO = (
     os.environ.get('MODEL_REPO')
-    or env_vars.get('MODEL_REPO')
+    or _env().get('MODEL_REPO')
     or os.path.join(os.getcwd(), 'models', 'phi-3-mini-4k-instruct')
 )
 
 WELCOME_TRIGGER_TEXT = (
     os.environ.get('WELCOME_TRIGGER_TEXT')
-    or env_vars.get('WELCOME_TRIGGER_TEXT')
+    or _env().get('WELCOME_TRIGGER_TEXT')
     or "hello, i'm interested in learning about the namami gange programme."
 ).strip().lower()
 WELCOME_MESSAGE = (
     os.environ.get('WELCOME_MESSAGE')
-    or env_vars.get('WELCOME_MESSAGE')
+    or _env().get('WELCOME_MESSAGE')
     or (
         "Namaste! I’m ChaCha. I can help you explore the Namami Gange Programme — "
         "what it is, how it cleans the Ganga, real projects in cities, and simple ways you can help. "
         "Ask me anything, or say ‘give me a quick overview’."
     )
 )
-WELCOME_AUTOTTS = (os.environ.get('WELCOME_AUTOTTS') or env_vars.get('WELCOME_AUTOTTS') or '1').strip().lower() in ('1','true','yes')
+WELCOME_AUTOTTS = (os.environ.get('WELCOME_AUTOTTS') or _env().get('WELCOME_AUTOTTS') or '1').strip().lower() in ('1','true','yes')
+
+def _norm_trigger(s: str) -> str:
+    return ''.join(ch for ch in s.lower() if ch.isalnum() or ch.isspace()).strip()
+
+# The welcome reply is constant apart from latency_ms/audio_url, so it is built once
+_WELCOME_TRIGGER_NORM = _norm_trigger(WELCOME_TRIGGER_TEXT)
+_WELCOME_RESPONSE = {
+    "result": WELCOME_MESSAGE,
+    "retrieved_count": 0,
+    "rag_score": None,
+    "source": "general",
+    "temperature": 0.0,
+    "top_p": 1.0,
+    "used_max_new_tokens": 0,
+    "wants_long": False,
+    "llm_used": False,
+}
 
 DATA_DIR = os.path.join(os.getcwd(), 'Data')
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -231,6 +507,203 @@ def sanitize_text_for_tts(text: str) -> str:
     except Exception:
         return text
 
+# Content-addressed WAVs for repeated (engine, voice, text) syntheses; survives restarts.
+# Oldest-by-mtime files are evicted past TTS_DISK_CACHE_MAX files or TTS_DISK_CACHE_MAX_BYTES
+# in total (0 disables the cache).
+TTS_CACHE_DIR = os.path.join(DATA_DIR, 'tts_cache')
+TTS_DISK_CACHE_MAX = int(os.environ.get('TTS_DISK_CACHE_MAX', '500'))
+TTS_DISK_CACHE_MAX_BYTES = int(os.environ.get('TTS_DISK_CACHE_MAX_BYTES', str(500_000_000)))
+if TTS_DISK_CACHE_MAX > 0:
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+
+_TTS_BLANKS_RE = re.compile(r"[ \t\r\f\v]+")
+
+def _tts_text_key(text: str) -> bytes:
+    """Cache key for TTS input: texts differing only in runs of blanks or surrounding
+    whitespace synthesize to the same audio, so they share one entry. Newlines are kept
+    since Piper treats each line as a separate utterance."""
+    norm = _TTS_BLANKS_RE.sub(' ', str(text)).strip()
+    return hashlib.blake2b(norm.encode('utf-8'), digest_size=16).digest()
+
+def _evict_tts_cache() -> None:
+    try:
+        entries = [(e.stat(), e.path) for e in os.scandir(TTS_CACHE_DIR) if e.is_file()]
+        count = len(entries)
+        total = sum(st.st_size for st, _ in entries)
+        if count <= TTS_DISK_CACHE_MAX and total <= TTS_DISK_CACHE_MAX_BYTES:
+            return
+        entries.sort(key=lambda entry: entry[0].st_mtime)
+        for st, path in entries:
+            if count <= TTS_DISK_CACHE_MAX and total <= TTS_DISK_CACHE_MAX_BYTES:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            count -= 1
+            total -= st.st_size
+    except OSError:
+        logger.exception('TTS cache eviction failed')
+
+class _TTSDiskIndex:
+    """Request key -> cached audio (path, mimetype, headers) for /tts and /fast-tts, kept in
+    SQLite so result-cache hits survive restarts. The files themselves live in TTS_CACHE_DIR
+    under the eviction above; rows whose file is gone, or whose ttl has passed, read as misses."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, path TEXT NOT NULL, bytes INTEGER,'
+            ' mimetype TEXT, headers TEXT, created_at REAL, last_access REAL, ttl REAL)'
+        )
+
+    def get(self, key: str):
+        """``((path, mimetype, headers), created_at)`` for a live entry, else ``None``."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT path, mimetype, headers, created_at, ttl FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            path, mimetype, headers, created_at, ttl = row
+            if (ttl and created_at + ttl < now) or not os.path.exists(path):
+                self._db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            self._db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+        return (path, mimetype, json.loads(headers or '{}')), created_at
+
+    def put(self, key: str, path: str, mimetype: str, headers: dict, ttl: float = 0.0) -> None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO entries (key, path, bytes, mimetype, headers, created_at, last_access, ttl)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, path, size, mimetype, json.dumps(headers), now, now, ttl),
+            )
+
+    def clear(self) -> int:
+        """Drop every entry and its file; returns how many entries there were."""
+        with self._lock:
+            paths = [p for (p,) in self._db.execute('SELECT path FROM entries')]
+            self._db.execute('DELETE FROM entries')
+        for p in paths:
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+        return len(paths)
+
+# Entries older than TTS_CACHE_TTL_S seconds are resynthesized (0 keeps them until evicted)
+TTS_CACHE_TTL_S = float(os.environ.get('TTS_CACHE_TTL_S', '0'))
+
+# Opt-in (TTS_SEMANTIC_CACHE=1): reuse audio already synthesized for a near-identical text
+# (cosine >= TTS_SEMANTIC_THRESHOLD under the RAG embedder) instead of synthesizing again.
+# Off by default since the reused audio speaks the earlier wording, not the new one.
+TTS_SEMANTIC_CACHE = (os.environ.get('TTS_SEMANTIC_CACHE') or _env().get('TTS_SEMANTIC_CACHE') or '').strip().lower() in ('1', 'true', 'yes')
+TTS_SEMANTIC_THRESHOLD = float(os.environ.get('TTS_SEMANTIC_THRESHOLD', '0.93'))
+TTS_SEMANTIC_MAX = int(os.environ.get('TTS_SEMANTIC_MAX', '256'))
+
+class _SemanticAudioCache:
+    """Unit-length text embeddings per namespace (route, voice, lang, gender, ...) with the
+    cached audio each text produced. ``get`` returns the closest entry's payload when it
+    clears the threshold; each namespace keeps its newest ``maxsize`` entries."""
+
+    def __init__(self, threshold: float, maxsize: int, ttl: float = 0.0):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._spaces = {}  # namespace -> (vectors (n, d) float32, [(payload, added_at)])
+        self._lock = threading.Lock()
+
+    def get(self, namespace, vec):
+        with self._lock:
+            space = self._spaces.get(namespace)
+        if space is None:
+            return None
+        vecs, entries = space
+        if vecs.shape[1] != vec.shape[0]:
+            return None
+        sims = vecs @ vec
+        best = int(sims.argmax())
+        payload, added_at = entries[best]
+        if sims[best] < self.threshold or (self.ttl and added_at + self.ttl < time.time()):
+            return None
+        return payload
+
+    def add(self, namespace, vec, payload) -> None:
+        import numpy as np
+        with self._lock:
+            vecs, entries = self._spaces.get(namespace, (np.empty((0, vec.shape[0]), dtype=np.float32), []))
+            if vecs.shape[1] != vec.shape[0]:  # embedder changed (e.g. model loaded late)
+                vecs, entries = np.empty((0, vec.shape[0]), dtype=np.float32), []
+            # Rebuilt rather than appended in place, so concurrent readers keep a consistent pair
+            self._spaces[namespace] = (np.vstack((vecs, vec[None, :]))[-self.maxsize:],
+                                       (entries + [(payload, time.time())])[-self.maxsize:])
+
+_SEMANTIC_TTS = _SemanticAudioCache(TTS_SEMANTIC_THRESHOLD, TTS_SEMANTIC_MAX, TTS_CACHE_TTL_S)
+
+def _tts_embedding(text: str):
+    """Unit-length embedding of a TTS input for the semantic cache, or ``None``."""
+    if not TTS_SEMANTIC_CACHE or embedder is None:
+        return None
+    try:
+        return embedder.encode([sanitize_text_for_tts(text)])[0]
+    except Exception:
+        logger.exception('TTS semantic cache embedding failed')
+        return None
+
+@functools.cache
+def _tts_disk_index() -> _TTSDiskIndex | None:
+    if TTS_DISK_CACHE_MAX <= 0:
+        return None
+    try:
+        return _TTSDiskIndex(os.path.join(DATA_DIR, 'tts_cache.sqlite'))
+    except sqlite3.Error:
+        logger.exception('TTS cache index unavailable; result cache stays in memory')
+        return None
+
+def _tts_cache_path(engine: str, voice_key: str, text: str) -> str:
+    key = hashlib.sha256(f"{engine}\0{voice_key}\0".encode('utf-8') + _tts_text_key(text)).hexdigest()
+    return os.path.join(TTS_CACHE_DIR, key + '.wav')
+
+def _tts_cache_hit(cached: str) -> bool:
+    try:
+        os.utime(cached)  # hit: refresh mtime so eviction stays LRU
+        return True
+    except OSError:
+        return False
+
+def _tts_cache_store(tmp: str, cached: str) -> str:
+    """Move a finished synthesis into the disk cache; returns the path now holding it."""
+    try:
+        # Leave tiny/failed output uncached; _safe_send_file substitutes a fallback for it
+        if os.path.getsize(tmp) < 2000:
+            return tmp
+        os.replace(tmp, cached)
+    except OSError:
+        return tmp
+    _evict_tts_cache()
+    return cached
+
+def _cached_synthesis(engine: str, voice_key: str, text: str, synthesize) -> str:
+    """Return the cached WAV for ``(engine, voice_key, text)``; on a miss run
+    ``synthesize(path)`` into a temp file and move it into the cache atomically."""
+    if TTS_DISK_CACHE_MAX <= 0:
+        out_wav = unique_filename('speech', 'wav')
+        synthesize(out_wav)
+        return out_wav
+    cached = _tts_cache_path(engine, voice_key, text)
+    if _tts_cache_hit(cached):
+        return cached
+    tmp = unique_filename('speech', 'wav')
+    synthesize(tmp)
+    return _tts_cache_store(tmp, cached)
+
 def generate_tts_file(text: str, voice_id: str | None = None) -> str:
     engine_to_use = TTS_ENGINE
     if engine_to_use != 'piper':
@@ -243,14 +716,11 @@ def generate_tts_file(text: str, voice_id: str | None = None) -> str:
             engine_to_use = 'piper'
         else:
             logger.info(f"TTS_ENGINE '{TTS_ENGINE}' not supported and no Piper voices found — falling back to local-basic")
-            out_wav = unique_filename('speech', 'wav')
             try:
-                try:
-                    from edge_local_tts_stt import tts_local_basic
-                except Exception:
+                if not _EDGE_LOCAL_AVAILABLE:
                     raise RuntimeError('local-basic TTS helper not available')
-                tts_local_basic(text, out_path=out_wav, voice=voice_id)
-                return out_wav
+                return _cached_synthesis('local-basic', voice_id or '', text,
+                                         lambda out_wav: tts_local_basic(text, out_path=out_wav, voice=voice_id))
             except Exception as e:
                 logger.exception('local-basic fallback failed')
                 raise RuntimeError('No available TTS engine to synthesize audio') from e
@@ -259,24 +729,338 @@ def generate_tts_file(text: str, voice_id: str | None = None) -> str:
         voice = pick_indian_piper_voice(voice_id)
         if not voice:
             raise RuntimeError('No Piper voices found. Place voices in ' + PIPER_VOICES_DIR)
-        model_path = voice['paths']['model']
+        model_path = _piper_model_path(voice)
         config_path = voice['paths']['config']
-        out_wav = unique_filename('speech', 'wav')
-        synthesize_with_piper(PIPER_PATH, model_path, config_path, text, out_wav)
-        return out_wav
+        return _cached_synthesis('piper', model_path, text,
+                                 lambda out_wav: _piper_to_file(model_path, config_path, text, out_wav))
     raise RuntimeError('Failed to select TTS engine')
 
-
-def _safe_send_file(out_path: str, mimetype: str, engine_label: str, voice_id: str | None = None):
+def _prefill_tts_cache(texts, voice_id: str | None = None) -> None:
+    # Synthesize Piper disk-cache misses among ``texts`` together, loading the voice model
+    # once for the batch; failures are left for the per-text path
+    voice = pick_indian_piper_voice(voice_id) if TTS_DISK_CACHE_MAX > 0 and len(texts) > 1 else None
+    if voice:
+        model_path = _piper_model_path(voice)
+        config_path = voice['paths']['config']
+        pending = {}
+        for text in texts:
+            cached = _tts_cache_path('piper', model_path, text)
+            # Multi-line texts keep the plain-text path, where each line is its own utterance
+            if '\n' not in text and cached not in pending and not _tts_cache_hit(cached):
+                pending[cached] = (text, unique_filename('speech', 'wav'))
+        if len(pending) > 1:
+            try:
+                _piper_to_files(model_path, config_path, list(pending.values()))
+                for cached, (_, tmp) in pending.items():
+                    if _tts_cache_store(tmp, cached) == tmp:
+                        _remove_generated([tmp])
+            except Exception:
+                logger.exception('Batched Piper synthesis failed; synthesizing one at a time')
+                _remove_generated([tmp for _, tmp in pending.values()])
+
+def generate_tts_files(texts, voice_id: str | None = None) -> list[str]:
+    """``generate_tts_file`` for several texts. Piper disk-cache misses are synthesized
+    together, loading the voice model once for the batch."""
+    _prefill_tts_cache(texts, voice_id)
+    # Batched results are now disk-cache hits; anything left is synthesized individually
+    return [generate_tts_file(text, voice_id=voice_id) for text in texts]
+
+# Long replies are synthesized sentence by sentence on these workers and joined into one
+# WAV; each sentence goes through the disk cache, so sentences repeated across replies
+# (canned stories, greetings) are reused. TTS_SPLIT_MIN_CHARS=0 disables splitting.
+TTS_SENTENCE_WORKERS = int(os.environ.get('TTS_SENTENCE_WORKERS', '4'))
+TTS_SPLIT_MIN_CHARS = int(os.environ.get('TTS_SPLIT_MIN_CHARS', '300'))
+_TTS_SENTENCE_POOL = ThreadPoolExecutor(max_workers=max(1, TTS_SENTENCE_WORKERS), thread_name_prefix='tts-sentence')
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?।])\s+')
+
+def _join_wavs(paths, out_path: str) -> None:
+    import wave
+    with wave.open(out_path, 'wb') as out:
+        for n, path in enumerate(paths):
+            with wave.open(path, 'rb') as part:
+                if n == 0:
+                    out.setparams(part.getparams())
+                elif part.getparams()[:3] != out.getparams()[:3]:
+                    raise ValueError(f'WAV format mismatch in {path}')
+                out.writeframes(part.readframes(part.getnframes()))
+
+def _tts_voice_identity(voice_id: str | None) -> tuple[str, str]:
+    """``(engine, voice_key)`` that ``generate_tts_file`` resolves ``voice_id`` to: the Piper
+    model actually synthesized with (which changes on a voices rescan or TTS_QUANTIZE),
+    else local-basic with the raw id."""
     try:
-        if not out_path or not os.path.exists(out_path):
-            logger.error('TTS produced no file: %r', out_path)
-            return jsonify({'error': 'TTS produced no file', 'path': out_path}), 500
-        size = 0
+        piper_voices = get_piper_voices()
+    except Exception:
+        piper_voices = []
+    if piper_voices:
+        voice = pick_indian_piper_voice(voice_id)
+        if voice:
+            return 'piper', _piper_model_path(voice)
+    return 'local-basic', voice_id or ''
+
+def generate_tts_long(text: str, voice_id: str | None = None) -> str:
+    """``generate_tts_file`` for long replies: sentences are synthesized concurrently and
+    concatenated into a single (disk-cached) WAV. Short texts are synthesized whole."""
+    sentences = [p for p in _SENTENCE_SPLIT_RE.split(text.strip()) if p]
+    if not TTS_SPLIT_MIN_CHARS or len(text) <= TTS_SPLIT_MIN_CHARS or len(sentences) < 2:
+        return generate_tts_file(text, voice_id=voice_id)
+
+    engine, voice_key = _tts_voice_identity(voice_id)
+
+    def synthesize(out_wav):
+        if engine == 'piper':
+            parts = list(_TTS_SENTENCE_POOL.map(lambda p: generate_tts_file(p, voice_id=voice_id), sentences))
+        else:
+            # pyttsx3 shares one engine per process; local-basic stays sequential
+            parts = [generate_tts_file(p, voice_id=voice_id) for p in sentences]
+        try:
+            _join_wavs(parts, out_wav)
+        finally:
+            _remove_generated(parts)  # per-request files only; cached sentences stay
+    # Keyed like the sentences it joins, so it is not reused once the voice resolves differently
+    return _cached_synthesis('sentences', f"{engine}\0{voice_key}", text, synthesize)
+
+# /llama-chat replies are voiced in the background: the JSON carries a pending audio URL
+# (``pending/<id>.wav``) right away and /generated_audio waits up to AUTOTTS_WAIT_S for the
+# synthesis behind it. Resolved ids are forgotten by the audio janitor after
+# TTS_JANITOR_MAX_AGE_S (or 10 min). Pending ids live in one process, so with several
+# gunicorn workers (GUNICORN_WORKERS > 1) a poll could land on a worker that never saw the
+# id; replies are then voiced before responding instead.
+AUTOTTS_ASYNC = (
+    os.environ.get('AUTOTTS_ASYNC', '1').strip().lower() not in ('0', 'false', 'no')
+    and int(os.environ.get('GUNICORN_WORKERS', '1')) <= 1
+)
+AUTOTTS_WAIT_S = float(os.environ.get('AUTOTTS_WAIT_S', '30'))
+_AUTOTTS_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix='autotts')
+_PENDING_AUDIO: dict = {}  # 'pending/<id>.wav' -> Future resolving to the WAV path
+_PENDING_DONE_AT: dict = {}  # 'pending/<id>.wav' -> time.monotonic() when its Future finished
+
+def _reply_audio(tts_text: str, voice_id: str | None, vec) -> str:
+    """WAV path for an assistant reply, reusing a semantically cached one when possible."""
+    namespace = ('autotts',) + _tts_voice_identity(voice_id) if vec is not None else None
+    wav_path = _SEMANTIC_TTS.get(namespace, vec) if vec is not None else None
+    if wav_path and os.path.exists(wav_path):
+        return wav_path
+    wav_path = generate_tts_long(tts_text, voice_id=voice_id)
+    # Only disk-cache files persist; per-request files are swept after use
+    if vec is not None and os.path.dirname(os.path.abspath(wav_path)) == os.path.abspath(TTS_CACHE_DIR):
+        _SEMANTIC_TTS.add(namespace, vec, wav_path)
+    return wav_path
+
+def _submit_reply_audio(tts_text: str, voice_id: str | None, vec) -> str:
+    """Start ``_reply_audio`` on the autotts workers; returns the pending name to serve."""
+    name = f"pending/{uuid.uuid4().hex}.wav"
+    fut = _PENDING_AUDIO[name] = _AUTOTTS_POOL.submit(_reply_audio, tts_text, voice_id, vec)
+    fut.add_done_callback(lambda _fut: _PENDING_DONE_AT.__setitem__(name, time.monotonic()))
+    return name
+
+def _prune_pending_audio() -> None:
+    cutoff = time.monotonic() - (TTS_JANITOR_MAX_AGE_S or 600.0)
+    for name, done_at in list(_PENDING_DONE_AT.items()):
+        if done_at < cutoff:
+            _PENDING_AUDIO.pop(name, None)
+            _PENDING_DONE_AT.pop(name, None)
+
+def _piper_wav_bytes(text: str, voice_id: str | None = None) -> bytes | None:
+    """Piper synthesis straight to WAV bytes (raw PCM, no output file), or
+    ``None`` without Piper voices. For when there is no disk cache to fill."""
+    voice = pick_indian_piper_voice(voice_id)
+    if not voice:
+        return None
+    config_path = voice['paths']['config']
+    pcm = b''.join(_piper_stream(_piper_model_path(voice), config_path, text))
+    return convert_to_wav_headered(pcm, 16, piper_sample_rate(config_path))
+
+# /tts synthesis runs on one worker thread, like the LLM: requests wait on a Future for up
+# to TTS_QUEUE_TIMEOUT seconds and get a 503 once TTS_QUEUE_MAX are queued or running.
+# Requests arriving within TTS_BATCH_WAIT_MS of each other are synthesized as one batch.
+_TTS_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts')
+TTS_QUEUE_MAX = int(os.environ.get('TTS_QUEUE_MAX', '32'))
+TTS_QUEUE_TIMEOUT = float(os.environ.get('TTS_QUEUE_TIMEOUT', '20'))
+TTS_BATCH_MAX = 8
+TTS_BATCH_WAIT_S = float(os.environ.get('TTS_BATCH_WAIT_MS', '5')) / 1000.0
+_TTS_LOCK = threading.Lock()
+_TTS_PENDING: list = []  # (text, voice_id, future, submitted_at)
+_TTS_OUTSTANDING = 0
+
+def _synthesize_tts(text: str, voice_id: str | None) -> bytes | str:
+    # In memory when there is no disk cache to fill (falling back to a file for tiny or
+    # failed output, where _safe_send_file substitutes a fallback); else the cached file
+    if TTS_DISK_CACHE_MAX <= 0:
         try:
-            size = os.path.getsize(out_path)
+            wav = _piper_wav_bytes(text, voice_id)
         except Exception:
-            size = 0
+            logger.exception('In-memory Piper synthesis failed; using the file path')
+            wav = None
+        if wav is not None and len(wav) >= 2000:
+            return wav
+    return generate_tts_file(text, voice_id=voice_id)
+
+def _run_tts_batch():
+    # Runs on the TTS worker; exactly one such job is queued while _TTS_PENDING is non-empty
+    with _TTS_LOCK:
+        first_at = _TTS_PENDING[0][3] if _TTS_PENDING else 0.0
+        full = len(_TTS_PENDING) >= TTS_BATCH_MAX
+    if not full:
+        time.sleep(max(0.0, first_at + TTS_BATCH_WAIT_S - time.monotonic()))
+    with _TTS_LOCK:
+        items = _TTS_PENDING[:TTS_BATCH_MAX]
+        del _TTS_PENDING[:TTS_BATCH_MAX]
+        if _TTS_PENDING:
+            _TTS_POOL.submit(_run_tts_batch)
+    by_voice = {}
+    for text, voice_id, fut, _ in items:
+        if fut.set_running_or_notify_cancel():
+            by_voice.setdefault(voice_id, []).append((text, fut))
+    for voice_id, group in by_voice.items():
+        if len(group) > 1:
+            _prefill_tts_cache([text for text, _ in group], voice_id)
+        for text, fut in group:
+            try:
+                fut.set_result(_synthesize_tts(text, voice_id))
+            except BaseException as e:
+                fut.set_exception(e)
+
+def _tts_done(_fut):
+    global _TTS_OUTSTANDING
+    with _TTS_LOCK:
+        _TTS_OUTSTANDING -= 1
+
+def _submit_tts(text: str, voice_id: str | None = None) -> Future | None:
+    """Queue ``text`` for the TTS worker. The Future resolves to WAV bytes or a file path
+    for ``_safe_send_file``; ``None`` means the queue is full."""
+    global _TTS_OUTSTANDING
+    fut = Future()
+    with _TTS_LOCK:
+        if _TTS_OUTSTANDING >= TTS_QUEUE_MAX:
+            return None
+        _TTS_OUTSTANDING += 1
+        _TTS_PENDING.append((text, voice_id, fut, time.monotonic()))
+        if len(_TTS_PENDING) == 1:
+            _TTS_POOL.submit(_run_tts_batch)
+    fut.add_done_callback(_tts_done)
+    return fut
+
+# Offline transcription of uploaded audio for /stt: one faster-whisper (CTranslate2) model,
+# int8 by default, stays resident; its bundled Silero VAD skips silence before decoding
+STT_WHISPER_MODEL = os.environ.get('STT_WHISPER_MODEL') or _env().get('STT_WHISPER_MODEL') or 'small'
+STT_COMPUTE_TYPE = (os.environ.get('STT_COMPUTE_TYPE') or _env().get('STT_COMPUTE_TYPE') or '').strip()
+_WHISPER_AVAILABLE = importlib.util.find_spec('faster_whisper') is not None
+_WHISPER_LOCK = threading.Lock()
+_WHISPER_MODEL = None
+
+def _get_whisper():
+    """The faster-whisper model, loaded on first use (concurrent callers wait for it);
+    ``None`` when the package or model is unavailable. Only a successful load is kept,
+    so a transient failure is retried on the next call."""
+    global _WHISPER_MODEL
+    with _WHISPER_LOCK:
+        if _WHISPER_MODEL is None:
+            _WHISPER_MODEL = _load_whisper()
+        return _WHISPER_MODEL
+
+def _load_whisper():
+    if not _WHISPER_AVAILABLE:
+        return None
+    try:
+        import ctranslate2
+        from faster_whisper import WhisperModel
+        cuda = ctranslate2.get_cuda_device_count() > 0
+        compute_type = STT_COMPUTE_TYPE or ('int8_float16' if cuda else 'int8')
+        t0 = time.time()
+        model = WhisperModel(STT_WHISPER_MODEL, device='cuda' if cuda else 'cpu', compute_type=compute_type)
+        logger.info(f"Loaded faster-whisper '{STT_WHISPER_MODEL}' ({compute_type}) in {time.time() - t0:.1f}s")
+        return model
+    except Exception:
+        logger.exception(f"Failed to load faster-whisper model '{STT_WHISPER_MODEL}'")
+        return None
+
+def _generated_audio_url(wav_path: str) -> str:
+    # Disk-cached syntheses live in DATA_DIR/tts_cache; /generated_audio serves paths under DATA_DIR
+    rel = os.path.relpath(os.path.abspath(wav_path), os.path.abspath(DATA_DIR))
+    return "/generated_audio/" + rel.replace(os.sep, '/')
+
+
+def _remove_generated(paths) -> None:
+    """Delete per-request audio files under DATA_DIR; anything else (bundled samples) is kept."""
+    for p in paths:
+        try:
+            if p and os.path.dirname(os.path.abspath(p)) == os.path.abspath(DATA_DIR):
+                os.remove(p)
+        except OSError:
+            pass
+
+
+# Grace period before a sent TTS file is deleted. send_file() streams from the path
+# (possibly via sendfile) and Response.call_on_close is skipped for such passthrough
+# responses, so removal is scheduled on a timer rather than tied to the response.
+TTS_FILE_TTL_S = float(os.environ.get('TTS_FILE_TTL_S', '60'))
+
+def _schedule_removal(paths) -> None:
+    timer = threading.Timer(TTS_FILE_TTL_S, _remove_generated, args=(tuple(paths),))
+    timer.daemon = True
+    timer.start()
+
+# Safety net for per-request audio nothing else deletes (e.g. files linked through
+# /generated_audio): speech_* files in DATA_DIR older than TTS_JANITOR_MAX_AGE_S are swept
+# periodically. 0 disables the sweep.
+TTS_JANITOR_MAX_AGE_S = float(os.environ.get('TTS_JANITOR_MAX_AGE_S', '600'))
+
+def _sweep_generated_audio() -> None:
+    cutoff = time.time() - TTS_JANITOR_MAX_AGE_S
+    try:
+        with os.scandir(DATA_DIR) as entries:
+            stale = [e.path for e in entries
+                     if e.name.startswith('speech_') and e.is_file() and e.stat().st_mtime < cutoff]
+    except OSError:
+        return
+    _remove_generated(stale)
+
+@functools.cache
+def _start_audio_janitor() -> None:
+    """Start the periodic sweep of stale audio files and resolved pending-audio ids. Threads
+    do not survive a fork, so this runs per worker (gunicorn.conf.py) or from ``__main__``."""
+    if TTS_JANITOR_MAX_AGE_S <= 0 and not AUTOTTS_ASYNC:
+        return
+
+    def loop():
+        while True:
+            time.sleep(min(TTS_JANITOR_MAX_AGE_S or 600.0, 300.0))
+            if TTS_JANITOR_MAX_AGE_S > 0:
+                _sweep_generated_audio()
+            _prune_pending_audio()
+
+    threading.Thread(target=loop, name='audio-janitor', daemon=True).start()
+
+
+def _safe_send_file(out_path: str | bytes, mimetype: str, engine_label: str, voice_id: str | None = None, cleanup=(),
+                    size: int | None = None):
+    """Send synthesized audio with sanity checks. ``out_path`` is a file, or the audio bytes
+    themselves when it was produced in memory (sent without touching the disk). The file and
+    any intermediate ``cleanup`` files in DATA_DIR are deleted ``TTS_FILE_TTL_S`` seconds
+    later. Callers that already know the file's ``size`` pass it to skip the stat."""
+    try:
+        if isinstance(out_path, bytes):
+            size = len(out_path)
+            if size >= 2000:
+                resp = send_file(io.BytesIO(out_path), mimetype=mimetype, as_attachment=False,
+                                 download_name='speech.mp3' if 'mpeg' in mimetype else 'speech.wav')
+                _schedule_removal(cleanup)
+                g.tts_output = (out_path, mimetype)
+                if voice_id is not None:
+                    resp.headers['X-Voice-Used'] = (voice_id or '')
+                resp.headers['X-TTS-Engine'] = engine_label
+                resp.headers['X-Generated-File-Size'] = str(size)
+                return resp
+            out_path = None  # too small: the checks below send the bundled sample instead
+        if not size:
+            try:
+                size = os.stat(out_path).st_size if out_path else None
+            except OSError:
+                size = None
+            if size is None:
+                logger.error('TTS produced no file: %r', out_path)
+                return jsonify({'error': 'TTS produced no file', 'path': out_path}), 500
         if size == 0:
             logger.error('TTS produced empty file: %r', out_path)
             sample = os.path.join(os.getcwd(), 'frontend', 'public', 'assets', 'chacha-cahaudhary', 'Greeting.wav')
@@ -303,7 +1087,9 @@ def _safe_send_file(out_path: str, mimetype: str, engine_label: str, voice_id: s
                     pass
                 return resp
             return jsonify({'error': 'TTS produced too-small audio', 'path': out_path, 'size': size}), 500
-        resp = send_file(out_path, mimetype=mimetype, as_attachment=False)
+        resp = send_file(out_path, mimetype=mimetype, as_attachment=False, conditional=True)
+        _schedule_removal((out_path, *cleanup))
+        g.tts_output = (out_path, mimetype)
         try:
             if voice_id is not None:
                 resp.headers['X-Voice-Used'] = (voice_id or '')
@@ -316,17 +1102,38 @@ def _safe_send_file(out_path: str, mimetype: str, engine_label: str, voice_id: s
         logger.exception('Failed to send generated audio')
         return jsonify({'error': 'failed to send audio', 'details': str(e)}), 500
 
-def convert_to_wav_headered(audio_data: bytes, bits_per_sample: int = 16, rate: int = 24000) -> bytes:
+def _stream_edge_tts(text: str, voice_id: str | None = None):
+    """Stream edge-tts MP3 bytes straight to the client instead of saving and converting a file.
+    Raises before a response is built if synthesis fails, so callers can fall through."""
+    if not _EDGE_LOCAL_AVAILABLE:
+        raise RuntimeError('edge-tts helper not available')
+    chunks = tts_edge_stream(text, voice=voice_id)
+    first = next(chunks, b'')
+    if not first:
+        raise RuntimeError('edge-tts produced no audio')
+
+    def body():
+        yield first
+        yield from chunks
+
+    resp = Response(body(), mimetype='audio/mpeg')
+    g.tts_streamed = True
+    resp.headers['X-TTS-Engine'] = 'edge-tts'
+    if voice_id is not None:
+        resp.headers['X-Voice-Used'] = voice_id or ''
+    return resp
+
+@functools.lru_cache(maxsize=8)
+def _wav_header_template(bits_per_sample: int, rate: int) -> bytes:
+    """44-byte mono PCM RIFF header with zeroed RIFF/data sizes, patched per call."""
     num_channels = 1
-    data_size = len(audio_data)
     bytes_per_sample = bits_per_sample // 8
     block_align = num_channels * bytes_per_sample
     byte_rate = rate * block_align
-    chunk_size = 36 + data_size
-    header = struct.pack(
+    return struct.pack(
         '<4sI4s4sIHHIIHH4sI',
         b'RIFF',
-        chunk_size,
+        0,
         b'WAVE',
         b'fmt ',
         16,
@@ -337,9 +1144,51 @@ def convert_to_wav_headered(audio_data: bytes, bits_per_sample: int = 16, rate:
         block_align,
         bits_per_sample,
         b'data',
-        data_size,
+        0,
     )
-    return header + audio_data
+
+
+_U32LE = struct.Struct('<I')  # RIFF/data size fields, patched at offsets 4 and 40
+
+
+def _wav_header(data_size: int, bits_per_sample: int, rate: int) -> bytearray:
+    header = bytearray(_wav_header_template(bits_per_sample, rate))
+    _U32LE.pack_into(header, 4, 36 + data_size)
+    _U32LE.pack_into(header, 40, data_size)
+    return header
+
+
+def convert_to_wav_headered(audio_data: bytes, bits_per_sample: int = 16, rate: int = 24000) -> bytes:
+    return b''.join((_wav_header(len(audio_data), bits_per_sample, rate), audio_data))
+
+
+def _streaming_wav_header(bits_per_sample: int, rate: int) -> bytes:
+    # Length unknown up front: max out the RIFF/data sizes, as players expect for live streams
+    header = bytearray(_wav_header_template(bits_per_sample, rate))
+    _U32LE.pack_into(header, 4, 0xFFFFFFFF)
+    _U32LE.pack_into(header, 40, 0xFFFFFFFF)
+    return bytes(header)
+
+
+def write_wav_headered(path: str, audio_data, bits_per_sample: int = 16, rate: int = 24000) -> str:
+    """Write raw PCM ``audio_data`` (any bytes-like) to ``path`` as a WAV file without first
+    joining header and payload into one buffer; a single writev where the OS has it."""
+    payload = memoryview(audio_data).cast('B')
+    header = _wav_header(len(payload), bits_per_sample, rate)
+    with open(path, 'wb') as fh:
+        if not hasattr(os, 'writev'):
+            fh.write(header)
+            fh.write(payload)
+            return path
+        bufs = [memoryview(header), payload]
+        while bufs:
+            n = os.writev(fh.fileno(), bufs)
+            while bufs and n >= len(bufs[0]):
+                n -= len(bufs[0])
+                bufs.pop(0)
+            if bufs:
+                bufs[0] = bufs[0][n:]
+    return path
 
 
 def convert_to_wav_file(src_path: str) -> str:
@@ -349,6 +1198,21 @@ def convert_to_wav_file(src_path: str) -> str:
         if src_path.lower().endswith('.wav'):
             return src_path
         dst = unique_filename('speech', 'wav')
+        try:
+            # Decode in-process (MP3/FLAC/Vorbis): pydub and the CLI both spawn ffmpeg per file
+            import miniaudio  # type: ignore
+            info = miniaudio.get_file_info(src_path)
+            decoded = miniaudio.decode_file(src_path, output_format=miniaudio.SampleFormat.SIGNED16,
+                                            nchannels=1, sample_rate=info.sample_rate)
+            write_wav_headered(dst, decoded.samples, 16, decoded.sample_rate)
+            logger.info('Converted %s to WAV via miniaudio -> %s', src_path, dst)
+            return dst
+        except ImportError:
+            pass
+        except Exception:
+            logger.info('miniaudio decode failed; trying pydub')
+        if FFMPEG is None:
+            raise RuntimeError('Failed to convert audio to WAV: in-process decode failed and ffmpeg not found')
         try:
             from pydub import AudioSegment  # type: ignore
             aud = AudioSegment.from_file(src_path)
@@ -358,7 +1222,8 @@ def convert_to_wav_file(src_path: str) -> str:
         except Exception:
             logger.info('pydub convert to WAV failed; trying ffmpeg CLI')
         try:
-            cmd = ['ffmpeg', '-y', '-i', src_path, dst]
+            import subprocess
+            cmd = [FFMPEG, '-y', '-i', src_path, dst]
             subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             logger.info('Converted %s to WAV via ffmpeg -> %s', src_path, dst)
             return dst
@@ -369,155 +1234,1196 @@ def convert_to_wav_file(src_path: str) -> str:
         logger.exception('convert_to_wav_file failed')
         raise
 
+FFMPEG = os.environ.get('FFMPEG_PATH') or _env().get('FFMPEG_PATH') or shutil.which('ffmpeg')
+FFPROBE = shutil.which('ffprobe')
+_SAMPLE_RATES: dict = {}
+
+@functools.cache
+def _pydub_status() -> dict:
+    """pydub/ffmpeg availability for /tts-diagnostic, probed once per process."""
+    try:
+        from pydub import AudioSegment  # type: ignore
+    except Exception as e:
+        return {'pydub_available': False, 'pydub_error': str(e)}
+    info = {'pydub_available': True}
+    try:
+        ff = AudioSegment.converter
+        info['ffmpeg_path'] = ff
+        info['ffmpeg_available'] = bool(ff and (os.path.exists(ff) or shutil.which(ff)))
+    except Exception:
+        info['ffmpeg_path'] = None
+        info['ffmpeg_available'] = False
+    return info
+
+def _audio_sample_rate(src, key: str) -> int:
+    """Sample rate of ``src`` (a file path or encoded mp3 bytes), probed once per ``key``
+    (engine/voice output is fixed-rate)."""
+    sr = _SAMPLE_RATES.get(key)
+    if sr:
+        return sr
+    try:
+        import miniaudio  # type: ignore
+        sr = miniaudio.get_file_info(src).sample_rate if isinstance(src, str) else miniaudio.mp3_get_info(src).sample_rate
+    except Exception:
+        if not FFPROBE:
+            raise RuntimeError('Cannot read sample rate: miniaudio failed and ffprobe not found')
+        import subprocess
+        out = subprocess.run([FFPROBE, '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=sample_rate',
+                              '-of', 'default=noprint_wrappers=1:nokey=1', src if isinstance(src, str) else 'pipe:0'],
+                             input=None if isinstance(src, str) else src,
+                             check=True, capture_output=True, timeout=10).stdout
+        sr = int(out.split()[0])
+    _SAMPLE_RATES[key] = sr
+    return sr
+
+# torchaudio is only probed here; it is imported when a pitch shift is first requested
+_TORCHAUDIO_AVAILABLE = importlib.util.find_spec('torchaudio') is not None
+
+def _pitch_shift_wav(data: bytes, key: str, pitch_factor: float) -> bytes:
+    """Pitch-shift mp3 ``data`` by ``pitch_factor`` in-process: miniaudio decode, then
+    torchaudio's phase-vocoder pitch_shift (tempo unchanged) at cent resolution."""
+    import miniaudio  # type: ignore
+    import numpy as np
+    import torch
+    import torchaudio.functional as AF  # type: ignore
+    sr = _audio_sample_rate(data, key)
+    decoded = miniaudio.decode(data, output_format=miniaudio.SampleFormat.SIGNED16, nchannels=1, sample_rate=sr)
+    samples = torch.from_numpy(np.frombuffer(decoded.samples, dtype=np.int16).astype(np.float32) / 32768.0)
+    with torch.inference_mode():
+        shifted = AF.pitch_shift(samples.unsqueeze(0), sr, round(1200 * math.log2(pitch_factor)), bins_per_octave=1200)
+    pcm = (shifted[0].clamp(-1.0, 1.0) * 32767.0).to(torch.int16).numpy().tobytes()
+    return convert_to_wav_headered(pcm, 16, sr)
+
+def encoded_audio_to_wav(data: bytes, key: str, pitch_factor: float | None = None) -> bytes:
+    """Decode mp3 ``data`` to mono WAV bytes in memory, without touching the disk.
+    ``pitch_factor`` lowers the pitch (tempo unchanged), with torchaudio when installed,
+    else in the same ffmpeg pass."""
+    if pitch_factor and _TORCHAUDIO_AVAILABLE:
+        try:
+            return _pitch_shift_wav(data, key, pitch_factor)
+        except Exception:
+            logger.info('torchaudio pitch shift failed; trying ffmpeg')
+    if not pitch_factor:
+        try:
+            import miniaudio  # type: ignore
+            decoded = miniaudio.decode(data, output_format=miniaudio.SampleFormat.SIGNED16, nchannels=1,
+                                       sample_rate=_audio_sample_rate(data, key))
+            return convert_to_wav_headered(decoded.samples.tobytes(), 16, decoded.sample_rate)
+        except ImportError:
+            pass
+        except Exception:
+            logger.info('miniaudio decode failed; trying ffmpeg')
+    if not FFMPEG:
+        raise RuntimeError('ffmpeg not found; cannot decode audio')
+    import subprocess
+    cmd = [FFMPEG, '-loglevel', 'error', '-i', 'pipe:0']
+    if pitch_factor:
+        sr = _audio_sample_rate(data, key)
+        cmd += ['-af', f'asetrate={int(sr * pitch_factor)},aresample={sr},atempo={1 / pitch_factor:.6f}']
+    cmd += ['-ac', '1', '-f', 'wav', 'pipe:1']
+    return subprocess.run(cmd, input=data, check=True, capture_output=True, timeout=10).stdout
+
+def _gtts_render(text: str, lang: str, pitch_factor: float | None) -> tuple[bytes, str, bool]:
+    """gTTS mp3 decoded to WAV in memory: ``(audio, mimetype, exact)``, where ``exact`` is
+    False when a fallback (unshifted pitch, or the raw mp3) was returned instead."""
+    from gtts import gTTS  # type: ignore
+    key = 'gtts-' + lang
+    buf = io.BytesIO()
+    gTTS(text, lang=lang).write_to_fp(buf)
+    data = buf.getvalue()
+    if pitch_factor:
+        try:
+            wav = encoded_audio_to_wav(data, key, pitch_factor)
+            logger.info('Applied pitch-lowering to approximate male voice')
+            return wav, 'audio/wav', True
+        except Exception:
+            logger.exception('Failed to apply pitch-lowering postprocess; returning original gTTS audio')
+    try:
+        return encoded_audio_to_wav(data, key), 'audio/wav', not pitch_factor
+    except Exception:
+        logger.exception('gTTS WAV conversion failed; serving mp3')
+    return data, 'audio/mpeg', False
+
+def gtts_audio(text: str, lang: str, pitch_factor: float | None = None) -> tuple[str | bytes, str]:
+    """gTTS synthesis of ``text`` as ``(audio, mimetype)``. The decoded WAV is kept in the
+    disk cache per (lang, pitch, text), so a repeated phrase is neither fetched from Google
+    nor decoded again and ``audio`` is the cached path; otherwise it is the bytes (WAV, or
+    the mp3 when it could not be decoded)."""
+    voice_key = f"{lang}:{pitch_factor or 1}"
+    cached = _tts_cache_path('gtts', voice_key, text) if TTS_DISK_CACHE_MAX > 0 else None
+    if cached and _tts_cache_hit(cached):
+        return cached, 'audio/wav'
+    audio, mimetype, exact = _gtts_render(text, lang, pitch_factor)
+    if cached and exact:
+        tmp = unique_filename('speech', 'wav')
+        try:
+            with open(tmp, 'wb') as fh:
+                fh.write(audio)
+        except OSError:
+            return audio, mimetype
+        return _tts_cache_store(tmp, cached), mimetype
+    return audio, mimetype
+
 tokenizer = None
 llm = None
 _LLM_DEVICE = "cpu"
-logger.info('Initializing LLM (optional)...')
-if os.environ.get('SKIP_LLM_LOAD', env_vars.get('SKIP_LLM_LOAD', '')).strip() not in ('1', 'true', 'yes'):
+_LLM_CONTEXT_TOKENS = 0
+_LLM_COMPILED = False
+_LLM_QUANTIZATION = None
+_llm_loaded = False
+SKIP_LLM_LOAD = os.environ.get('SKIP_LLM_LOAD', _env().get('SKIP_LLM_LOAD', '')).strip() in ('1', 'true', 'yes')
+_LLM_LOCK = threading.Lock()
+
+
+def _weights_kwargs(repo_path: str) -> dict:
+    """``from_pretrained`` kwargs for the checkpoint format in a local model folder.
+    Safetensors shards are memory-mapped and copied tensor by tensor onto their device;
+    pickled .bin shards are read whole into RAM first."""
     try:
-        if _TRANSFORMERS_AVAILABLE:
-            local_only_flag = (os.environ.get('MODEL_REPO_LOCAL_ONLY') or env_vars.get('MODEL_REPO_LOCAL_ONLY') or '').strip().lower()
-            model_repo_local_only = local_only_flag in ('1', 'true', 'yes')
+        names = os.listdir(repo_path)
+    except OSError:
+        return {}  # hub id: let transformers pick
+    if any(n.endswith('.safetensors') for n in names):
+        return {'use_safetensors': True}
+    if any(n.endswith('.bin') for n in names):
+        logger.warning('%s has only .bin weights; convert once with tools/convert_to_safetensors.py for faster loads', repo_path)
+    return {}
+
+def _prequantized_method(repo_path: str) -> str | None:
+    """``'gptq'``/``'awq'`` when the local model folder is an int4 export (its config.json
+    carries a ``quantization_config``); transformers then loads it with fused int4 kernels."""
+    try:
+        with open(os.path.join(repo_path, 'config.json'), 'r', encoding='utf-8') as f:
+            method = (json.load(f).get('quantization_config') or {}).get('quant_method')
+    except (OSError, ValueError, AttributeError):
+        return None
+    return method if method in ('gptq', 'awq') else None
+
+def _attn_kwargs(has_cuda: bool = False) -> dict:
+    """``attn_implementation`` for ``from_pretrained``. ``LLAMA_ATTN_IMPL`` may name one
+    explicitly (``eager``, ``sdpa``, ``flash_attention_2``). Left unset, FlashAttention-2 is
+    used on Ampere+ GPUs with the ``flash_attn`` package installed, and otherwise transformers'
+    fused ``scaled_dot_product_attention`` kernels for models that support them."""
+    impl = (os.environ.get('LLAMA_ATTN_IMPL') or _env().get('LLAMA_ATTN_IMPL') or '').strip().lower()
+    if not impl and has_cuda and importlib.util.find_spec('flash_attn') is not None:
+        try:
+            import torch
+            if torch.cuda.get_device_capability()[0] >= 8:
+                impl = 'flash_attention_2'
+        except Exception:
+            pass
+    return {'attn_implementation': impl} if impl else {}
+
+def _load_with_attn_fallback(load, attn_kw: dict):
+    """Run ``load(attn_kw)``; if FlashAttention-2 is rejected (fp32 weights, an unsupported
+    architecture or GPU), load again on the SDPA kernels rather than failing over to CPU."""
+    try:
+        return load(attn_kw)
+    except Exception:
+        if attn_kw.get('attn_implementation') != 'flash_attention_2':
+            raise
+        logger.exception('FlashAttention-2 load failed; retrying with SDPA attention')
+        return load({'attn_implementation': 'sdpa'})
+
+_DTYPE_NAMES = {'bf16': 'bfloat16', 'bfloat16': 'bfloat16', 'fp16': 'float16', 'float16': 'float16',
+                'half': 'float16', 'fp32': 'float32', 'float32': 'float32'}
+
+def _dtype_kwargs(has_cuda: bool) -> dict:
+    """``torch_dtype`` for the standard load. ``LLAMA_DTYPE`` (bf16/fp16/fp32) overrides the
+    default of fp16 on CUDA and fp32 on CPU; bf16 on CPU halves the weight bytes streamed per
+    decode step and runs natively on AVX512-BF16/AMX, in place of dynamic int8."""
+    import torch
+    name = _DTYPE_NAMES.get((os.environ.get('LLAMA_DTYPE') or _env().get('LLAMA_DTYPE') or '').strip().lower())
+    if name:
+        return {'torch_dtype': getattr(torch, name)}
+    return {'torch_dtype': torch.float16} if has_cuda else {}
+
+def _bnb_compute_dtype():
+    """Compute dtype for the 4-bit load: ``LLAMA_DTYPE`` when set, else bf16 on GPUs that
+    support it (Ampere+; no fp16 overflow in the NF4 dequant matmuls) and fp16 before that."""
+    import torch
+    name = _DTYPE_NAMES.get((os.environ.get('LLAMA_DTYPE') or _env().get('LLAMA_DTYPE') or '').strip().lower())
+    if name:
+        return getattr(torch, name)
+    return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+
+@functools.cache
+def _get_llm():
+    """Import torch/transformers and load the local model on first use.
+
+    Keeping this out of module import lets ``/health``, ``/tts`` and ``/stt``
+    serve immediately; ``/llama-chat`` (or ``POST /warmup``) pays the load once.
+    Returns ``(tokenizer, llm)``, both ``None`` when the LLM is unavailable.
+    """
+    global tokenizer, llm, _LLM_DEVICE, _LLM_CONTEXT_TOKENS, _LLM_COMPILED, _LLM_QUANTIZATION, _llm_loaded, _TRANSFORMERS_AVAILABLE
+    with _LLM_LOCK:
+        if _llm_loaded:
+            return tokenizer, llm
+        if SKIP_LLM_LOAD:
+            logger.info('SKIP_LLM_LOAD set — skipping LLM initialization')
+            return None, None
+        if LLAMA_SERVER_URL:
+            logger.info('LLAMA_SERVER_URL set — generating on %s; local LLM not loaded', LLAMA_SERVER_URL)
+            return None, None
+        if LLAMA_GGUF:
+            _llm_loaded = _gguf_llm() is not None
+            if _llm_loaded:
+                _LLM_QUANTIZATION = 'gguf'
+                _LLM_DEVICE = 'cuda' if LLAMA_GGUF_GPU_LAYERS and _gguf_gpu_offload() else 'cpu'
+            return None, None
+        logger.info('Initializing LLM (optional)...')
+        try:
+            if _TRANSFORMERS_AVAILABLE:
+                try:
+                    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig  # type: ignore
+                except Exception as _tx_err:
+                    logger.warning(f"Transformers/torch not available, LLM disabled: {_tx_err}")
+                    _TRANSFORMERS_AVAILABLE = False
+                    return None, None
+                logging.getLogger("accelerate").setLevel(logging.WARNING)
+                logging.getLogger("transformers").setLevel(logging.WARNING)
+                import warnings
+                warnings.filterwarnings(
+                    "ignore",
+                    message=r"`prompt_attention_mask` is specified but `attention_mask` is not\\.",
+                )
+                local_only_flag = (os.environ.get('MODEL_REPO_LOCAL_ONLY') or _env().get('MODEL_REPO_LOCAL_ONLY') or '').strip().lower()
+                model_repo_local_only = local_only_flag in ('1', 'true', 'yes')
 
-            repo_path = None
-            try:
-                if isinstance(MODEL_REPO, str) and (MODEL_REPO.startswith('.') or os.path.isabs(MODEL_REPO) or os.path.sep in MODEL_REPO):
-                    candidate = os.path.abspath(MODEL_REPO)
-                    if os.path.isdir(candidate):
-                        repo_path = candidate
-            except Exception:
                 repo_path = None
+                prequantized = None
+                try:
+                    if isinstance(MODEL_REPO, str) and (MODEL_REPO.startswith('.') or os.path.isabs(MODEL_REPO) or os.path.sep in MODEL_REPO):
+                        candidate = os.path.abspath(MODEL_REPO)
+                        if os.path.isdir(candidate):
+                            repo_path = candidate
+                except Exception:
+                    repo_path = None
 
-            try:
-                if repo_path:
-                    logger.info(f"Attempting to load LLM from local path '{repo_path}'")
-                else:
-                    if model_repo_local_only:
-                        logger.info(f"MODEL_REPO_LOCAL_ONLY set and local path '{MODEL_REPO}' not found; skipping LLM load")
+                try:
+                    if repo_path:
+                        logger.info(f"Attempting to load LLM from local path '{repo_path}'")
                     else:
-                        logger.info(f"Attempting to load LLM from '{MODEL_REPO}' (network fetch allowed). Set MODEL_REPO_LOCAL_ONLY=1 to avoid network fetches.")
-                        repo_path = MODEL_REPO
+                        if model_repo_local_only:
+                            logger.info(f"MODEL_REPO_LOCAL_ONLY set and local path '{MODEL_REPO}' not found; skipping LLM load")
+                        else:
+                            logger.info(f"Attempting to load LLM from '{MODEL_REPO}' (network fetch allowed). Set MODEL_REPO_LOCAL_ONLY=1 to avoid network fetches.")
+                            repo_path = MODEL_REPO
 
-                if repo_path:
-                    try:
-                        tokenizer = AutoTokenizer.from_pretrained(repo_path, use_fast=True, local_files_only=True)
-                    except Exception:
-                        logger.exception('Failed to load tokenizer from %s; retrying without local_files_only', repo_path)
+                    if repo_path:
                         try:
-                            tokenizer = AutoTokenizer.from_pretrained(repo_path, use_fast=True)
+                            tokenizer = AutoTokenizer.from_pretrained(repo_path, use_fast=True, local_files_only=True)
                         except Exception:
-                            logger.exception('Tokenizer load failed; aborting LLM load')
-                            tokenizer = None
+                            logger.exception('Failed to load tokenizer from %s; retrying without local_files_only', repo_path)
+                            try:
+                                tokenizer = AutoTokenizer.from_pretrained(repo_path, use_fast=True)
+                            except Exception:
+                                logger.exception('Tokenizer load failed; aborting LLM load')
+                                tokenizer = None
 
-                    has_cuda = False
-                    bnb_available = False
-                    try:
-                        import torch as _torch
-                        has_cuda = bool(_torch.cuda.is_available())
-                    except Exception:
                         has_cuda = False
-                    try:
-                        import bitsandbytes as _bnb  # type: ignore
-                        bnb_available = True
-                    except Exception:
                         bnb_available = False
-                    use_bnb_env = (os.environ.get('LLAMA_USE_BNB') or env_vars.get('LLAMA_USE_BNB') or '').strip().lower()
-                    allow_bnb = use_bnb_env not in ('0', 'false', 'no')
-
-                    primary_loaded = False
-                    if allow_bnb and has_cuda and bnb_available and BitsAndBytesConfig is not None:
                         try:
                             import torch as _torch
-                            bnb_cfg = BitsAndBytesConfig(
-                                load_in_4bit=True,
-                                bnb_4bit_compute_dtype=_torch.float16,
-                                bnb_4bit_use_double_quant=True,
-                                bnb_4bit_quant_type="nf4",
-                            )
-                            logger.info('Attempting quantized 4-bit load (bitsandbytes) from %s', repo_path)
-                            llm = AutoModelForCausalLM.from_pretrained(
-                                repo_path,
-                                quantization_config=bnb_cfg,
-                                device_map='auto',
-                                trust_remote_code=True,
-                                local_files_only=True,
-                                attn_implementation='eager',
-                            )
-                            primary_loaded = True
+                            has_cuda = bool(_torch.cuda.is_available())
                         except Exception:
-                            logger.exception('BNB 4-bit load failed; will try standard load next')
-
-                    if not primary_loaded:
+                            has_cuda = False
                         try:
-                            device_map_choice = 'auto' if has_cuda else 'cpu'
-                            logger.info('Loading standard model from %s (device_map=%s)', repo_path, device_map_choice)
-                            torch_dtype_kw = {}
+                            import bitsandbytes as _bnb  # type: ignore
+                            bnb_available = True
+                        except Exception:
+                            bnb_available = False
+                        use_bnb_env = (os.environ.get('LLAMA_USE_BNB') or _env().get('LLAMA_USE_BNB') or '').strip().lower()
+                        allow_bnb = use_bnb_env not in ('0', 'false', 'no')
+
+                        weights_kw = _weights_kwargs(repo_path)
+                        attn_kw = _attn_kwargs(has_cuda)
+                        prequantized = _prequantized_method(repo_path)
+                        if prequantized:
+                            # Already int4 (tools/quantize_gptq.py): NF4 on top would not load, and
+                            # GPTQ/AWQ kernels decode faster than on-the-fly NF4 dequantization
+                            logger.info('%s is a %s int4 checkpoint; skipping bitsandbytes', repo_path, prequantized.upper())
+                            allow_bnb = False
+                        primary_loaded = False
+                        if allow_bnb and has_cuda and bnb_available and BitsAndBytesConfig is not None:
                             try:
-                                if has_cuda:
-                                    import torch as _torch
-                                    torch_dtype_kw = { 'torch_dtype': _torch.float16 }
+                                compute_dtype = _bnb_compute_dtype()
+                                bnb_cfg = BitsAndBytesConfig(
+                                    load_in_4bit=True,
+                                    bnb_4bit_compute_dtype=compute_dtype,
+                                    bnb_4bit_use_double_quant=True,
+                                    bnb_4bit_quant_type="nf4",
+                                )
+                                logger.info('Attempting quantized 4-bit load (bitsandbytes, compute %s) from %s', compute_dtype, repo_path)
+                                # Unquantized layers (embeddings, lm_head) in the compute dtype avoid per-op casts
+                                llm = _load_with_attn_fallback(lambda kw: AutoModelForCausalLM.from_pretrained(
+                                    repo_path,
+                                    quantization_config=bnb_cfg,
+                                    torch_dtype=compute_dtype,
+                                    device_map='auto',
+                                    trust_remote_code=True,
+                                    local_files_only=True,
+                                    **kw,
+                                    low_cpu_mem_usage=True,
+                                    **weights_kw,
+                                ), attn_kw)
+                                primary_loaded = True
                             except Exception:
-                                torch_dtype_kw = {}
-                            llm = AutoModelForCausalLM.from_pretrained(
-                                repo_path,
-                                device_map=device_map_choice,
-                                trust_remote_code=True,
-                                local_files_only=True,
-                                attn_implementation='eager',
-                                low_cpu_mem_usage=True,
-                                **torch_dtype_kw,
-                            )
-                            primary_loaded = True
-                        except Exception:
-                            logger.exception('Standard load failed; trying CPU-forced fallback')
+                                logger.exception('BNB 4-bit load failed; will try standard load next')
+
+                        if not primary_loaded:
                             try:
-                                import torch as _torch
-                                llm = AutoModelForCausalLM.from_pretrained(
+                                device_map_choice = 'auto' if has_cuda else 'cpu'
+                                logger.info('Loading standard model from %s (device_map=%s)', repo_path, device_map_choice)
+                                try:
+                                    torch_dtype_kw = _dtype_kwargs(has_cuda)
+                                except Exception:
+                                    torch_dtype_kw = {}
+                                llm = _load_with_attn_fallback(lambda kw: AutoModelForCausalLM.from_pretrained(
                                     repo_path,
-                                    device_map='cpu',
+                                    device_map=device_map_choice,
                                     trust_remote_code=True,
                                     local_files_only=True,
-                                    torch_dtype=_torch.float32,
+                                    **kw,
                                     low_cpu_mem_usage=True,
-                                )
+                                    **torch_dtype_kw,
+                                    **weights_kw,
+                                ), attn_kw)
                                 primary_loaded = True
                             except Exception:
-                                logger.exception('CPU-forced fallback also failed; skipping LLM')
-                                llm = None
+                                logger.exception('Standard load failed; trying CPU-forced fallback')
+                                try:
+                                    import torch as _torch
+                                    llm = AutoModelForCausalLM.from_pretrained(
+                                        repo_path,
+                                        device_map='cpu',
+                                        trust_remote_code=True,
+                                        local_files_only=True,
+                                        torch_dtype=_torch.float32,
+                                        low_cpu_mem_usage=True,
+                                        **weights_kw,
+                                    )
+                                    primary_loaded = True
+                                except Exception:
+                                    logger.exception('CPU-forced fallback also failed; skipping LLM')
+                                    llm = None
 
-                if llm is not None:
-                    try:
-                        import torch as _torch  # type: ignore
-                        _LLM_DEVICE = next(llm.parameters()).device.type
-                    except Exception:
-                        _LLM_DEVICE = "cpu"
-                    logger.info(f'LLM loaded on {_LLM_DEVICE}')
-            except Exception:
-                logger.exception('Failed to load LLM; continuing without LLM')
-        else:
-            logger.info('LLM skipped (transformers/torch not available)')
-    except Exception:
-        logger.exception('Failed to load LLM')
-        tokenizer, llm = None, None
-else:
-    logger.info('SKIP_LLM_LOAD set — skipping LLM initialization')
+                    if llm is not None:
+                        try:
+                            import torch as _torch  # type: ignore
+                            _LLM_DEVICE = next(llm.parameters()).device.type
+                        except Exception:
+                            _LLM_DEVICE = "cpu"
+                        logger.info('LLM loaded on %s (attention: %s)', _LLM_DEVICE, getattr(llm.config, '_attn_implementation', 'unknown'))
+                        if prequantized:
+                            _LLM_QUANTIZATION = prequantized
+                        elif getattr(llm, 'is_loaded_in_4bit', False):
+                            _LLM_QUANTIZATION = 'nf4'
+                        cpu_int8_env = (os.environ.get('LLAMA_CPU_INT8') or _env().get('LLAMA_CPU_INT8') or '').strip().lower()
+                        if _LLM_DEVICE == 'cpu' and cpu_int8_env not in ('0', 'false', 'no'):
+                            try:
+                                if next(llm.parameters()).dtype == _torch.float32:
+                                    # CPU decode is bound by streaming fp32 weights; int8 Linear weights cut that 4x
+                                    _torch.ao.quantization.quantize_dynamic(llm, {_torch.nn.Linear}, dtype=_torch.qint8, inplace=True)
+                                    _LLM_QUANTIZATION = 'int8-dynamic'
+                                    logger.info('Applied dynamic int8 quantization to LLM Linear layers')
+                            except Exception:
+                                logger.exception('Dynamic int8 quantization failed; keeping fp32 weights')
+                        try:
+                            _LLM_CONTEXT_TOKENS = int(getattr(llm.config, 'max_position_embeddings', 0) or 0)
+                        except Exception:
+                            _LLM_CONTEXT_TOKENS = 0
+                        if tokenizer is not None and not getattr(tokenizer, 'is_fast', False):
+                            logger.warning('Loaded a slow (Python) tokenizer; install `tokenizers` for the Rust backend')
+                        if _LLM_DEVICE == 'cuda':
+                            try:
+                                # TF32 for any fp32 matmuls left on Ampere+ GPUs (no-op elsewhere)
+                                _torch.backends.cuda.matmul.allow_tf32 = True
+                                _torch.backends.cudnn.allow_tf32 = True
+                            except Exception:
+                                pass
+                        compile_env = (os.environ.get('LLAMA_TORCH_COMPILE') or _env().get('LLAMA_TORCH_COMPILE') or '').strip().lower()
+                        if compile_env in ('1', 'true', 'yes') and _LLM_DEVICE == 'cuda' and not getattr(llm, 'is_loaded_in_4bit', False):
+                            try:
+                                # CUDA graphs need a static KV cache; decode steps then replay one graph
+                                llm.generation_config.cache_implementation = 'static'
+                                # One graph per prompt bucket plus decode: above dynamo's default of 8
+                                # recompiles, later buckets would silently run eager
+                                _torch._dynamo.config.cache_size_limit = max(
+                                    _torch._dynamo.config.cache_size_limit,
+                                    -(-LLAMA_MAX_INPUT_TOKENS // _COMPILE_BUCKET) + 8)
+                                llm.forward = _torch.compile(llm.forward, mode='reduce-overhead', fullgraph=False)
+                                _LLM_COMPILED = True
+                                logger.info('LLM forward compiled with torch.compile(mode="reduce-overhead")')
+                            except Exception:
+                                logger.exception('torch.compile failed; keeping eager forward')
+                except Exception:
+                    logger.exception('Failed to load LLM; continuing without LLM')
+            else:
+                logger.info('LLM skipped (transformers/torch not available)')
+        except Exception:
+            logger.exception('Failed to load LLM')
+            tokenizer, llm = None, None
+        _llm_loaded = tokenizer is not None and llm is not None
+        return tokenizer, llm
+
+
+
+
+def _input_budget(max_length: int, max_new_tokens: int) -> int:
+    # Cap the prompt so that it plus ``max_new_tokens`` fits the model's context window
+    if _LLM_CONTEXT_TOKENS and max_new_tokens:
+        return max(1, min(max_length, _LLM_CONTEXT_TOKENS - max_new_tokens))
+    return max_length
+
+# Prompt lengths are left-padded to a multiple of this when the forward is compiled, so
+# prefill sees a handful of shapes instead of recompiling for every prompt length
+_COMPILE_BUCKET = 64
+
+def _bucket_pad(batch):
+    import torch
+    ids = batch['input_ids']
+    n = int(ids.shape[1])
+    target = -(-n // _COMPILE_BUCKET) * _COMPILE_BUCKET
+    if target == n:
+        return batch
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    pad = ids.new_full((ids.shape[0], target - n), pad_id)
+    mask = batch.get('attention_mask')
+    if mask is None:
+        mask = torch.ones_like(ids)
+    return {'input_ids': torch.cat([pad, ids], dim=1), 'attention_mask': torch.cat([torch.zeros_like(pad), mask], dim=1)}
+
+def _to_llm_device(batch):
+    if _LLM_COMPILED:
+        batch = _bucket_pad(batch)
+    # On CUDA, pin the host tensors so the copy can run non-blocking
+    if _LLM_DEVICE == 'cuda':
+        return {k: v.pin_memory().to(llm.device, non_blocking=True) for k, v in batch.items()}
+    return {k: v.to(llm.device) for k, v in batch.items()}
+
+def _llm_inputs(text: str, max_length: int, max_new_tokens: int = 0):
+    """Tokenize ``text`` for the loaded LLM (truncated to fit the context window) and move
+    it to the model's device."""
+    max_length = _input_budget(max_length, max_new_tokens)
+    return _to_llm_device(tokenizer(text, return_tensors='pt', truncation=True, max_length=max_length))
+
+# Chat request settings, resolved once at import instead of on every request. Unset
+# LLAMA_MAX_NEW_TOKENS / LLAMA_MAX_TIME fall back to the speed preset's values.
+LLAMA_SPEED_PRESET = (os.environ.get('LLAMA_SPEED_PRESET') or _env().get('LLAMA_SPEED_PRESET') or 'balanced').strip().lower()
+LLAMA_MAX_NEW_TOKENS = os.environ.get('LLAMA_MAX_NEW_TOKENS')
+LLAMA_MAX_INPUT_TOKENS = int(os.environ.get('LLAMA_MAX_INPUT_TOKENS', '1024'))
+LLAMA_MAX_TIME = os.environ.get('LLAMA_MAX_TIME')
+LLAMA_FORCE_FALLBACK = os.environ.get('LLAMA_FORCE_FALLBACK', '').strip().lower() in ('1', 'true', 'yes')
+LLAMA_ALLOW_FALLBACK_WITHOUT_RAG = os.environ.get('LLAMA_ALLOW_FALLBACK_WITHOUT_RAG', '').strip().lower() in ('1', 'true', 'yes')
+LLAMA_AUTOTTS = os.environ.get('LLAMA_AUTOTTS', '').strip().lower() in ('1', 'true', 'yes')
+RAG_CONTEXT_CHARS = int(os.environ.get('RAG_CONTEXT_CHARS', '1200'))
+RAG_CONTEXT_TOKENS = int(os.environ.get('RAG_CONTEXT_TOKENS', '300'))
+INPUT_LANGUAGE = (_env().get('InputLanguage') or os.environ.get('InputLanguage') or '').strip().lower()
+
+# Every generate() runs on this single worker: the model is one serialized resource, and
+# request threads stay free for /health, /tts and /stt while a generation is in flight
+_LLM_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='llm')
+
+# Concurrent single-prompt generate() calls with identical kwargs are collated into one
+# left-padded batch of up to LLAMA_BATCH_MAX rows (1 disables batching). The first caller
+# holds the batch open for up to LLAMA_BATCH_WAIT_MS so that near-simultaneous requests join it.
+LLAMA_BATCH_MAX = int(os.environ.get('LLAMA_BATCH_MAX', '4'))
+LLAMA_BATCH_WAIT_S = float(os.environ.get('LLAMA_BATCH_WAIT_MS', '20')) / 1000.0
+LLAMA_QUEUE_TIMEOUT = float(os.environ.get('LLAMA_QUEUE_TIMEOUT', '0')) or None
+_BATCH_PENDING = {}
+_BATCH_LOCK = threading.Lock()
+_LLM_ACTIVE = 0  # _llm_generate calls queued or running
+
+def _llm_result(fut: Future):
+    """Wait for an LLM worker future for up to LLAMA_QUEUE_TIMEOUT; on timeout cancel it
+    so that a job still in the queue never runs."""
+    try:
+        return fut.result(timeout=LLAMA_QUEUE_TIMEOUT)
+    except FutureTimeoutError:  # not the builtin TimeoutError before Python 3.11
+        fut.cancel()
+        raise
 
-def _tts_ready() -> bool:
+# Every LLAMA_GC_EVERY generations the LLM worker collects garbage and returns cached CUDA
+# blocks, so freed KV caches of varying lengths do not fragment VRAM over a long-lived
+# process. Not per request: empty_cache() makes the next generate re-allocate. 0 disables.
+LLAMA_GC_EVERY = int(os.environ.get('LLAMA_GC_EVERY', '32'))
+_GENERATIONS = 0
+
+def _after_generate() -> None:
+    # Runs on the LLM worker, so no generate() is in flight
+    global _GENERATIONS
+    _GENERATIONS += 1
+    if LLAMA_GC_EVERY <= 0 or _GENERATIONS % LLAMA_GC_EVERY:
+        return
     try:
-        return len(get_piper_voices()) > 0
+        gc.collect()
+        if _LLM_DEVICE == 'cuda':
+            import torch
+            torch.cuda.empty_cache()
     except Exception:
+        logger.exception('Post-generation cleanup failed')
+
+# Admission control for chat generations on the local model: at most LLAMA_MAX_INFLIGHT
+# requests hold a slot (queued or generating); others wait up to LLAMA_ADMIT_TIMEOUT
+# seconds and then get a 429, instead of piling unbounded work onto the one GPU worker
+LLAMA_MAX_INFLIGHT = int(os.environ.get('LLAMA_MAX_INFLIGHT', str(2 * max(LLAMA_BATCH_MAX, 1))))
+LLAMA_ADMIT_TIMEOUT = float(os.environ.get('LLAMA_ADMIT_TIMEOUT', '30'))
+_LLM_SLOTS = threading.BoundedSemaphore(max(LLAMA_MAX_INFLIGHT, 1))
+
+def _generate_batch(batches, kwargs):
+    """Left-pad single-row ``batches`` to a common length, run one ``llm.generate`` and
+    return each request's row with its padding stripped (prompt ids + new tokens)."""
+    try:
+        return _generate_rows(batches, kwargs)
+    finally:
+        _after_generate()
+
+def _generate_rows(batches, kwargs):
+    import torch
+    with torch.inference_mode():
+        if len(batches) == 1:
+            return [llm.generate(**batches[0], **kwargs)]
+        lengths = [int(b['input_ids'].shape[1]) for b in batches]
+        width = max(lengths)
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        ids = batches[0]['input_ids'].new_full((len(batches), width), pad_id)
+        mask = torch.zeros_like(ids)
+        for row, (b, n) in enumerate(zip(batches, lengths)):
+            ids[row, width - n:] = b['input_ids'][0]
+            mask[row, width - n:] = b['attention_mask'][0] if 'attention_mask' in b else 1
+        out = llm.generate(input_ids=ids, attention_mask=mask, **kwargs)
+    return [out[row:row + 1, width - n:] for row, n in enumerate(lengths)]
+
+def _run_batch(key):
+    # Runs on the LLM worker; exactly one such job is queued while _BATCH_PENDING[key] is non-empty
+    with _BATCH_LOCK:
+        items = _BATCH_PENDING.get(key, [])
+        first_at = items[0][2] if items else 0.0
+        full = len(items) >= LLAMA_BATCH_MAX
+    if not full:
+        time.sleep(max(0.0, first_at + LLAMA_BATCH_WAIT_S - time.monotonic()))
+    with _BATCH_LOCK:
+        items = _BATCH_PENDING.pop(key, [])
+        if len(items) > LLAMA_BATCH_MAX:
+            _BATCH_PENDING[key] = items[LLAMA_BATCH_MAX:]
+            _LLM_POOL.submit(_run_batch, key)
+        items = items[:LLAMA_BATCH_MAX]
+    live = [(b, fut) for b, fut, _ in items if fut.set_running_or_notify_cancel()]
+    if not live:
+        return
+    try:
+        rows = _generate_batch([b for b, _ in live], dict(key))
+    except BaseException as e:
+        for _, fut in live:
+            fut.set_exception(e)
+        return
+    for (_, fut), row in zip(live, rows):
+        fut.set_result(row)
+
+def _llm_generate(inputs, **kwargs):
+    """Run ``llm.generate`` on the LLM worker under inference_mode and wait for the result,
+    batched with concurrent compatible calls. ``LLAMA_QUEUE_TIMEOUT`` (seconds, 0 = none)
+    bounds the wait including queueing."""
+    global _LLM_ACTIVE
+    with _BATCH_LOCK:
+        _LLM_ACTIVE += 1
+    try:
+        # A compiled forward runs on a static cache sized for one row, so it is never batched;
+        # neither is a row that continues a prefilled preface cache
+        if (LLAMA_BATCH_MAX <= 1 or _LLM_COMPILED or 'streamer' in kwargs or 'past_key_values' in inputs
+                or int(inputs['input_ids'].shape[0]) != 1):
+            return _llm_result(_LLM_POOL.submit(lambda: _generate_batch([inputs], kwargs)[0]))
+        key = tuple(sorted(kwargs.items()))
+        fut = Future()
+        with _BATCH_LOCK:
+            items = _BATCH_PENDING.setdefault(key, [])
+            items.append((inputs, fut, time.monotonic()))
+            if len(items) == 1:
+                _LLM_POOL.submit(_run_batch, key)
+        return _llm_result(fut)
+    finally:
+        with _BATCH_LOCK:
+            _LLM_ACTIVE -= 1
+
+_WARM_LOCK = threading.Lock()
+
+def _warm_llm() -> bool:
+    """Load the LLM and run a one-token generate so the first real request does not pay
+    for lazy kernel/cache initialization. Runs once (concurrent callers wait for it);
+    returns whether the LLM is usable."""
+    with _WARM_LOCK:
+        return _warm_llm_once()
+
+@functools.cache
+def _warm_llm_once() -> bool:
+    _warm_rag()
+    if LLAMA_SERVER_URL:
+        try:
+            logger.info('LLM server model: %s', _server_model())
+            return True
+        except Exception:
+            logger.exception('LLM server at %s not reachable', LLAMA_SERVER_URL)
+            return False
+    tok, model = _get_llm()
+    if LLAMA_GGUF:
+        if not _llm_loaded:
+            return False
+        try:
+            _gguf_complete("Hello", _generate_kwargs(1, 0.0, 1.0))
+            logger.info('LLM warmup generate finished')
+        except Exception:
+            logger.exception('LLM warmup generate failed')
+        return True
+    if tok is None or model is None:
         return False
+    try:
+        # A compiled forward also needs decode steps to capture its graph, not just prefill
+        _llm_generate(_llm_inputs("Hello", 16), **_generate_kwargs(8 if _LLM_COMPILED else 1, 0.0, 1.0))
+        logger.info('LLM warmup generate finished')
+    except Exception:
+        logger.exception('LLM warmup generate failed')
+    return True
 
-def _preload_tts_sync():
+def _warm_llm_async():
     try:
-        logger.info(f"Preloading TTS engine '{TTS_ENGINE}'...")
-        _ = get_piper_voices(force_refresh=True)
-        if _:
-            logger.info(f"Piper TTS voices available: {len(_)}")
+        th = threading.Thread(target=_warm_llm, name='llm-warmup', daemon=True)
+        th.start()
+    except Exception:
+        logger.exception('Failed to start LLM warmup thread')
+
+# At or below this temperature sampling is close to deterministic anyway, so decode
+# greedily and skip the per-step softmax/top-p/multinomial work.
+_GREEDY_MAX_TEMPERATURE = 0.2
+
+def _generate_kwargs(max_new_tokens, temperature, top_p):
+    """Build ``llm.generate`` kwargs: greedy single-beam decoding for low temperatures,
+    nucleus sampling otherwise."""
+    do_sample = bool(temperature) and float(temperature) > _GREEDY_MAX_TEMPERATURE
+    kwargs = dict(
+        max_new_tokens=max_new_tokens,
+        do_sample=do_sample,
+        num_beams=1,
+        use_cache=True,
+    )
+    if do_sample:
+        kwargs.update(temperature=temperature, top_p=top_p)
+    try:
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        if pad_id is not None:
+            kwargs['pad_token_id'] = pad_id
+    except Exception:
+        pass
+    return kwargs
+
+# Optional OpenAI-compatible completion server (e.g. a vLLM or TGI sidecar with continuous
+# batching and paged KV). With LLAMA_SERVER_URL set (like http://localhost:8000/v1) chat
+# prompts are sent there and the local model is never loaded.
+LLAMA_SERVER_URL = (os.environ.get('LLAMA_SERVER_URL') or _env().get('LLAMA_SERVER_URL') or '').strip().rstrip('/')
+LLAMA_SERVER_MODEL = (os.environ.get('LLAMA_SERVER_MODEL') or _env().get('LLAMA_SERVER_MODEL') or '').strip()
+LLAMA_SERVER_TIMEOUT = float(os.environ.get('LLAMA_SERVER_TIMEOUT', '60'))
+
+@functools.cache
+def _llm_session():
+    import requests
+    return requests.Session()  # keep-alive connections to the server
+
+@functools.cache
+def _server_model() -> str:
+    # The first model the server lists, unless LLAMA_SERVER_MODEL names one
+    if LLAMA_SERVER_MODEL:
+        return LLAMA_SERVER_MODEL
+    r = _llm_session().get(LLAMA_SERVER_URL + '/models', timeout=LLAMA_SERVER_TIMEOUT)
+    r.raise_for_status()
+    return r.json()['data'][0]['id']
+
+def _server_request(prompt: str, kwargs: dict, stream: bool):
+    body = {
+        'model': _server_model(),
+        'prompt': prompt,
+        'max_tokens': int(kwargs.get('max_new_tokens') or 128),
+        'temperature': float(kwargs.get('temperature', 1.0)) if kwargs.get('do_sample') else 0.0,
+        'top_p': float(kwargs.get('top_p', 1.0)) if kwargs.get('do_sample') else 1.0,
+        'stream': stream,
+    }
+    r = _llm_session().post(LLAMA_SERVER_URL + '/completions', json=body, stream=stream,
+                            timeout=max(LLAMA_SERVER_TIMEOUT, float(kwargs.get('max_time') or 0)))
+    r.raise_for_status()
+    return r
+
+def _server_stream(prompt: str, kwargs: dict):
+    """Yield text pieces of a streamed completion (server-sent ``data:`` events)."""
+    with _server_request(prompt, kwargs, stream=True) as r:
+        for line in r.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                break
+            piece = json.loads(payload)['choices'][0].get('text')
+            if piece:
+                yield piece
+
+# Optional in-process llama.cpp backend. With LLAMA_GGUF set to a GGUF file (e.g. a Q4_K_M
+# quant made with tools/convert_to_gguf.py) prompts run through llama-cpp-python and
+# torch/transformers are never imported.
+LLAMA_GGUF = (os.environ.get('LLAMA_GGUF') or _env().get('LLAMA_GGUF') or '').strip()
+LLAMA_GGUF_CTX = int(os.environ.get('LLAMA_GGUF_CTX', '4096'))
+LLAMA_GGUF_GPU_LAYERS = int(os.environ.get('LLAMA_GGUF_GPU_LAYERS', '-1'))
+
+@functools.cache
+def _gguf_llm():
+    """The ``llama_cpp.Llama`` for LLAMA_GGUF, loaded once; ``None`` when unavailable."""
+    try:
+        from llama_cpp import Llama  # type: ignore
+    except Exception as e:
+        logger.warning(f"llama-cpp-python not available, LLM disabled: {e}")
+        return None
+    try:
+        logger.info('Loading GGUF model %s', LLAMA_GGUF)
+        return Llama(model_path=LLAMA_GGUF, n_ctx=LLAMA_GGUF_CTX, n_gpu_layers=LLAMA_GGUF_GPU_LAYERS,
+                     n_threads=os.cpu_count(), verbose=False)
+    except Exception:
+        logger.exception('Failed to load GGUF model %s', LLAMA_GGUF)
+        return None
+
+def _gguf_gpu_offload() -> bool:
+    try:
+        from llama_cpp import llama_supports_gpu_offload  # type: ignore
+        return bool(llama_supports_gpu_offload())
+    except Exception:
+        return False
+
+def _gguf_tokens(text: str) -> list:
+    return _gguf_llm().tokenize(text.encode('utf-8'), add_bos=False)
+
+def _gguf_fit_prompt(system_preface: str, conversation_block: str, context: str, prompt: str,
+                     max_new_tokens: int) -> str:
+    """Render a chat prompt for the GGUF model: the context is capped at RAG_CONTEXT_TOKENS,
+    then, while the prompt plus ``max_new_tokens`` overflows the context window, the context
+    is cut further and the oldest conversation lines are dropped. The preface and the
+    question with its ``Assistant:`` cue are always kept."""
+    budget = _gguf_llm().n_ctx() - max_new_tokens - 1  # one slot for BOS
+    ctx_ids = _gguf_tokens(context) if context else []
+    full = _render_prompt(system_preface, conversation_block, context, prompt)
+    over = max(len(_gguf_tokens(full)) - budget, len(ctx_ids) - RAG_CONTEXT_TOKENS)
+    if over > 0 and ctx_ids:
+        keep = max(0, len(ctx_ids) - over - len(_gguf_tokens(_CONTEXT_TRUNCATED)))
+        context = _gguf_llm().detokenize(ctx_ids[:keep]).decode('utf-8', 'ignore') + _CONTEXT_TRUNCATED if keep else ''
+        full = _render_prompt(system_preface, conversation_block, context, prompt)
+    lines = (conversation_block or '').split('\n')
+    while lines and len(_gguf_tokens(full)) > budget:
+        lines.pop(0)
+        full = _render_prompt(system_preface, '\n'.join(lines), context, prompt)
+    return full
+
+def _gguf_request(prompt: str, kwargs: dict, stream: bool):
+    # Same sampling mapping as _server_request. A prompt that still overflows the context
+    # window keeps its end (the question and the Assistant: cue) and BOS
+    cpp = _gguf_llm()
+    max_tokens = int(kwargs.get('max_new_tokens') or 128)
+    ids = cpp.tokenize(prompt.encode('utf-8'))
+    budget = max(2, cpp.n_ctx() - max_tokens)
+    if len(ids) > budget:
+        ids = ids[:1] + ids[len(ids) - budget + 1:]
+    return cpp(
+        ids,
+        max_tokens=max_tokens,
+        temperature=float(kwargs.get('temperature', 1.0)) if kwargs.get('do_sample') else 0.0,
+        top_p=float(kwargs.get('top_p', 1.0)) if kwargs.get('do_sample') else 1.0,
+        stream=stream,
+    )
+
+def _gguf_complete(prompt: str, kwargs: dict) -> dict:
+    # llama.cpp contexts are not thread-safe, so completions run on the LLM worker too
+    return _llm_result(_LLM_POOL.submit(_gguf_request, prompt, kwargs, False))
+
+def _gguf_stream(prompt: str, kwargs: dict):
+    """Yield text pieces of a completion streamed from the LLM worker."""
+    pieces = queue.Queue()
+
+    def run():
+        try:
+            for chunk in _gguf_request(prompt, kwargs, stream=True):
+                pieces.put(chunk['choices'][0].get('text'))
+        except Exception:
+            logger.exception('GGUF generation failed')
+        finally:
+            pieces.put(None)
+
+    _LLM_POOL.submit(run)
+    while (piece := pieces.get()) is not None:
+        yield piece
+
+def _llm_available() -> bool:
+    if LLAMA_GGUF:
+        return _llm_loaded
+    return bool(LLAMA_SERVER_URL) or (tokenizer is not None and llm is not None)
+
+def _complete(prompt: str, make_inputs, kwargs: dict) -> tuple[str, int | None]:
+    """Generate a continuation of ``prompt``: ``(text, generated token count)``. On the
+    server or GGUF model when configured, else on the local model with the inputs
+    ``make_inputs()`` builds."""
+    if LLAMA_SERVER_URL or LLAMA_GGUF:
+        out = _server_request(prompt, kwargs, stream=False).json() if LLAMA_SERVER_URL else _gguf_complete(prompt, kwargs)
+        return (out['choices'][0].get('text') or '').strip(), (out.get('usage') or {}).get('completion_tokens')
+    inputs = make_inputs()
+    output = _llm_generate(inputs, **kwargs)
+    gen = output[0][int(inputs['input_ids'].shape[1]):]
+    return tokenizer.decode(gen, skip_special_tokens=True).strip(), int(gen.shape[0])
+
+
+_CONTEXT_SEP = "\n\n---\n\n"
+
+def _build_context(chunks_list, max_chars: int) -> str:
+    """Join retrieved chunks with ``_CONTEXT_SEP``, cut to ``max_chars`` plus a truncation
+    marker. Stops copying once the budget is spent instead of joining everything first."""
+    parts = []
+    remaining = max_chars
+    for i, chunk in enumerate(chunks_list or ()):
+        for piece in ((_CONTEXT_SEP, chunk) if i else (chunk,)):
+            if len(piece) > remaining:
+                parts.append(piece[:max(remaining, 0)])
+                parts.append("\n[context truncated]")
+                return "".join(parts)
+            parts.append(piece)
+            remaining -= len(piece)
+    return "".join(parts)
+
+def _lang_kind(lang_hint) -> str:
+    lh = str(lang_hint or '').strip().lower()
+    return 'hi' if lh.startswith('hi') else 'en' if lh.startswith('en') else ''
+
+# Persona prefaces depend only on a handful of flags, so each distinct combination is built
+# once; repeat requests also get the identical str back, which keeps _preface_ids hits cheap.
+@functools.lru_cache(maxsize=256)
+def _chat_preface(user_name: str | None, age_group: str | None, use_kid_story: bool, wants_story: bool,
+                  lang_kind: str, rag_reliable: bool) -> str:
+    """System preface for /llama-chat."""
+    persona_lines = []
+    if user_name:
+        persona_lines.append(f"The user's name is {user_name}.")
+    persona_lines.append("Speak as ChaCha in first person (I/me) with a warm, friendly tone—natural, concise, and human.")
+    if age_group == 'kid':
+        if use_kid_story:
+            persona_lines.append("Use simple, positive language and create a short story example appropriate for kids.")
+            persona_lines.append("Structure: briefly explain the idea, then tell a small story (setting → action → outcome), and end with one friendly question.")
+            persona_lines.append("Keep it ~80–140 words, vivid but simple; prefer familiar Indian names/places and Ganga context when it fits naturally.")
+            persona_lines.append("Avoid headings and lists; write in 3–5 short paragraphs so it’s easy to follow.")
+        else:
+            persona_lines.append("Use simple, positive language; explain in 1–2 short paragraphs with one concrete example. Avoid lists unless asked.")
+    elif age_group == 'teen':
+        persona_lines.append("Keep it concise, friendly, and practical — one or two short paragraphs.")
+    else:
+        persona_lines.append("Be concise and conversational; prefer short paragraphs (2–4). Avoid lists unless explicitly asked.")
+    persona_lines.append(
+        "Only ask a follow‑up question if the user clearly asks for more detail or says they want to continue; otherwise, just answer clearly without asking new questions."
+    )
+    persona_lines.append("Use light empathy and clarifying questions only when the user’s goal is ambiguous.")
+    persona_lines.append(
+        "Do not invent or assume what the user said; never write new lines starting with 'User:' or answer imaginary questions."
+    )
+    persona_lines.append(
+        "If the user says ‘continue’, ‘go on’, or answers yes/no, continue naturally from the last assistant reply without restarting or repeating, and do not create extra Q&A turns by yourself."
+    )
+    persona_lines.append("Do not include role labels or markdown headings in the reply.")
+    if wants_story:
+        if lang_kind == 'hi':
+            persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story in Hindi (Devanagari). Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
+        else:
+            persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story. Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
+    if lang_kind == 'hi':
+        persona_lines.append("Respond entirely in Hindi using Devanagari script. Use natural, simple phrasing; avoid mixing English except proper nouns. When technical terms appear, explain them briefly in Hindi. If the provided context is in English, translate it faithfully to Hindi while answering.")
+    elif lang_kind == 'en':
+        persona_lines.append("Respond in English (Indian English tone).")
+    if rag_reliable:
+        persona_lines.append("Use the context below as your primary source. If you add general knowledge, keep it minimal and integrated naturally.")
+    else:
+        persona_lines.append("Context appears weak or missing. Answer from general knowledge clearly and helpfully without apologies or disclaimers.")
+    return "\n".join(persona_lines)
+
+@functools.lru_cache(maxsize=64)
+def _stream_preface(user_name: str | None, age_group: str | None, lang_kind: str, rag_reliable: bool) -> str:
+    """System preface for /llama-chat-stream."""
+    persona_lines = []
+    if user_name:
+        persona_lines.append(f"The user's name is {user_name}.")
+    persona_lines.append("Speak as ChaCha in first person (I/me) with a warm, friendly tone—natural, concise, and human.")
+    if age_group == 'kid':
+        persona_lines.append("Use simple, positive language; short example or story; end with one friendly question.")
+    elif age_group == 'teen':
+        persona_lines.append("Keep it concise, friendly, and practical — one or two short paragraphs.")
+    else:
+        persona_lines.append("Be concise and conversational; prefer short paragraphs (2–4). Avoid lists unless asked.")
+    persona_lines.append("Ask one brief, tailored follow‑up question to keep the chat flowing, unless the user asks for a one‑shot answer.")
+    persona_lines.append("Use light empathy and clarifying questions when the user’s goal is ambiguous.")
+    persona_lines.append("Do not include role labels or markdown headings in the reply.")
+    if lang_kind == 'hi':
+        persona_lines.append("Respond entirely in Hindi using Devanagari script. Keep it natural and simple; avoid English mixing except proper nouns. If the context is in English, translate it into Hindi as you answer.")
+    elif lang_kind == 'en':
+        persona_lines.append("Respond in English (Indian English tone).")
+    if rag_reliable:
+        persona_lines.append("Use the context below as your primary source. If you add general knowledge, keep it minimal and integrated naturally.")
+    else:
+        persona_lines.append("Context appears weak or missing. Answer from general knowledge clearly and helpfully without apologies or disclaimers.")
+    return "\n".join(persona_lines)
+
+def _prompt_sys(system_preface: str) -> str:
+    return "".join((
+        "<SYS>\n", system_preface,
+        "\nNever mention or quote the <SYS>, <CONTEXT>, or <CONV> sections.\n</SYS>\n\n<CONV>\n",
+    ))
+
+def _prompt_conv(conversation_block: str) -> str:
+    return "".join((conversation_block or "", "\n</CONV>\n\n<CONTEXT>\n"))
+
+def _prompt_head(system_preface: str, conversation_block: str) -> str:
+    return _prompt_sys(system_preface) + _prompt_conv(conversation_block)
+
+def _prompt_tail(prompt: str) -> str:
+    return "".join(("\n</CONTEXT>\n\nUser: ", prompt, "\nAssistant:"))
+
+def _render_prompt(system_preface: str, conversation_block: str, context: str, prompt: str) -> str:
+    """Assemble the chat prompt in one join instead of chained concatenation."""
+    return "".join((_prompt_head(system_preface, conversation_block), context or "", _prompt_tail(prompt)))
+
+
+_CONTEXT_TRUNCATED = "\n[context truncated]"
+
+@functools.cache
+def _splice_tables():
+    """Pre-tokenized RAG chunks plus separator ids for the loaded tokenizer, or ``None``
+    when splicing ids would not reproduce a single-pass encode of the same prompt."""
+    try:
+        from rag_utils import chunk_token_table, encode_after
+        import numpy as np
+        if tokenizer is None or not chunks or len(chunks) < 2:
+            return None
+        table = chunk_token_table(tokenizer)
+        sep = encode_after(tokenizer, "a", _CONTEXT_SEP)
+        marker = encode_after(tokenizer, "a", _CONTEXT_TRUNCATED)
+        if table is None or sep is None or marker is None:
+            return None
+        tables = (table, np.asarray(sep, dtype=np.int32), np.asarray(marker, dtype=np.int32))
+        # Self-check on real chunks: spliced ids must match encoding the joined text
+        tail = _prompt_tail("What is this?")
+        for conversation_block in ("User: hi", ""):
+            head = _prompt_head("Check.", conversation_block)
+            spliced = _splice_ids(tables, "Check.", conversation_block, [0, 1], tail, 1 << 30)
+            expected = tokenizer(head + chunks[0] + _CONTEXT_SEP + chunks[1] + tail)["input_ids"]
+            if spliced is None or spliced.tolist() != list(expected):
+                logger.info('Tokenizer does not splice exactly; RAG context will be tokenized per request')
+                return None
+        return tables
+    except Exception:
+        logger.exception('Failed to prepare pre-tokenized RAG chunks')
+        return None
+
+@functools.lru_cache(maxsize=128)
+def _preface_ids(system_preface: str):
+    # The preface only varies with persona/language flags, so its ids are reused across requests
+    import numpy as np
+    ids = np.asarray(tokenizer(_prompt_sys(system_preface))["input_ids"], dtype=np.int32)
+    ids.flags.writeable = False
+    return ids
+
+# Spliced prompts start with exactly _preface_ids(), so the model's KV cache for that prefix
+# can be computed once per preface and copied into each request's generate(). On by default
+# on CUDA ("auto"); LLAMA_PREFIX_KV=1 enables it on CPU too, 0 disables it.
+LLAMA_PREFIX_KV = (os.environ.get('LLAMA_PREFIX_KV') or _env().get('LLAMA_PREFIX_KV') or 'auto').strip().lower()
+# Prefilled preface KVs stay on the model's device, and prefaces embed the user's name, so
+# the cache is bounded by total KV bytes (LLAMA_PREFIX_KV_MB, 0 disables it), least recently used first
+LLAMA_PREFIX_KV_MB = float(os.environ.get('LLAMA_PREFIX_KV_MB', '512'))
+
+def _prefix_kv_enabled() -> bool:
+    # A compiled forward runs on its own static cache
+    if _LLM_COMPILED or LLAMA_PREFIX_KV_MB <= 0:
+        return False
+    if LLAMA_PREFIX_KV == 'auto':
+        return _LLM_DEVICE == 'cuda'
+    return LLAMA_PREFIX_KV in ('1', 'true', 'yes')
+
+_PREFACE_KV = OrderedDict()  # system_preface -> (past_key_values, nbytes)
+_PREFACE_KV_LOCK = threading.Lock()
+
+def _kv_nbytes(past_key_values) -> int:
+    # Per layer a (key, value) pair, for legacy tuples and DynamicCache alike
+    return sum(t.numel() * t.element_size() for layer in past_key_values for t in layer if hasattr(t, 'numel'))
+
+def _preface_kv(system_preface: str):
+    """KV cache of the model over ``_preface_ids(system_preface)``; callers copy it."""
+    with _PREFACE_KV_LOCK:
+        hit = _PREFACE_KV.get(system_preface)
+        if hit is not None:
+            _PREFACE_KV.move_to_end(system_preface)
+            return hit[0]
+    import torch
+    ids = torch.from_numpy(_preface_ids(system_preface).astype('int64')).unsqueeze(0).to(llm.device)
+
+    def prefill():
+        with torch.inference_mode():
+            return llm(input_ids=ids, attention_mask=torch.ones_like(ids), use_cache=True).past_key_values
+    kv = _llm_result(_LLM_POOL.submit(prefill))
+    nbytes, budget = _kv_nbytes(kv), LLAMA_PREFIX_KV_MB * 2 ** 20
+    if nbytes <= budget:
+        with _PREFACE_KV_LOCK:
+            _PREFACE_KV[system_preface] = (kv, nbytes)
+            total = sum(n for _, n in _PREFACE_KV.values())
+            while total > budget:
+                total -= _PREFACE_KV.popitem(last=False)[1][1]
+    return kv
+
+def _splice_ids(tables, system_preface: str, conversation_block: str, chunk_idx, tail: str, context_tokens: int):
+    """Concatenate ids for the cached preface, the conversation, the stored chunks in
+    ``chunk_idx`` (joined by ``_CONTEXT_SEP`` and cut to ``context_tokens``) and ``tail``."""
+    import numpy as np
+    from rag_utils import encode_after
+    (flat, offsets), sep, marker = tables
+    conv_ids = encode_after(tokenizer, ">\n", _prompt_conv(conversation_block))
+    if conv_ids is None:
+        return None
+    parts = [_preface_ids(system_preface), np.asarray(conv_ids, dtype=np.int32)]
+    remaining = context_tokens
+    for n, i in enumerate(chunk_idx):
+        chunk_ids = flat[offsets[i]:offsets[i + 1]]
+        for piece in ((sep, chunk_ids) if n else (chunk_ids,)):
+            if len(piece) > remaining:
+                parts.append(piece[:max(remaining, 0)])
+                parts.append(marker)
+                remaining = -1
+                break
+            parts.append(piece)
+            remaining -= len(piece)
+        if remaining < 0:
+            break
+    tail_ids = encode_after(tokenizer, "a" if chunk_idx else "\n", tail)
+    if tail_ids is None:
+        return None
+    parts.append(np.asarray(tail_ids, dtype=np.int32))
+    return np.concatenate(parts)
+
+def _context_within_tokens(chunk_idx, context_tokens: int) -> str:
+    """Retrieved chunks joined like ``_build_context`` but cut after ``context_tokens``
+    tokens rather than a character count (Devanagari runs several tokens per character
+    where English runs ~4 characters per token)."""
+    # Generous character pre-cut so only about the budget is tokenized
+    context = _build_context([chunks[i] for i in chunk_idx], context_tokens * 8)
+    enc = tokenizer(context, add_special_tokens=False, return_offsets_mapping=True)
+    if len(enc["input_ids"]) <= context_tokens:
+        return context
+    cut = enc["offset_mapping"][context_tokens - 1][1] if context_tokens > 0 else 0
+    return context[:cut] + _CONTEXT_TRUNCATED
+
+def _llm_prompt_inputs(system_preface: str, conversation_block: str, chunk_idx, prompt: str,
+                       full_prompt: str, max_length: int, max_new_tokens: int):
+    """Model inputs for a chat prompt. Retrieved chunks are spliced in from their stored
+    token ids; otherwise the prompt is re-rendered with the context cut in token space and
+    tokenized once. Either way the context is capped at RAG_CONTEXT_TOKENS."""
+    tables = _splice_tables() if chunk_idx else None
+    ids = None
+    if tables is not None:
+        ids = _splice_ids(tables, system_preface, conversation_block, chunk_idx, _prompt_tail(prompt), RAG_CONTEXT_TOKENS)
+    if ids is None:
+        if chunk_idx:
+            try:
+                full_prompt = _render_prompt(system_preface, conversation_block,
+                                             _context_within_tokens(chunk_idx, RAG_CONTEXT_TOKENS), prompt)
+            except Exception:
+                # Slow (pure-Python) tokenizers have no offset mapping; keep the character cap
+                logger.debug('Token-space context cut unavailable', exc_info=True)
+        return _llm_inputs(full_prompt, max_length, max_new_tokens)
+    import torch
+    ids = torch.from_numpy(ids[:_input_budget(max_length, max_new_tokens)].astype('int64')).unsqueeze(0)
+    inputs = _to_llm_device({'input_ids': ids, 'attention_mask': torch.ones_like(ids)})
+    # Under load, skip the preface cache: a plain row can join the next batch, and one
+    # batched generate beats several single-row ones that each save a short prefill
+    busy = LLAMA_BATCH_MAX > 1 and _LLM_ACTIVE > 0
+    if _prefix_kv_enabled() and not busy and ids.shape[1] > len(_preface_ids(system_preface)):
+        try:
+            # generate() extends the cache in place, so every request gets its own copy
+            inputs['past_key_values'] = copy.deepcopy(_preface_kv(system_preface))
+        except Exception:
+            logger.exception('Preface KV prefill failed; running the full prompt')
+    return inputs
+
+def _tts_ready() -> bool:
+    try:
+        return len(get_piper_voices()) > 0
+    except Exception:
+        return False
+
+def _preload_tts_sync():
+    try:
+        logger.info(f"Preloading TTS engine '{TTS_ENGINE}'...")
+        _ = get_piper_voices()
+        if _:
+            logger.info(f"Piper TTS voices available: {len(_)}")
         else:
             logger.info('Piper TTS preload found no voices')
     except Exception:
         logger.exception('TTS preload encountered an error')
+    _warm_rag()
+    if TTS_QUANTIZE and not PIPER_CUDA:
+        # One-time int8 copies; the rescan that follows picks them up as paths['model_q8']
+        for voice in get_piper_voices() or []:
+            if voice.get('id') in TTS_QUANTIZE_EXCLUDE or voice['paths'].get('model_q8'):
+                continue
+            try:
+                t0 = time.time()
+                quantize_voice(voice['paths']['model'])
+                logger.info(f"Quantized Piper voice {voice.get('id')} to int8 in {time.time() - t0:.1f}s")
+            except Exception:
+                logger.exception(f"Quantizing Piper voice {voice.get('id')} failed; keeping FP32")
+    if PIPER_IN_PROCESS:
+        # Create the default voice's ONNX session and run it once so requests skip both
+        voice = pick_indian_piper_voice(None)
+        if voice:
+            try:
+                b''.join(_piper_stream(_piper_model_path(voice), voice['paths']['config'], 'Hello there.'))
+            except Exception:
+                logger.exception('Piper session warmup failed')
+    if TTS_DISK_CACHE_MAX <= 0:
+        return
+    # Synthesize canned replies into the disk cache so their first request is a hit
+    warm = [WELCOME_MESSAGE] if WELCOME_AUTOTTS else []
+    if (os.environ.get('TTS_WARM_FALLBACKS') or _env().get('TTS_WARM_FALLBACKS') or '').strip().lower() in ('1', 'true', 'yes'):
+        warm.append(_kid_story_fallback(None))
+    if warm:
+        try:
+            generate_tts_files([sanitize_text_for_tts(t) for t in warm])
+        except Exception:
+            logger.exception('Canned reply TTS warmup failed')
+    _warm_greeting_cache()
+
+# Audio for the fixed greeting replies ("hi", "hello", ... without a user name), keyed by
+# (language, voice). Entries are disk-cache paths, so they stay valid across requests.
+GREETING_WAVS: dict = {}
+
+def _greeting_text(lang: str) -> str:
+    return sanitize_text_for_tts(_conversational_fallback('hi', None, None, None, lang))
+
+def _greeting_audio(lang_hint, voice_id: str | None = None) -> str:
+    """Audio file for the name-less greeting reply in ``lang_hint``; synthesized once per
+    (language, voice) and then served from ``GREETING_WAVS``."""
+    key = ('hi' if _lang_kind(lang_hint) == 'hi' else 'en', voice_id or '')
+    path = GREETING_WAVS.get(key)
+    if path and os.path.exists(path):
+        return path
+    path = generate_tts_file(_greeting_text(key[0]), voice_id=voice_id)
+    if TTS_DISK_CACHE_MAX > 0:
+        GREETING_WAVS[key] = path
+    return path
+
+def _warm_greeting_cache() -> None:
+    """Pre-synthesize the greeting replies for the default voice in both languages."""
+    if not (LLAMA_AUTOTTS or WELCOME_AUTOTTS) or TTS_DISK_CACHE_MAX <= 0:
+        return
+    langs = ('en', 'hi')
+    try:
+        for lang, path in zip(langs, generate_tts_files([_greeting_text(lang) for lang in langs])):
+            GREETING_WAVS[(lang, '')] = path
+    except Exception:
+        logger.exception('Greeting TTS warmup failed')
 
 def _preload_tts_async():
     try:
@@ -526,6 +2432,15 @@ def _preload_tts_async():
     except Exception:
         logger.exception('Failed to start TTS preload thread')
 
+def _wants_tts(data: dict) -> bool:
+    """Whether a chat reply should come with audio: LLAMA_AUTOTTS, overridden per request by ``tts``."""
+    req_tts = data.get('tts')
+    if isinstance(req_tts, bool):
+        return req_tts
+    if isinstance(req_tts, str) and req_tts.strip().lower() in ('1', 'true', 'yes'):
+        return True
+    return LLAMA_AUTOTTS
+
 def _is_chunk_readable(txt: str) -> bool:
     try:
         s = (txt or "").strip()
@@ -570,19 +2485,15 @@ def _is_mostly_english(text: str) -> bool:
 
 def _translate_with_llm_to_hindi(src: str) -> str | None:
     try:
-        if tokenizer is None or llm is None:
+        if not _llm_available():
             return None
         prompt = (
             "Translate the following text to Hindi in Devanagari script. "
             "Do not add any extra explanation, examples, or questions. "
             "Keep sentences short and clear.\n\nText:\n" + src.strip() + "\n\nHindi:"
         )
-        inputs = tokenizer(prompt, return_tensors='pt', truncation=True, max_length=512).to(llm.device)
         kwargs = dict(max_new_tokens=400, do_sample=False, use_cache=True)
-        out = llm.generate(**inputs, **kwargs)
-        input_len = int(inputs['input_ids'].shape[1])
-        gen = out[0][input_len:]
-        return tokenizer.decode(gen, skip_special_tokens=True).strip()
+        return _complete(prompt, lambda: _llm_inputs(prompt, 512, 400), kwargs)[0]
     except Exception:
         return None
 
@@ -594,29 +2505,53 @@ def _translate_with_llm_to_english(src: str) -> str | None:
     to Hindi for display.
     """
     try:
-        if tokenizer is None or llm is None:
+        if not _llm_available():
             return None
         prompt = (
             "Translate the following text to English. "
             "Do not add any extra explanation, examples, or questions. "
             "Keep sentences short and clear.\n\nText:\n" + src.strip() + "\n\nEnglish:"
         )
-        inputs = tokenizer(prompt, return_tensors='pt', truncation=True, max_length=512).to(llm.device)
         kwargs = dict(max_new_tokens=400, do_sample=False, use_cache=True)
-        out = llm.generate(**inputs, **kwargs)
-        input_len = int(inputs['input_ids'].shape[1])
-        gen = out[0][input_len:]
-        return tokenizer.decode(gen, skip_special_tokens=True).strip()
+        return _complete(prompt, lambda: _llm_inputs(prompt, 512, 400), kwargs)[0]
     except Exception:
         return None
 
+# Special topics the canned fallbacks recognise, found in one regex pass over the lowercased
+# text. "ganga river" is tried before bare "ganga" so that phrase is not split.
+_TOPIC_RE = re.compile(
+    r"(?P<namami>namami gang[ae])|(?P<namami_hi>नमामि गंगे)|(?P<river_ganga>river ganga|ganga river)"
+    r"|(?P<ganges>ganges)|(?P<ganga_hi>गंगा)|(?P<ganga>ganga)"
+)
+
+# A greeting on its own or as the first word ("hi", "hello! ...", "नमस्ते ...")
+_GREETING_RE = re.compile(r"(?:(?:hi|hello|hey|नमस्ते)!?|yo|hola|namaste)(?: |\Z)")
+
+# Generated lines where the model starts echoing prompt sections, or a new chat turn
+_META_LINE_RE = re.compile(r"^(System instructions:|<SYS>|</SYS>|<CONTEXT>|</CONTEXT>|<CONV>|</CONV>|Instruction\b|You are now role-?playing)", re.I)
+_TURN_LINE_RE = re.compile(r"^(User:|<User>:|Assistant:|<Assistant>:)", re.I)
+
+# Requests to expand on the previous answer, matched anywhere in the lowercased text
+_EXPAND_RE = re.compile("|".join(map(re.escape, (
+    "विस्तार", "और बताओ", "ज्यादा", "डिटेल", "विस्तृत", "और समझाओ", "थोड़ा और", "और जानकारी", "और बताइए",
+    "expand", "elaborate", "more detail", "details", "continue", "tell me more", "go deeper",
+))))
+
+@functools.lru_cache(maxsize=1024)
+def _topic_hits(lowered: str) -> frozenset:
+    """Names of the ``_TOPIC_RE`` groups that occur in ``lowered``."""
+    return frozenset(m.lastgroup for m in _TOPIC_RE.finditer(lowered))
+
+@functools.lru_cache(maxsize=256)
 def _kid_story_fallback(topic: str | None, lang: str | None = None) -> str:
+    """Short story-style fallback for kids when RAG is weak or model is missing."""
     t = (topic or "the Ganga river").strip()
+    # Hindi variant when lang starts with 'hi'
     try:
         if lang and str(lang).strip().lower().startswith('hi'):
             return (
                 "यह बात मेरी स्थानीय नोट्स में साफ़ नहीं मिली, इसलिए एक छोटी-सी कहानी से समझाते हैं। "
-                "एक शाम गंगा किनारे आशा और उसके चचेरे भाई रोहन ने चमकता पानी دیکھا।"
+                "एक शाम गंगा किनारे आशा और उसके चचेरे भाई रोहन ने चमकता पानी देखा।"
                 "उन्हें कुछ प्लास्टिक कप तैरते दिखे, तो दोनों ने मिलकर उन्हें उठा लिया। पास के मछुआरे ने मुस्कराकर कहा, ‘जब हम नदी को साफ़ रखते हैं, तो मछलियाँ और डॉल्फ़िन स्वस्थ रहती हैं और हमारे शहर भी बेहतर बनते हैं।’ "
                 "अगले दिन उनकी कक्षा ने एक छोटा-सा बोर्ड लगाया: ‘कचरा डस्टबिन में डालें — हमारी नदी हमारा परिवार।’ "
                 "इतनी-सी पहल से घाट साफ़ दिखने लगा और दूसरे लोग भी मदद करने लगे। क्या मैं बच्चों के लिए एक छोटा-सा काम बताऊँ जो आप आज ही कर सकते हैं?"
@@ -631,12 +2566,42 @@ def _kid_story_fallback(topic: str | None, lang: str | None = None) -> str:
         "That tiny action made the steps look nicer, and more people started helping. Would you like a tiny tip on how kids can care for the river?"
     )
     return core
+# Fixed parts of the canned fallback replies, assembled once at import
+_GREETING_REPLY_EN = (
+    " I’m ChaCha. Great to see you. "
+    "What should we explore today — the Ganga, Namami Gange, or something else you’re curious about?"
+)
+_GREETING_REPLY_HI = " मैं चाचा हूँ। आज हम क्या जानें — गंगा, नमामि गंगे, या कुछ और?"
+_NAMAMI_REPLY_EN = (
+    "Namami Gange is India’s mission to clean and protect the Ganga — building sewage treatment, reducing pollution, restoring habitats, and involving people."
+    " Want a quick example from a real city project?"
+)
+_NAMAMI_REPLY_HI = (
+    "नमामि गंगे गंगा की सफाई और संरक्षण के लिए भारत का मिशन है — सीवरेज ट्रीटमेंट बनाना, प्रदूषण कम करना, आवास बहाल करना और जनभागीदारी बढ़ाना।"
+    " क्या किसी शहर की वास्तविक परियोजना का छोटा उदाहरण बताऊँ?"
+)
+_GANGA_REPLY_EN = (
+    "The Ganga is a lifeline for millions — sacred to many, vital for farms and cities, and home to unique wildlife like the Ganges river dolphin."
+    " Should we talk about wildlife, culture, or how the river is kept healthy?"
+)
+_GANGA_REPLY_HI = (
+    "गंगा करोड़ों लोगों की जीवनरेखा है — कईयों के लिए पवित्र, खेती और शहरों के लिए आवश्यक, और गंगेटिक डॉल्फ़िन जैसे अनोखे जीवों का घर।"
+    " क्या हम वन्यजीव, संस्कृति या नदी को स्वस्थ रखने के तरीक़ों पर बात करें?"
+)
+_FOLLOW_EN = "Does that help, or should I go deeper with a short example?"
+_FOLLOW_HI = "क्या यह मददगार है, या एक छोटा उदाहरण देकर और विस्तार करूँ?"
 
 def _conversational_fallback(topic: str, name: str | None, age_group: str | None, history: list[dict] | None, lang: str | None = None) -> str:
+    """Heuristic, natural-sounding fallback when LLM isn't available.
+    - Warmer tone, short and human.
+    - References known topics with a one-line follow-up question.
+    - Uses recent context lightly (last user message) if present.
+    """
     t = (topic or "").strip()
     nm = (name or "friend").strip()
     ag = (age_group or "").strip().lower() or None
     lt = t.lower()
+    # Last user message if any
     last_user = None
     try:
         if history:
@@ -647,100 +2612,57 @@ def _conversational_fallback(topic: str, name: str | None, age_group: str | None
     except Exception:
         pass
 
-    def _is_expand_request(txt: str) -> bool:
-        txt = (txt or '').lower().strip()
-        hi_keywords = ["विस्तार", "और बताओ", "ज्यादा", "डिटेल", "विस्तृत", "और समझाओ", "थोड़ा और", "और जानकारी", "और बताइए"]
-        en_keywords = ["expand", "elaborate", "more detail", "details", "continue", "tell me more", "go deeper"]
-        return any(k in txt for k in hi_keywords) or any(k in txt for k in en_keywords)
-
-    greetings = {"hi", "hello", "hey", "yo", "hola", "namaste", "hi!", "hello!", "hey!", "नमस्ते", "नमस्ते!"}
-    if lt in greetings or any(lt.startswith(g+" ") for g in greetings):
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                opener_hi = f"नमस्ते {nm}!" if name else "नमस्ते!"
-                return (
-                    f"{opener_hi} मैं चाचा हूँ। "
-                    "आज हम क्या जानें — गंगा, नमामि गंगे, या कुछ और?"
-                )
-        except Exception:
-            pass
-        opener = f"Hey {nm}!" if name else "Hey there!"
-        return (
-            f"{opener} I’m ChaCha. Great to see you. "
-            f"What should we explore today — the Ganga, Namami Gange, or something else you’re curious about?"
-        )
-
-    if "namami gange" in lt or "namami ganga" in lt:
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                core = (
-                    "नमामि गंगे गंगा की सफाई और संरक्षण के लिए भारत का मिशन है — सीवरेज ट्रीटमेंट बनाना, प्रदूषण कम करना, आवास बहाल करना और जनभागीदारी बढ़ाना।"
-                )
-                follow = "क्या किसी शहर की वास्तविक परियोजना का छोटा उदाहरण बताऊँ?"
-                return f"{('हाय ' + nm + ', ') if name else ''}{core} {follow}"
-        except Exception:
-            pass
-        core = (
-            "Namami Gange is India’s mission to clean and protect the Ganga — building sewage treatment, reducing pollution, restoring habitats, and involving people."
-        )
-        follow = "Want a quick example from a real city project?"
-        return f"{f'Hi {nm}, ' if name else ''}{core} {follow}"
-
-    if "river ganga" in lt or "ganga river" in lt or "ganges" in lt or "गंगा" in lt:
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                core = (
-                    "गंगा करोड़ों लोगों की जीवनरेखा है — कईयों के लिए पवित्र, खेती और शहरों के लिए आवश्यक, और गंगेटिक डॉल्फ़िन जैसे अनोखे जीवों का घर।"
-                )
-                follow = "क्या हम वन्यजीव, संस्कृति या नदी को स्वस्थ रखने के तरीक़ों पर बात करें?"
-                return f"{('हाय ' + nm + ', ') if name else ''}{core} {follow}"
-        except Exception:
-            pass
-        core = (
-            "The Ganga is a lifeline for millions — sacred to many, vital for farms and cities, and home to unique wildlife like the Ganges river dolphin."
-        )
-        follow = "Should we talk about wildlife, culture, or how the river is kept healthy?"
-        return f"{f'Hi {nm}, ' if name else ''}{core} {follow}"
+    hindi = _lang_kind(lang) == 'hi'
+    # Greeting intents
+    if _GREETING_RE.match(lt):
+        if hindi:
+            return (f"नमस्ते {nm}!" if name else "नमस्ते!") + _GREETING_REPLY_HI
+        return (f"Hey {nm}!" if name else "Hey there!") + _GREETING_REPLY_EN
+
+    hits = _topic_hits(lt)
+    topic_reply = None
+    if 'namami' in hits:
+        topic_reply = _NAMAMI_REPLY_HI if hindi else _NAMAMI_REPLY_EN
+    elif hits & {'river_ganga', 'ganges', 'ganga_hi'}:
+        topic_reply = _GANGA_REPLY_HI if hindi else _GANGA_REPLY_EN
+    if topic_reply is not None:
+        if not name:
+            return topic_reply
+        return f"हाय {nm}, {topic_reply}" if hindi else f"Hi {nm}, {topic_reply}"
 
-    if _is_expand_request(lt):
+    # If user asks to expand/elaborate, give a deeper answer based on recent topic
+    if _EXPAND_RE.search(lt.strip()):
         base_topic = last_user if last_user and last_user != t else last_user or t
         return _detailed_about(base_topic or t, ag, lang)
 
+    # Generic, topic-aware fallback with a hint of continuity
     if last_user and last_user != t and len(last_user) > 3:
+        # English continuity note
         continuity = f"You mentioned earlier: '{last_user}'. "
+        # For Hindi mode, avoid leaking English by not quoting the previous text
         continuity_hi = "आपने पहले यही पूछा था। "
     else:
         continuity = ""
         continuity_hi = ""
-    follow = "Does that help, or should I go deeper with a short example?"
-    follow_hi = "क्या यह मददगार है, या एक छोटा उदाहरण देकर और विस्तार करूँ?"
+    # Slightly simpler phrasing for kids
     if ag == 'kid':
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                return (
-                    f"हाय {nm}, मैं {t} के बारे में आसान शब्दों में समझाता हूँ। "
-                    f"{continuity_hi}मैं इसे छोटा और दोस्ताना रखूँगा ताकि आसानी से याद रहे। {follow_hi}"
-                )
-        except Exception:
-            pass
+        if hindi:
+            return (
+                f"हाय {nm}, मैं {t} के बारे में आसान शब्दों में समझाता हूँ। "
+                f"{continuity_hi}मैं इसे छोटा और दोस्ताना रखूँगा ताकि आसानी से याद रहे। {_FOLLOW_HI}"
+            )
         return (
             f"Hi {nm}, here’s the idea about {t} in simple words you can follow. "
-            f"{continuity}I’ll keep it short and friendly so it’s easy to remember. {follow}"
+            f"{continuity}I’ll keep it short and friendly so it’s easy to remember. {_FOLLOW_EN}"
         )
-    try:
-        if lang and str(lang).strip().lower().startswith('hi'):
-            return (
-                f"{t} की मूल बातें — साफ़ और संक्षेप में। {continuity_hi}{follow_hi}"
-            )
-    except Exception:
-        pass
-    return (
-        f"Here’s the gist of {t}: clear and to the point. {continuity}{follow}"
-    )
+    # Adult/teen generic
+    if hindi:
+        return f"{t} की मूल बातें — साफ़ और संक्षेप में। {continuity_hi}{_FOLLOW_HI}"
+    return f"Here’s the gist of {t}: clear and to the point. {continuity}{_FOLLOW_EN}"
 
+@functools.lru_cache(maxsize=256)
 def _teen_short_about(topic: str) -> str:
-    lt = (topic or "").lower()
-    if "namami gange" in lt or "namami ganga" in lt:
+    if 'namami' in _topic_hits((topic or "").lower()):
         return (
             "Namami Gange is India’s national mission (launched 2014) to clean and rejuvenate the Ganga: "
             "sewage treatment plants, river-surface cleaning, industrial effluent control, biodiversity, afforestation, and public participation. "
@@ -750,9 +2672,9 @@ def _teen_short_about(topic: str) -> str:
         f"Here’s the gist of {topic}: key ideas explained clearly in a few lines, with causes, effects, and one practical example."
     )
 
+@functools.lru_cache(maxsize=256)
 def _adult_short_about(topic: str) -> str:
-    lt = (topic or "").lower()
-    if "namami gange" in lt or "namami ganga" in lt:
+    if 'namami' in _topic_hits((topic or "").lower()):
         return (
             "Namami Gange (2014–) is GoI’s flagship river rejuvenation programme: "
             "pillars include sewage infrastructure, industrial discharge control, riverfront development, biodiversity conservation, afforestation, and public engagement."
@@ -761,10 +2683,14 @@ def _adult_short_about(topic: str) -> str:
         f"Summary of {topic}: concise definition, 2–3 pillars, and intended outcomes."
     )
 
+@functools.lru_cache(maxsize=256)
 def _detailed_about(topic: str, age_group: str | None, lang: str | None = None) -> str:
+    """Provide a deeper 5–7-line explanation of a topic in the selected language.
+    Used when the user asks to expand/elaborate.
+    """
     t = (topic or "").strip()
     ag = (age_group or "").strip().lower() or None
-    lt = t.lower()
+    hits = _topic_hits(t.lower())
 
     is_hi = False
     try:
@@ -774,7 +2700,7 @@ def _detailed_about(topic: str, age_group: str | None, lang: str | None = None)
         pass
 
     if is_hi:
-        if "namami gange" in lt or "namami ganga" in lt or "नमामि गंगे" in lt:
+        if hits & {'namami', 'namami_hi'}:
             return (
                 "नमामि गंगे का उद्देश्य गंगा को दीर्घकाल तक स्वच्छ और अविरल बनाए रखना है। "
                 "मुख्य कार्य: (1) सीवरेज शोधन संयंत्र (STP) का निर्माण और उन्नयन, (2) औद्योगिक अपशिष्ट पर नियंत्रण, "
@@ -783,7 +2709,7 @@ def _detailed_about(topic: str, age_group: str | None, lang: str | None = None)
                 "परिणाम: BOD/DO सूचक बेहतर हुए, डॉल्फ़िन/घड़ियाल आवास में सुधार दिखा, नदी तटीय सौंदर्यीकरण से पर्यटन बढ़ा। "
                 "आप चाहें तो मैं किसी एक शहर की परियोजना का संक्षिप्त केस-स्टडी भी बता सकता हूँ।"
             )
-        if "ganga" in lt or "ganges" in lt or "गंगा" in lt:
+        if hits & {'river_ganga', 'ganga', 'ganges', 'ganga_hi'}:
             return (
                 "गंगा हिमालय से निकलकर मैदानों से होती हुई बंगाल की खाड़ी तक जाती है। "
                 "यह कृषि, पेयजल, नौवहन और आस्था—सबकी केंद्र है। "
@@ -791,18 +2717,20 @@ def _detailed_about(topic: str, age_group: str | None, lang: str | None = None)
                 "समाधान: उपचारित सीवरेज का पुनः उपयोग, वर्षा-जल संचयन, जल-मित्र कृषि, तटीय हरियाली, और समुदाय-आधारित निगरानी। "
                 "क्या मैं किसी एक चुनौती (जैसे औद्योगिक प्रदूषण) पर गहराई से समझाऊँ?"
             )
+        # Generic detailed
         return (
             f"{t} को आसान भाषा में विस्तार से समझें: परिभाषा, 3–4 मुख्य बिंदु, एक छोटा उदाहरण, और करने योग्य कदम। "
             "बताइए किस हिस्से पर और गहराई चाहिए—कारण, प्रभाव, नीतियाँ या ज़मीनी उदाहरण?"
         )
 
-    if "namami gange" in lt or "namami ganga" in lt:
+    # English detailed fallback
+    if 'namami' in hits:
         return (
             "Namami Gange aims for long-term river health: (1) STP build/upgrade, (2) industrial effluent control, (3) surface cleaning & solid waste, "
             "(4) biodiversity & riparian plantations, (5) public participation (Ganga Praharis). Example: new STPs in Kanpur/Varanasi curbed untreated discharge. "
             "Outcomes: improved BOD/DO, better habitats, cleaner ghats and tourism. I can share a short case study for any one city."
         )
-    if "ganga" in lt or "ganges" in lt:
+    if hits & {'river_ganga', 'ganga', 'ganges'}:
         return (
             "The Ganga runs from the Himalayas to the Bay of Bengal—vital for farms, drinking water, transport, and culture. "
             "Challenges: urban/industrial discharge, unmanaged solid waste, bank erosion, reduced flows. "
@@ -813,6 +2741,7 @@ def _detailed_about(topic: str, age_group: str | None, lang: str | None = None)
         f"Here’s a deeper look at {t}: definition, 3–4 pillars, one example, and next steps. Tell me which part to expand further."
     )
 
+# --- Progressive expansion helpers (for multi-message Hindi answers) ---
 def _is_expand_request_text(txt: str | None) -> bool:
     s = (txt or '').strip().lower()
     hi_keys = ["विस्तार", "आगे बताइए", "आगे बताओ", "आगे जारी", "जारी रखें", "और बताइए", "और बताओ", "कृपया आगे"]
@@ -825,8 +2754,8 @@ def _count_prev_parts(history: list[dict] | None, lang: str | None) -> int:
     is_hi = str(lang or '').strip().lower().startswith('hi')
     count = 0
     try:
-        import re as _re
-        pat = _re.compile(r"भाग\s*(\d+)") if is_hi else _re.compile(r"Part\s*(\d+)", _re.I)
+        import re
+        pat = re.compile(r"भाग\s*(\d+)") if is_hi else re.compile(r"Part\s*(\d+)", re.I)
         for m in history[-10:]:
             if str(m.get('role','')).lower() != 'assistant':
                 continue
@@ -871,9 +2800,13 @@ def _detailed_parts(topic: str, lang: str | None) -> list[str]:
         ]
 
 def create_app():
+    logging.basicConfig(level=logging.INFO)
     app = Flask(__name__)
+    provider_cls = _orjson_provider_class()
+    if provider_cls is not None:
+        app.json = provider_cls(app)
 
-    frontend_origin = os.environ.get('FRONTEND_URL') or env_vars.get('FRONTEND_URL')
+    frontend_origin = os.environ.get('FRONTEND_URL') or _env().get('FRONTEND_URL')
     if frontend_origin:
         origins = [o.strip() for o in str(frontend_origin).split(',') if o.strip()]
     else:
@@ -890,6 +2823,7 @@ def create_app():
         max_age=86400,
         supports_credentials=True,
     )
+    from flask_cors import CORS
     CORS(app, **cors_kwargs)
 
     try:
@@ -900,1509 +2834,172 @@ def create_app():
     except Exception as e:
         logger.warning(f"Blueprint registration failed (possibly during import stage): {e}")
 
+    # Per-app result caches: deterministic LLM replies keyed on prompt + decoding settings,
+    # synthesized audio (or its disk-cache path) plus its creation time, keyed on endpoint + text hash + voice/lang/rate/gender
+    llm_cache = _LRUCache(int(os.environ.get('LLM_RESULT_CACHE_SIZE', '128')))
+    tts_cache = _LRUCache(int(os.environ.get('TTS_RESULT_CACHE_SIZE', '64')))
+
+    def _tts_cached(view):
+        @functools.wraps(view)
+        def wrapper():
+            data = request.get_json(silent=True) or {}
+            if not isinstance(data, dict):
+                # A JSON list/string/number carries no text either; answer before the view parses it
+                return jsonify({'error': 'No text provided'}), 400
+            text = data.get('text')
+            if not text or data.get('no_cache'):
+                return view()
+            key = (
+                request.path,
+                _tts_text_key(text),
+                str(data.get('voice') or ''),
+                str(data.get('lang') or data.get('locale') or '').strip().lower(),
+                str(data.get('rate') or ''),
+                str(data.get('gender') or data.get('sex') or '').strip().lower(),
+            )
+            digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+            disk_index = _tts_disk_index()
+            hit = None
+            cached = tts_cache.get(key)  # (entry, created_at)
+            if cached is not None and not (TTS_CACHE_TTL_S and cached[1] + TTS_CACHE_TTL_S < time.time()):
+                hit = cached[0]
+            if hit is None and disk_index is not None:
+                cached = disk_index.get(digest)  # cached by an earlier process
+                if cached is not None:
+                    hit = cached[0]
+                    tts_cache.put(key, cached)  # keeps the original creation time for the TTL
+            # Namespace: the key without its text, so voices/languages never share audio
+            semantic = None
+            vec = _tts_embedding(text) if hit is None else None
+            if vec is not None:
+                semantic = (key[:1] + key[2:], vec)
+                hit = _SEMANTIC_TTS.get(*semantic)
+            if hit is not None:
+                audio, mimetype, headers = hit
+                resp = None
+                if isinstance(audio, str):
+                    # Entry points at a file in the disk cache: send it with sendfile, no read
+                    try:
+                        os.utime(audio)
+                        resp = send_file(audio, mimetype=mimetype, as_attachment=False, conditional=True)
+                    except OSError:
+                        resp = None  # evicted from disk since; synthesize again
+                else:
+                    resp = send_file(io.BytesIO(audio), mimetype=mimetype, as_attachment=False)
+                if resp is not None:
+                    resp.headers.update(headers)
+                    resp.headers['X-TTS-Cache'] = 'hit' if vec is None else 'semantic'
+                    return resp
+            resp = view()
+            produced = g.pop('tts_output', None)
+            if produced:
+                out_path, mimetype = produced
+                headers = {h: resp.headers[h] for h in ('X-TTS-Engine', 'X-Voice-Used', 'X-Generated-File-Size') if h in resp.headers}
+                resp.headers['X-TTS-Cache'] = 'miss'
+                if isinstance(out_path, bytes):
+                    # Synthesized in memory: the client gets the bytes now, the disk copy is written after
+                    resp.response = _after_body(resp.response, lambda: _remember(
+                        key, digest, _store_tts_bytes(digest, out_path, mimetype, headers), semantic))
+                elif os.path.dirname(os.path.abspath(out_path)) == os.path.abspath(TTS_CACHE_DIR):
+                    _remember(key, digest, (out_path, mimetype, headers), semantic)
+                else:
+                    try:
+                        _remember(key, digest, _keep_tts_output(digest, out_path, mimetype, headers), semantic)
+                    except OSError:
+                        logger.warning('Could not cache TTS output %r', out_path)
+            elif g.pop('tts_streamed', False):
+                headers = {h: resp.headers[h] for h in ('X-TTS-Engine', 'X-Voice-Used') if h in resp.headers}
+                resp.headers['X-TTS-Cache'] = 'miss'
+                resp.response = _tee_stream(resp.response, key, digest, resp.mimetype, headers, semantic)
+            return resp
+
+        def _remember(key, digest, entry, semantic=None):
+            tts_cache.put(key, (entry, time.time()))
+            if semantic is not None:
+                _SEMANTIC_TTS.add(*semantic, entry)
+            disk_index = _tts_disk_index()
+            if disk_index is not None and isinstance(entry[0], str):
+                disk_index.put(digest, *entry, ttl=TTS_CACHE_TTL_S)
+
+        def _keep_tts_output(digest, out_path, mimetype, headers):
+            # Per-request output (gTTS, local-basic, ...) moves into the disk cache under a
+            # name derived from the request key, so the entry holds a path rather than the
+            # audio bytes. send_file() already holds the file open, so moving it is safe;
+            # where it is not (Windows, cache disabled) the bytes are kept instead.
+            if TTS_DISK_CACHE_MAX > 0:
+                cached = os.path.join(TTS_CACHE_DIR, digest + os.path.splitext(out_path)[1])
+                try:
+                    os.replace(out_path, cached)
+                    _evict_tts_cache()
+                    return cached, mimetype, headers
+                except OSError:
+                    pass
+            with open(out_path, 'rb') as fh:
+                return fh.read(), mimetype, headers
+
+        def _tee_stream(body, key, digest, mimetype, headers, semantic=None):
+            # Cache a streamed body only once the client has consumed all of it
+            parts = []
+            for chunk in body:
+                parts.append(chunk)
+                yield chunk
+            _remember(key, digest, _store_tts_bytes(digest, b''.join(parts), mimetype, headers), semantic)
+
+        def _after_body(body, callback):
+            # call_on_close() is skipped for send_file's passthrough bodies, so wrap the body
+            yield from body
+            callback()
+
+        def _store_tts_bytes(digest, audio, mimetype, headers):
+            # Write in-memory audio into the disk cache; the bytes are kept when that fails
+            entry = (audio, mimetype, headers)
+            if TTS_DISK_CACHE_MAX > 0:
+                cached = os.path.join(TTS_CACHE_DIR, digest + ('.mp3' if 'mpeg' in (mimetype or '') else '.wav'))
+                tmp = unique_filename('speech', os.path.splitext(cached)[1][1:])
+                try:
+                    with open(tmp, 'wb') as fh:
+                        fh.write(audio)
+                    os.replace(tmp, cached)
+                    _evict_tts_cache()
+                    entry = (cached, mimetype, headers)
+                except OSError:
+                    logger.warning('Could not write TTS output to %r', cached)
+            return entry
+        return wrapper
+
+    try:
+        from auth import admin_required
+    except Exception:
+        admin_required = None
+    if admin_required is not None:
+        @app.route('/cache/clear', methods=['POST'])
+        @admin_required
+        def cache_clear():
+            disk_index = _tts_disk_index()
+            cleared = {'llm': llm_cache.clear(), 'tts': tts_cache.clear()}
+            if disk_index is not None:
+                cleared['tts_disk'] = disk_index.clear()
+            return jsonify({'cleared': cleared})
+
     @app.route('/', methods=['GET'])
     def root():
         return jsonify({
             'service': 'SmartGanga Mascot Backend',
-            'endpoints': ['/health', '/tts (POST)', '/stt (POST)', '/llama-chat (POST)']
+            'endpoints': ['/health', '/tts (POST)', '/tts-stream (POST)', '/stt (POST)', '/llama-chat (POST)', '/warmup (POST)']
         })
 
-    # Lightweight local TTS/STT helpers
-    try:
-        from edge_local_tts_stt import tts_edge_sync, speech_recognition_once, tts_local_basic, list_local_basic_voices
-        _EDGE_LOCAL_AVAILABLE = True
-    except Exception:
-        _EDGE_LOCAL_AVAILABLE = False
-
     def _is_english_hint(lang_hint: str | None) -> bool:
         try:
             lh = (lang_hint or '').strip().lower()
-            if lh:
-                return lh.startswith('en')
-            cfg = (env_vars.get('InputLanguage') or os.environ.get('InputLanguage') or '').strip().lower()
-            return cfg.startswith('en')
-        except Exception:
-            return False
-
-    @app.route('/tts', methods=['POST'])
-    def tts_endpoint():
-        data = request.get_json() or {}
-        text = data.get('text')
-        voice_id = data.get('voice') or None
-        description = data.get('description') or data.get('caption') or None
-        logger.info(f"/tts request received. voice_id={voice_id!r} desc_present={bool(description)}")
-        if not text:
-            return jsonify({'error': 'No text provided'}), 400
-        try:
-            lang = (data.get('lang') or data.get('locale') or '').strip()
-            rate = data.get('rate')
-            try:
-                rate = int(rate) if rate is not None else None
-            except Exception:
-                rate = None
-            style = (data.get('style') or '').strip()
-            seed = data.get('seed')
-            try:
-                seed = int(seed) if seed is not None else None
-            except Exception:
-                seed = None
-            if lang and not description:
-                l = lang.lower()
-                lang_map = {
-                    'hi': 'Speak in Hindi with a neutral Indian accent.',
-                    'hi-in': 'Speak in Hindi with a neutral Indian accent.',
-                    'en': 'Speak in English with an Indian English accent.',
-                    'en-in': 'Speak in English with an Indian English accent.',
-                }
-                base = lang_map.get(l, f"Speak in language: {lang}.")
-                if style:
-                    description = f"{base} Style: {style}."
-                else:
-                    description = base
-
-            tts_start = time.time()
-            use_fast = _EDGE_LOCAL_AVAILABLE and _is_english_hint(lang)
-            if voice_id:
-                vlow = str(voice_id).strip().lower()
-                if vlow.startswith('piper'):
-                    logger.info(f"Skipping fast-tts because voice_id '{voice_id}' appears to be engine-specific")
-                    use_fast = False
-            if use_fast:
-                try:
-                    out_path = tts_local_basic(text, voice=voice_id, rate=rate)
-                    mimetype = 'audio/wav'
-                    logger.info(f"Fast local-basic TTS used for lang={lang}, out={out_path}")
-                    try:
-                        size = os.path.getsize(out_path) if out_path and os.path.exists(out_path) else 0
-                    except Exception:
-                        size = 0
-                    if size < 2000:
-                        logger.warning('local-basic produced small file (%d bytes); attempting gTTS fallback', size)
-
-                        try:
-                            from gtts import gTTS  # type: ignore
-                            fb_out = unique_filename('speech', 'mp3')
-                            tts_obj = gTTS(text, lang='hi' if (lang or '').lower().startswith('hi') else 'en')
-                            tts_obj.save(fb_out)
-                            logger.info('gTTS fallback produced %s', fb_out)
-                            try:
-                                wav_fb = convert_to_wav_file(fb_out)
-                                return _safe_send_file(wav_fb, 'audio/wav', 'gtts', voice_id)
-                            except Exception:
-                                return _safe_send_file(fb_out, 'audio/mpeg', 'gtts', voice_id)
-                        except Exception:
-                            logger.exception('gTTS fallback failed after small local-basic file; trying edge-tts fallback')
-                            try:
-                                from edge_local_tts_stt import tts_edge_sync  # type: ignore
-                                fb_out = unique_filename('speech', 'mp3')
-                                tts_edge_sync(text, out_path=fb_out, voice=voice_id)
-                                logger.info('edge-tts fallback produced %s', fb_out)
-                                try:
-                                    wav_fb2 = convert_to_wav_file(fb_out)
-                                    return _safe_send_file(wav_fb2, 'audio/wav', 'edge-tts', voice_id)
-                                except Exception:
-                                    return _safe_send_file(fb_out, 'audio/mpeg', 'edge-tts', voice_id)
-                            except Exception:
-                                logger.exception('edge-tts fallback also failed; returning original local-basic output')
-                    return _safe_send_file(out_path, mimetype, 'local-basic', voice_id)
-                except Exception as e:
-                    logger.exception('fast local-basic TTS failed; falling back to configured engine')
-            lhl = (lang or '').strip().lower()
-            if lhl.startswith('hi'):
-                try:
-                    from gtts import gTTS  # type: ignore
-                    out_path = unique_filename('speech', 'mp3')
-                    tts_obj = gTTS(text, lang='hi')
-                    tts_obj.save(out_path)
-                    want_male = False
-                    try:
-                        req_gender = (data.get('gender') or data.get('sex') or '').strip().lower()
-                        if req_gender == 'male':
-                            want_male = True
-                    except Exception:
-                        want_male = False
-                    try:
-                        if not want_male and voice_id and 'male' in str(voice_id).lower():
-                            want_male = True
-                    except Exception:
-                        pass
-                    if want_male:
-                        try:
-                            from pydub import AudioSegment  # type: ignore
-                            aud = AudioSegment.from_file(out_path, format='mp3')
-                            factor = 0.85
-                            new_rate = int(aud.frame_rate * factor)
-                            deeper = aud._spawn(aud.raw_data, overrides={'frame_rate': new_rate})
-                            deeper = deeper.set_frame_rate(aud.frame_rate)
-                            deeper.export(out_path, format='mp3')
-                            logger.info('Applied pydub pitch-lowering to approximate male voice')
-                        except Exception:
-                            logger.exception('Failed to apply pitch-lowering postprocess; returning original gTTS audio')
-                    logger.info('Used gTTS fallback for Hindi synthesis (out=%s)', out_path)
-                    try:
-                        wav_path = convert_to_wav_file(out_path)
-                        return _safe_send_file(wav_path, 'audio/wav', 'gtts', voice_id)
-                    except Exception:
-                        return _safe_send_file(out_path, 'audio/mpeg', 'gtts', voice_id)
-                except Exception:
-                    logger.exception('gTTS fallback for Hindi failed; trying edge-tts fallback')
-                    try:
-                        from edge_local_tts_stt import tts_edge_sync  # type: ignore
-                        fb_out = unique_filename('speech', 'mp3')
-                        tts_edge_sync(text, out_path=fb_out, voice=voice_id)
-                        logger.info('edge-tts fallback produced %s', fb_out)
-                        try:
-                            wav_fb = convert_to_wav_file(fb_out)
-                            return _safe_send_file(wav_fb, 'audio/wav', 'edge-tts', voice_id)
-                        except Exception:
-                            return _safe_send_file(fb_out, 'audio/mpeg', 'edge-tts', voice_id)
-                    except Exception:
-                        logger.exception('edge-tts fallback for Hindi also failed; returning bundled sample if available')
-                        sample = os.path.join(os.getcwd(), 'frontend', 'public', 'assets', 'chacha-cahaudhary', 'Greeting.wav')
-                        if os.path.exists(sample):
-                            resp = send_file(sample, mimetype='audio/wav', as_attachment=False)
-                            try:
-                                resp.headers['X-TTS-Engine'] = 'none'
-                                resp.headers['X-TTS-Fallback'] = 'sample-greeting'
-                                resp.headers['X-Generated-File-Size'] = '0'
-                            except Exception:
-                                pass
-                            return resp
-            out_path = generate_tts_file(text, voice_id=voice_id)
-            tts_latency_ms = int((time.time() - tts_start) * 1000)
-            logger.info(f"TTS generation finished in {tts_latency_ms}ms (engine={TTS_ENGINE}, voice={voice_id}, lang={lang})")
-            mimetype = 'audio/wav'
-            logger.info('Returning generated TTS file: %s', out_path)
-            return _safe_send_file(out_path, mimetype, TTS_ENGINE, voice_id)
-        except Exception as e:
-            logger.exception('TTS endpoint error')
-            return jsonify({'error': 'TTS generation failed', 'details': str(e)}), 500
-
-    @app.route('/fast-tts', methods=['POST'])
-    def fast_tts():
-        if not _EDGE_LOCAL_AVAILABLE:
-            return jsonify({'error': 'fast-tts helper not available'}), 503
-        data = request.get_json() or {}
-        text = data.get('text')
-        voice = data.get('voice') or None
-        rate = data.get('rate')
-        try:
-            rate = int(rate) if rate is not None else None
-        except Exception:
-            rate = None
-        if not text:
-            return jsonify({'error': 'No text provided'}), 400
-        try:
-            out = tts_local_basic(text, out_path=None, voice=voice, rate=rate)
-            logger.info('fast-tts produced file: %s', out)
-            try:
-                size = os.path.getsize(out) if out and os.path.exists(out) else 0
-            except Exception:
-                size = 0
-            if size < 2000:
-                logger.warning('fast-tts produced small file (%d bytes); attempting gTTS fallback', size)
-
-                try:
-                    from gtts import gTTS  # type: ignore
-                    fb_out = unique_filename('speech', 'mp3')
-                    tts_obj = gTTS(text, lang='en' if not (voice or '').lower().startswith('hi') else 'hi')
-                    tts_obj.save(fb_out)
-                    try:
-                        wav_fb = convert_to_wav_file(fb_out)
-                        return _safe_send_file(wav_fb, 'audio/wav', 'gtts', voice)
-                    except Exception:
-                        return _safe_send_file(fb_out, 'audio/mpeg', 'gtts', voice)
-                except Exception:
-                    logger.exception('gTTS fallback failed for fast-tts; trying edge-tts fallback')
-                    try:
-                        from edge_local_tts_stt import tts_edge_sync  # type: ignore
-                        fb_out = unique_filename('speech', 'mp3')
-                        tts_edge_sync(text, out_path=fb_out, voice=voice)
-                        try:
-                            wav_fb_e = convert_to_wav_file(fb_out)
-                            return _safe_send_file(wav_fb_e, 'audio/wav', 'edge-tts', voice)
-                        except Exception:
-                            return _safe_send_file(fb_out, 'audio/mpeg', 'edge-tts', voice)
-                    except Exception:
-                        logger.exception('edge-tts fallback failed for fast-tts; returning original')
-            return _safe_send_file(out, 'audio/wav', 'local-basic', voice)
-        except Exception as e:
-            logger.exception('fast-tts failed')
-            return jsonify({'error': 'fast-tts failed', 'details': str(e)}), 500
-
-    @app.route('/fast-stt', methods=['GET'])
-    def fast_stt():
-        if not _EDGE_LOCAL_AVAILABLE:
-            return jsonify({'error': 'fast-stt helper not available'}), 503
-        try:
-            text = speech_recognition_once()
-            return jsonify({'result': text})
-        except Exception as e:
-            logger.exception('fast-stt failed')
-            return jsonify({'error': 'fast-stt failed', 'details': str(e)}), 500
-
-    @app.route('/voices', methods=['GET'])
-    def voices_endpoint():
-        try:
-            piper_list = []
-            try:
-                piper_list = get_piper_voices() or []
-            except Exception:
-                piper_list = []
-            if piper_list:
-                items = []
-                for v in piper_list:
-                    try:
-                        items.append({
-                            'id': v.get('id') or v.get('shortName'),
-                            'shortName': v.get('shortName') or v.get('id'),
-                            'locale': v.get('locale') or None,
-                        })
-                    except Exception:
-                        continue
-                return jsonify({ 'count': len(items), 'voices': items, 'engine': 'piper' })
-            items = list_local_basic_voices()
-            return jsonify({ 'count': len(items), 'voices': items, 'engine': 'local-basic' })
-        except Exception as e:
-            return jsonify({ 'error': 'failed to list voices', 'details': str(e) }), 500
-
-    @app.route('/tts-diagnostic', methods=['GET'])
-    def tts_diagnostic():
-        try:
-            info = {
-                'piper_helper_imported': False,
-                'piper_path': PIPER_PATH,
-                'piper_voices_dir': PIPER_VOICES_DIR,
-                'piper_voices_count': 0,
-                'piper_voices_sample': [],
-            }
-            try:
-                voices = get_piper_voices(force_refresh=True) or []
-                info['piper_helper_imported'] = True
-                info['piper_voices_count'] = len(voices)
-                info['piper_voices_sample'] = [ { 'id': v.get('id'), 'shortName': v.get('shortName'), 'locale': v.get('locale') } for v in voices[:8] ]
-            except Exception as e:
-                info['piper_helper_imported'] = False
-                info['piper_error'] = str(e)
-            try:
-                from pydub import AudioSegment  # type: ignore
-                info['pydub_available'] = True
-                try:
-                    ff = AudioSegment.converter
-                    info['ffmpeg_path'] = ff
-                    info['ffmpeg_available'] = bool(ff and os.path.exists(ff))
-                except Exception:
-                    info['ffmpeg_path'] = None
-                    info['ffmpeg_available'] = False
-            except Exception as e:
-                info['pydub_available'] = False
-                info['pydub_error'] = str(e)
-            try:
-                info['piper_path_exists'] = os.path.isabs(PIPER_PATH) and os.path.exists(PIPER_PATH)
-            except Exception:
-                info['piper_path_exists'] = False
-            return jsonify(info)
-        except Exception as e:
-            return jsonify({'error': 'diagnostic failed', 'details': str(e)}), 500
-
-    @app.route('/generated_audio/<path:filename>', methods=['GET'])
-    def get_generated_audio(filename: str):
-        try:
-            path = os.path.join(DATA_DIR, filename)
-            if not os.path.isfile(path):
-                return jsonify({'error': 'file not found'}), 404
-            return send_file(path, mimetype='audio/wav', as_attachment=False)
-        except Exception as e:
-            return jsonify({'error': 'failed to serve audio', 'details': str(e)}), 500
-
-    @app.route('/stt', methods=['POST'])
-    def stt_endpoint():
-        data = request.get_json() or {}
-        text = data.get('text')
-        if not text:
-            if _EDGE_LOCAL_AVAILABLE and _is_english_hint(None):
-                try:
-                    captured = speech_recognition_once()
-                    return jsonify({'result': captured})
-                except Exception as e:
-                    logger.exception('fast-stt capture failed')
-                    return jsonify({'error': 'fast-stt failed', 'details': str(e)}), 500
-            return jsonify({'error': 'No text provided'}), 400
-        return jsonify({'result': text})
-
-    @app.route('/health', methods=['GET'])
-    def health():
-        return jsonify({
-            'status': 'ok',
-            'rag_ready': embedder is not None and index is not None and chunks is not None,
-            'llm_ready': tokenizer is not None and llm is not None,
-            'llm_device': _LLM_DEVICE,
-            'tts_engine': TTS_ENGINE,
-            'tts_ready': _tts_ready(),
-            'tts_device': None,
-            'db_mode': 'memory' if _USING_IN_MEMORY_DB else 'mongo'
-        })
-
-    @app.route('/llm-diagnostic', methods=['GET'])
-    def llm_diagnostic():
-        info = {
-            'transformers_available': _TRANSFORMERS_AVAILABLE,
-            'llm_ready': tokenizer is not None and llm is not None,
-            'llm_device': _LLM_DEVICE,
-            'env': {
-                'SKIP_LLM_LOAD': os.environ.get('SKIP_LLM_LOAD') or env_vars.get('SKIP_LLM_LOAD'),
-                'LLAMA_FORCE_FALLBACK': os.environ.get('LLAMA_FORCE_FALLBACK'),
-                'LLAMA_USE_BNB': os.environ.get('LLAMA_USE_BNB') or env_vars.get('LLAMA_USE_BNB'),
-                'MODEL_REPO': os.environ.get('MODEL_REPO') or env_vars.get('MODEL_REPO'),
-                'MODEL_REPO_LOCAL_ONLY': os.environ.get('MODEL_REPO_LOCAL_ONLY') or env_vars.get('MODEL_REPO_LOCAL_ONLY'),
-                'HF_HUB_OFFLINE': os.environ.get('HF_HUB_OFFLINE'),
-            }
-        }
-        try:
-            repo_hint = (os.environ.get('MODEL_REPO') or env_vars.get('MODEL_REPO') or os.path.join(os.getcwd(), 'models', 'phi-3-mini-4k-instruct'))
-            repo_path = None
-            if isinstance(repo_hint, str) and (repo_hint.startswith('.') or os.path.isabs(repo_hint) or os.path.sep in repo_hint):
-                cand = os.path.abspath(repo_hint)
-                if os.path.isdir(cand):
-                    repo_path = cand
-            info['resolved_repo_path'] = repo_path
-            if repo_path:
-                try:
-                    files = os.listdir(repo_path)
-                    key_files = ['config.json', 'tokenizer.json', 'tokenizer.model', 'model.safetensors.index.json', 'pytorch_model.bin.index.json']
-                    present = {kf: (kf in files) for kf in key_files}
-                    info['repo_files_present'] = present
-                    info['repo_file_count'] = len(files)
-                except Exception as e:
-                    info['repo_list_error'] = str(e)
-        except Exception as e:
-            info['repo_resolve_error'] = str(e)
-
-        try:
-            import torch as _torch  # type: ignore
-            info['torch'] = {
-                'version': getattr(_torch, '__version__', None),
-                'cuda_available': bool(_torch.cuda.is_available()),
-                'cuda_version': getattr(getattr(_torch, 'version', None), 'cuda', None),
-            }
-        except Exception as e:
-            info['torch_error'] = str(e)
-
-        try:
-            import bitsandbytes as _bnb  # type: ignore
-            info['bitsandbytes'] = {'available': True, 'version': getattr(_bnb, '__version__', None)}
-        except Exception as e:
-            info['bitsandbytes'] = {'available': False, 'error': str(e)}
-
-        return jsonify(info)
-
-    @app.route('/llama-chat', methods=['GET', 'POST', 'OPTIONS'])
-    def llama_chat():
-        req_start = time.time()
-        logging.debug("Request received at /llama-chat")
-        if request.method == 'OPTIONS':
-            return ("", 200)
-        if request.method == 'GET':
-            return jsonify({
-                'error': 'Use POST with JSON payload {"prompt": "..."}',
-                'example': {'prompt': 'Hello'}
-            }), 405
-        if embedder is None or index is None or chunks is None:
-            allow_fallback_without_rag = os.environ.get('LLAMA_ALLOW_FALLBACK_WITHOUT_RAG', '')
-            if allow_fallback_without_rag.strip().lower() in ('1', 'true', 'yes'):
-                logger.info('RAG components not initialized but LLAMA_ALLOW_FALLBACK_WITHOUT_RAG set — proceeding in fallback-only mode')
-            else:
-                return jsonify({"error": "RAG components not initialized"}), 503
-        model_missing = tokenizer is None or llm is None
-        try:
-            data = request.get_json() or {}
-            prompt = data.get("prompt")
-            lang_hint = (data.get('lang') or data.get('locale') or '').strip()
-            force_fallback = False
-            fb_req = data.get('fallback')
-            if isinstance(fb_req, bool):
-                force_fallback = fb_req
-            elif isinstance(fb_req, str):
-                force_fallback = fb_req.strip().lower() in ("1", "true", "yes")
-            if os.environ.get('LLAMA_FORCE_FALLBACK', '').lower() in ("1", "true", "yes"):
-                force_fallback = True
-            age_group = (
-                data.get('ageGroup')
-                or data.get('agegroup')
-                or data.get('age_group')
-                or data.get('AgeGroup')
-            )
-            user_name = (
-                data.get('name')
-                or data.get('Name')
-                or data.get('username')
-                or data.get('user_name')
-            )
-            if isinstance(age_group, str):
-                raw_age = age_group.strip()
-                age_group = raw_age.lower()
-                if age_group in ('child', 'children', 'kids', 'kiddo'):
-                    age_group = 'kid'
-                else:
-                    # Treat numeric ages up to 12 as kid
-                    try:
-                        n = int(raw_age)
-                        if n <= 12:
-                            age_group = 'kid'
-                    except Exception:
-                        pass
-            if isinstance(user_name, str):
-                user_name = user_name.strip()
-            if not prompt:
-                return jsonify({"error": "No prompt provided"}), 400
-
-            # Strip any explicit chat-log style role tags from the prompt
-            try:
-                for marker in ("<User>:", "<Assistant>:", "User:", "Assistant:"):
-                    prompt = prompt.replace(marker, "")
-            except Exception:
-                pass
-
-            # For Hindi flows, first translate the user prompt to English so that
-            # RAG and the core LLM reasoning always see clean English text.
-            original_prompt = prompt
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    translated_prompt = _translate_with_llm_to_english(prompt or '')
-                    if translated_prompt:
-                        prompt = translated_prompt
-            except Exception:
-                pass
-
-            logging.debug(f"Prompt received (normalized): {prompt}")
-            history = data.get('history')
-            if not isinstance(history, list):
-                history = []
-            history = history[-12:]
-
-            kid_greeting_story = False
-            simple = (prompt or '').strip().lower()
-            is_welcome = False
-            try:
-                wflag = data.get('welcome') or data.get('isWelcome') or data.get('is_welcome')
-                if isinstance(wflag, bool):
-                    is_welcome = wflag
-            except Exception:
-                is_welcome = False
-            if not is_welcome:
-                def _norm(s: str) -> str:
-                    return ''.join(ch for ch in s.lower() if ch.isalnum() or ch.isspace()).strip()
-                is_welcome = _norm(simple) == _norm(WELCOME_TRIGGER_TEXT)
-            if is_welcome:
-                result = WELCOME_MESSAGE
-                audio_url = None
-                if WELCOME_AUTOTTS:
-                    try:
-                        out_path = unique_filename('speech', 'wav')
-                        tts_text = sanitize_text_for_tts(result)
-                        if 'tts_local_basic' in globals() and _EDGE_LOCAL_AVAILABLE:
-                            wav_path = tts_local_basic(tts_text, out_path=out_path, voice=data.get('voice') or None)
-                        else:
-                            wav_path = generate_tts_file(tts_text)
-                        filename = os.path.basename(wav_path)
-                        audio_url = f"/generated_audio/{filename}"
-                    except Exception:
-                        logger.exception('Welcome TTS failed')
-                latency_ms = int((time.time() - req_start) * 1000)
-                resp = {
-                    "result": result,
-                    "retrieved_count": 0,
-                    "rag_score": None,
-                    "source": "general",
-                    "temperature": 0.0,
-                    "top_p": 1.0,
-                    "used_max_new_tokens": 0,
-                    "latency_ms": latency_ms,
-                    "wants_long": False,
-                    "llm_used": False,
-                }
-                if audio_url:
-                    resp['audio_url'] = audio_url
-                return jsonify(resp)
-
-            if simple in ("hi", "hello", "hey", "yo", "hola", "namaste"):
-                if (age_group or '').strip().lower() == 'kid' and not (force_fallback or model_missing):
-                    kid_greeting_story = True
-                else:
-                    base = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-                    latency_ms = int((time.time() - req_start) * 1000)
-                    return jsonify({
-                        "result": base,
-                        "retrieved_count": 0,
-                        "temperature": 0.0,
-                        "top_p": 1.0,
-                        "used_max_new_tokens": 0,
-                        "latency_ms": latency_ms,
-                        "wants_long": False,
-                    })
-            query_emb = embedder.encode([prompt])
-            query_arr = np.array(query_emb, dtype=np.float32)
-            if query_arr.ndim == 1:
-                query_arr = np.expand_dims(query_arr, 0)
-            D, I = index.search(query_arr, k=3)
-            retrieved_chunks = [chunks[i] for i in I[0] if 0 <= i < len(chunks)]
-
-            rag_score = None
-            try:
-                if D is not None and len(D) > 0 and len(D[0]) > 0:
-                    d0 = float(D[0][0])
-                    if 0.0 <= d0 <= 1.0:
-                        rag_score = max(0.0, min(1.0, 1.0 - d0))
-                    elif 0.0 <= d0 <= 2.0:
-                        rag_score = max(0.0, min(1.0, 1.0 - (d0 / 2.0)))
-            except Exception:
-                rag_score = None
-
-            rag_reliable = bool(retrieved_chunks) and (rag_score is not None and rag_score >= 0.70)
-            context = "\n\n---\n\n".join(retrieved_chunks) if retrieved_chunks else ""
-
-            max_context_chars = int(os.environ.get("RAG_CONTEXT_CHARS", "1200"))
-            if len(context) > max_context_chars:
-                context = context[:max_context_chars] + "\n[context truncated]"
-
-            persona_lines = []
-            if user_name:
-                persona_lines.append(f"The user's name is {user_name}.")
-            persona_lines.append("Speak as ChaCha in first person (I/me) with a warm, friendly tone—natural, concise, and human.")
-            use_kid_story = False
-            if (age_group == 'kid'):
-                lt_prompt = (prompt or '').strip().lower()
-                if ('kid_greeting_story' in locals() and kid_greeting_story) or any(
-                    kw in lt_prompt for kw in ('why', 'how', 'what is', 'tell me', 'story')
-                ) or not rag_reliable:
-                    use_kid_story = True
-                if use_kid_story:
-                    persona_lines.append("Use simple, positive language and create a short story example appropriate for kids.")
-                    persona_lines.append("Structure: briefly explain the idea, then tell a small story (setting → action → outcome), and end with one friendly question.")
-                    persona_lines.append("Keep it ~80–140 words, vivid but simple; prefer familiar Indian names/places and Ganga context when it fits naturally.")
-                    persona_lines.append("Avoid headings and lists; write in 3–5 short paragraphs so it’s easy to follow.")
-                else:
-                    persona_lines.append("Use simple, positive language; explain in 1–2 short paragraphs with one concrete example. Avoid lists unless asked.")
-            elif age_group == 'teen':
-                persona_lines.append("Keep it concise, friendly, and practical — one or two short paragraphs.")
-            else:
-                persona_lines.append("Be concise and conversational; prefer short paragraphs (2–4). Avoid lists unless explicitly asked.")
-            persona_lines.append(
-                "Only ask a follow‑up question if the user clearly asks for more detail or says they want to continue; otherwise, just answer clearly without asking new questions."
-            )
-            persona_lines.append("Use light empathy and clarifying questions only when the user’s goal is ambiguous.")
-            persona_lines.append(
-                "Do not invent or assume what the user said; never write new lines starting with 'User:' or answer imaginary questions."
-            )
-            persona_lines.append(
-                "If the user says ‘continue’, ‘go on’, or answers yes/no, continue naturally from the last assistant reply without restarting or repeating, and do not create extra Q&A turns by yourself."
-            )
-            persona_lines.append("Do not include role labels or markdown headings in the reply.")
-            try:
-                _pl = (prompt or '').strip().lower()
-                if ('कहानी' in (prompt or '')) or ('story' in _pl):
-                    if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                        persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story in Hindi (Devanagari). Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
-                    else:
-                        persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story. Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
-            except Exception:
-                pass
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    persona_lines.append("Respond entirely in Hindi using Devanagari script. Use natural, simple phrasing; avoid mixing English except proper nouns. When technical terms appear, explain them briefly in Hindi. If the provided context is in English, translate it faithfully to Hindi while answering.")
-                elif lang_hint:
-                    if str(lang_hint).strip().lower().startswith('en'):
-                        persona_lines.append("Respond in English (Indian English tone).")
-            except Exception:
-                pass
-            if rag_reliable:
-                persona_lines.append("Use the context below as your primary source. If you add general knowledge, keep it minimal and integrated naturally.")
-            else:
-                persona_lines.append("Context appears weak or missing. Answer from general knowledge clearly and helpfully without apologies or disclaimers.")
-
-            system_preface = "\n".join(persona_lines)
-
-            convo_lines = []
-            for m in history:
-                try:
-                    role = str(m.get('role', '')).strip().lower()
-                    content = str(m.get('content', '')).strip()
-                    if not content:
-                        continue
-                    if role == 'user':
-                        convo_lines.append(f"User: {content}")
-                    elif role == 'assistant':
-                        convo_lines.append(f"Assistant: {content}")
-                except Exception:
-                    continue
-            conversation_block = "\n".join(convo_lines)
-
-            full_prompt = (
-                "<SYS>\n"
-                + system_preface
-                + "\nNever mention or quote the <SYS>, <CONTEXT>, or <CONV> sections.\n</SYS>\n\n"
-                + "<CONV>\n" + (conversation_block or "") + "\n</CONV>\n\n"
-                + "<CONTEXT>\n" + (context or "") + "\n</CONTEXT>\n\n"
-                + "User: " + prompt + "\nAssistant:"
-            )
-            if force_fallback or model_missing:
-                logger.info(f"/llama-chat: using fallback (force={force_fallback}, model_missing={model_missing}, age_group={age_group})")
-                result = None
-                if retrieved_chunks:
-                    try:
-                        top = (retrieved_chunks[0] or '').strip()
-                        readable = _is_chunk_readable(top)
-                        if age_group == 'kid':
-                            if rag_reliable and readable:
-                                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                                    result = (
-                                        "मैं इसे एक छोटे उदाहरण या कहानी से समझा सकता हूँ — क्या आप चाहेंगे?"
-                                    )
-                                else:
-                                    snippet = _clean_snippet(top)
-                                    result = (
-                                        f"Based on our local notes: {snippet}\n\nWould you like a short story or a simple example next?"
-                                    )
-                            else:
-                                result = _kid_story_fallback(prompt, lang_hint)
-                        else:
-                            if rag_reliable and readable:
-                                snippet = _clean_snippet(top)
-                                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                                    result = ("हमारी स्थानीय नोट्स के आधार पर जानकारी उपलब्ध है। क्या मैं इसे आगे बढ़ाकर एक छोटा उदाहरण दूँ?")
-                                else:
-                                    result = (
-                                        f"Based on our local notes: {snippet}\n\nWant me to expand or give a quick example?"
-                                    )
-                            elif readable:
-                                snippet = _clean_snippet(top)
-                                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                                    result = (
-                                        "यह बात मेरी स्थानीय नोट्स में साफ़ नहीं मिली। चाहें तो मैं सामान्य रूप से संक्षेप में समझा दूँ?"
-                                    )
-                                else:
-                                    result = (
-                                        "I couldn't find this clearly in my local notes; here’s what I do have: "
-                                        f"{snippet}\n\nIf helpful, I can give a broader general explanation."
-                                    )
-                            else:
-                                result = None
-                    except Exception:
-                        result = None
-                if not result:
-                    if age_group == 'kid':
-                        result = _kid_story_fallback(prompt, lang_hint)
-                    else:
-                        result = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-                latency_ms = int((time.time() - req_start) * 1000)
-                return jsonify({
-                    "result": result,
-                    "retrieved_count": len(retrieved_chunks),
-                    "rag_score": float(rag_score) if rag_score is not None else None,
-                    "source": "rag" if rag_reliable else "general",
-                    "temperature": 0.0,
-                    "top_p": 1.0,
-                    "used_max_new_tokens": 0,
-                    "latency_ms": latency_ms,
-                    "wants_long": False,
-                })
-
-            speed_preset = (os.environ.get('LLAMA_SPEED_PRESET') or env_vars.get('LLAMA_SPEED_PRESET') or 'balanced').strip().lower()
-            try:
-                req_speed = (data.get('speed') or data.get('speed_preset') or '').strip().lower()
-                if req_speed in ('fast', 'balanced', 'quality'):
-                    speed_preset = req_speed
-            except Exception:
-                pass
-            if speed_preset not in ('fast', 'balanced', 'quality'):
-                speed_preset = 'balanced'
-
-            temperature = 0.2
-            top_p = 0.9
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    temperature = max(temperature, 0.45)
-            except Exception:
-                pass
-
-            if _LLM_DEVICE == 'cpu':
-                preset_tokens = {'fast': 48, 'balanced': 72, 'quality': 104}
-                kid_tokens_map = {'fast': 100, 'balanced': 140, 'quality': 180}
-                teen_tokens_map = {'fast': 60, 'balanced': 80, 'quality': 100}
-                default_max_time = {'fast': 4.0, 'balanced': 6.0, 'quality': 8.0}[speed_preset]
-            else:
-                preset_tokens = {'fast': 128, 'balanced': 196, 'quality': 320}
-                kid_tokens_map = {'fast': 200, 'balanced': 300, 'quality': 420}
-                teen_tokens_map = {'fast': 110, 'balanced': 160, 'quality': 220}
-                default_max_time = {'fast': 8.0, 'balanced': 14.0, 'quality': 22.0}[speed_preset]
-
-            default_tokens = preset_tokens[speed_preset]
-            max_new_tokens = int(os.environ.get('LLAMA_MAX_NEW_TOKENS', str(default_tokens)))
-
-            try:
-                if (lang_hint and str(lang_hint).strip().lower().startswith('hi')) or ('कहानी' in (prompt or '')) or ('story' in (prompt or '').lower()):
-                    max_new_tokens = int(max_new_tokens * 1.25)
-            except Exception:
-                pass
-
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    temperature = max(temperature, 0.45)
-            except Exception:
-                pass
-            if age_group == 'kid':
-                temperature = 0.7
-                kid_tokens = kid_tokens_map[speed_preset]
-                max_new_tokens = min(max(max_new_tokens, kid_tokens), kid_tokens_map['quality'])
-            elif age_group == 'teen':
-                temperature = 0.4
-                teen_tokens = teen_tokens_map[speed_preset]
-                max_new_tokens = min(max_new_tokens, teen_tokens)
-
-            max_input_tokens = int(os.environ.get("LLAMA_MAX_INPUT_TOKENS", "1024"))
-
-            try:
-                import torch
-                no_grad_ctx = torch.inference_mode
-            except Exception:
-                class _NoopCtx:
-                    def __enter__(self):
-                        return None
-                    def __exit__(self, exc_type, exc, tb):
-                        return False
-                def no_grad_ctx():
-                    return _NoopCtx()
-
-            inputs = tokenizer(
-                full_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=max_input_tokens,
-            ).to(llm.device)
-
-            do_sample = False if _LLM_DEVICE == 'cpu' else True
-            if (temperature and float(temperature) > 0.0) or (top_p and float(top_p) < 1.0):
-                if _LLM_DEVICE == 'cpu':
-                    logger.info('Enabling sampling on CPU because temperature/top_p request sampling (temperature=%s top_p=%s)', temperature, top_p)
-                do_sample = True
-
-            generate_kwargs = dict(
-                max_new_tokens=max_new_tokens,
-                do_sample=do_sample,
-                use_cache=False if _LLM_DEVICE == 'cpu' else True,
-            )
-            if do_sample:
-                generate_kwargs.update(temperature=temperature, top_p=top_p)
-            max_time = float(os.environ.get('LLAMA_MAX_TIME', str(default_max_time)))
-            if max_time > 0:
-                generate_kwargs['max_time'] = max_time
-
-            try:
-                with no_grad_ctx():
-                    output = llm.generate(**inputs, **generate_kwargs)
-                input_len = int(inputs["input_ids"].shape[1])
-                gen_tokens = output[0][input_len:]
-                result = tokenizer.decode(gen_tokens, skip_special_tokens=True).strip()
-                try:
-                    import re as _re
-                    raw_lines = result.split("\n")
-                    lines = []
-                    for ln in raw_lines:
-                        stripped = ln.strip()
-                        # If the model starts echoing system/meta sections, stop there
-                        if _re.match(r"^(System instructions:|<SYS>|</SYS>|<CONTEXT>|</CONTEXT>|<CONV>|</CONV>|Instruction\b|You are now role-?playing)", stripped, _re.I):
-                            break
-                        lines.append(ln)
-                    if lines and lines[0].strip().lower().startswith('assistant:'):
-                        lines[0] = lines[0].split(':', 1)[1].strip()
-                    # Drop any trailing hallucinated Q&A style turns (User:/Assistant:)
-                    cleaned = []
-                    for ln in lines:
-                        if _re.match(r"^(User:|<User>:|Assistant:|<Assistant>:)", ln.strip(), _re.I):
-                            break
-                        cleaned.append(ln)
-                    result = "\n".join(cleaned).strip()
-                except Exception:
-                    pass
-                try:
-                    gen_token_count = int(gen_tokens.shape[0]) if hasattr(gen_tokens, 'shape') else None
-                except Exception:
-                    gen_token_count = None
-                truncated_candidate = False
-                try:
-                    if gen_token_count is not None and max_new_tokens and gen_token_count >= max_new_tokens - 2:
-                        truncated_candidate = True
-                    elif result and result[-1] not in ('.', '!', '?') and len(result) > 40:
-                        truncated_candidate = True
-                except Exception:
-                    truncated_candidate = False
-                if truncated_candidate and not (force_fallback or model_missing):
-                    try:
-                        logger.info('Generation likely truncated (used %s tokens of %s); attempting one continuation', gen_token_count, max_new_tokens)
-                        continuation_system = (
-                            "Continue the previous assistant reply smoothly. "
-                            "Do not repeat any text already said. Do not add labels or headings. "
-                            "Finish the thought with complete sentences."
-                        )
-                        continuation_text = (
-                            f"{continuation_system}\n\nPrevious reply:\n{result}\n\nContinue:\n"
-                        )
-                        inputs2 = tokenizer(
-                            continuation_text,
-                            return_tensors="pt",
-                            truncation=True,
-                            max_length=max_input_tokens,
-                        ).to(llm.device)
-                        extra_kwargs = dict(generate_kwargs)
-                        extra_budget = min(max(max_new_tokens * 2, 160), 512)
-                        extra_kwargs['max_new_tokens'] = extra_budget
-                        if max_time:
-                            extra_kwargs['max_time'] = float(max_time) * 1.5
-                        with no_grad_ctx():
-                            out2 = llm.generate(**inputs2, **extra_kwargs)
-                        input_len2 = int(inputs2["input_ids"].shape[1])
-                        gen2 = out2[0][input_len2:]
-                        cont_text = tokenizer.decode(gen2, skip_special_tokens=True).strip()
-                        if cont_text:
-                            result = (result + " " + cont_text).strip()
-                            logger.info('Continuation appended (len now=%d)', len(result))
-                    except Exception:
-                        logger.exception('Continuation generation failed; keeping original truncated result')
-                if not result:
-                    try:
-                        full_decoded = tokenizer.decode(output[0], skip_special_tokens=True).strip()
-                    except Exception:
-                        full_decoded = None
-                    try:
-                        out_tokens = int(output[0].shape[1])
-                    except Exception:
-                        out_tokens = None
-                    logger.warning('Empty generation from LLM: input_len=%s output_tokens=%s full_decoded_preview=%r', input_len, out_tokens, (full_decoded or '')[:300])
-                    result = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-                    logger.info('Applied conversational fallback due to empty generation; fallback_preview=%s', (result or '')[:200])
-            except Exception as gen_err:
-                logger.error(f"LLM generation failed, using fallback: {gen_err}")
-                result = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-            # If Hindi is requested, always translate the English LLM answer to Hindi
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    translated = _translate_with_llm_to_hindi(result or '')
-                    if translated:
-                        result = translated
-            except Exception:
-                pass
-            try:
-                preview = (result or '')[:200].replace('\n', ' ')
-            except Exception:
-                preview = '<unprintable>'
-            logger.info('Generated response (len=%d) preview: %s', len(result or ''), preview)
-            latency_ms = int((time.time() - req_start) * 1000)
-
-            want_tts = False
-            try:
-                env_autotts = os.environ.get('LLAMA_AUTOTTS', '').strip().lower()
-                if env_autotts in ('1', 'true', 'yes'):
-                    want_tts = True
-                req_tts = data.get('tts')
-                if isinstance(req_tts, bool):
-                    want_tts = req_tts
-                elif isinstance(req_tts, str):
-                    if req_tts.strip().lower() in ('1', 'true', 'yes'):
-                        want_tts = True
-            except Exception:
-                want_tts = False
-
-            audio_url = None
-            tts_error = None
-            if want_tts:
-                try:
-                    voice_id = data.get('voice') or data.get('ttsVoice') or None
-                    out_path = unique_filename('speech', 'wav')
-                    tts_text = sanitize_text_for_tts(result)
-                    if 'tts_local_basic' in globals() and _EDGE_LOCAL_AVAILABLE:
-                        wav_path = tts_local_basic(tts_text, out_path=out_path, voice=voice_id)
-                    else:
-                        wav_path = generate_tts_file(tts_text, voice_id=voice_id)
-                    filename = os.path.basename(wav_path)
-                    audio_url = f"/generated_audio/{filename}"
-                except Exception as tte:
-                    logger.exception('Failed to generate TTS for assistant reply')
-                    tts_error = str(tte)
-
-            resp = {
-                "result": result,
-                "retrieved_count": len(retrieved_chunks),
-                "rag_score": float(rag_score) if rag_score is not None else None,
-                "source": "rag" if rag_reliable else "general",
-                "temperature": round(float(temperature), 2),
-                "top_p": round(float(top_p), 2),
-                "used_max_new_tokens": int(max_new_tokens),
-                "latency_ms": latency_ms,
-                "wants_long": False,
-                "llm_used": not (force_fallback or model_missing),
-            }
-            if audio_url:
-                resp['audio_url'] = audio_url
-            if tts_error:
-                resp['tts_error'] = tts_error
-            return jsonify(resp)
-        except Exception as e:
-            logging.error(f"Error in /llama-chat: {e}")
-            return jsonify({"error": str(e)}), 500
-
-    @app.route('/llama-chat-stream', methods=['POST', 'OPTIONS'])
-    def llama_chat_stream():
-        if request.method == 'OPTIONS':
-            return ("", 200)
-        req_start = time.time()
-        try:
-            data = request.get_json() or {}
-            prompt = data.get('prompt')
-            if not prompt:
-                return jsonify({"error": "No prompt provided"}), 400
-            lang_hint = (data.get('lang') or data.get('locale') or '').strip()
-            history = data.get('history')
-            if not isinstance(history, list):
-                history = []
-            history = history[-12:]
-            age_group = (
-                data.get('ageGroup')
-                or data.get('agegroup')
-                or data.get('age_group')
-                or data.get('AgeGroup')
-            )
-            user_name = (
-                data.get('name') or data.get('Name') or data.get('username') or data.get('user_name')
-            )
-            if isinstance(age_group, str):
-                agl = age_group.strip().lower()
-                age_group = 'kid' if agl in ('child','children','kids','kiddo') else agl
-            if isinstance(user_name, str):
-                user_name = user_name.strip()
-
-            if embedder is None or index is None or chunks is None:
-                allow = os.environ.get('LLAMA_ALLOW_FALLBACK_WITHOUT_RAG','').strip().lower() in ('1','true','yes')
-                if not allow:
-                    return jsonify({"error": "RAG components not initialized"}), 503
-
-            query_emb = embedder.encode([prompt])
-            query_arr = np.array(query_emb, dtype=np.float32)
-            if query_arr.ndim == 1:
-                query_arr = np.expand_dims(query_arr, 0)
-            D, I = index.search(query_arr, k=3)
-            retrieved_chunks = [chunks[i] for i in I[0] if 0 <= i < len(chunks)]
-            rag_score = None
-            try:
-                if D is not None and len(D) > 0 and len(D[0]) > 0:
-                    d0 = float(D[0][0])
-                    if 0.0 <= d0 <= 1.0:
-                        rag_score = max(0.0, min(1.0, 1.0 - d0))
-                    elif 0.0 <= d0 <= 2.0:
-                        rag_score = max(0.0, min(1.0, 1.0 - (d0 / 2.0)))
-            except Exception:
-                rag_score = None
-            rag_reliable = bool(retrieved_chunks) and (rag_score is not None and rag_score >= 0.70)
-            context = "\n\n---\n\n".join(retrieved_chunks) if retrieved_chunks else ""
-            max_context_chars = int(os.environ.get('RAG_CONTEXT_CHARS', '1200'))
-            if len(context) > max_context_chars:
-                context = context[:max_context_chars] + "\n[context truncated]"
-
-            persona_lines = []
-            if user_name:
-                persona_lines.append(f"The user's name is {user_name}.")
-            persona_lines.append("Speak as ChaCha in first person (I/me) with a warm, friendly tone—natural, concise, and human.")
-            if age_group == 'kid':
-                persona_lines.append("Use simple, positive language; short example or story; end with one friendly question.")
-            elif age_group == 'teen':
-                persona_lines.append("Keep it concise, friendly, and practical — one or two short paragraphs.")
-            else:
-                persona_lines.append("Be concise and conversational; prefer short paragraphs (2–4). Avoid lists unless asked.")
-            persona_lines.append("Ask one brief, tailored follow‑up question to keep the chat flowing, unless the user asks for a one‑shot answer.")
-            persona_lines.append("Use light empathy and clarifying questions when the user’s goal is ambiguous.")
-            persona_lines.append("Do not include role labels or markdown headings in the reply.")
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    persona_lines.append("Respond entirely in Hindi using Devanagari script. Keep it natural and simple; avoid English mixing except proper nouns. If the context is in English, translate it into Hindi as you answer.")
-                elif lang_hint:
-                    if str(lang_hint).strip().lower().startswith('en'):
-                        persona_lines.append("Respond in English (Indian English tone).")
-            except Exception:
-                pass
-            if rag_reliable:
-                persona_lines.append("Use the context below as your primary source. If you add general knowledge, keep it minimal and integrated naturally.")
-            else:
-                persona_lines.append("Context appears weak or missing. Answer from general knowledge clearly and helpfully without apologies or disclaimers.")
-            system_preface = "\n".join(persona_lines)
-
-            convo_lines = []
-            for m in history:
-                role = str(m.get('role','')).strip().lower()
-                content = str(m.get('content','')).strip()
-                if not content:
-                    continue
-                if role == 'user':
-                    convo_lines.append(f"User: {content}")
-                elif role == 'assistant':
-                    convo_lines.append(f"Assistant: {content}")
-            conversation_block = "\n".join(convo_lines)
-            full_prompt = (
-                "<SYS>\n"
-                + system_preface
-                + "\nNever mention or quote the <SYS>, <CONTEXT>, or <CONV> sections.\n</SYS>\n\n"
-                + "<CONV>\n" + (conversation_block or "") + "\n</CONV>\n\n"
-                + "<CONTEXT>\n" + (context or "") + "\n</CONTEXT>\n\n"
-                + "User: " + prompt + "\nAssistant:"
-            )
-
-            speed_preset = (os.environ.get('LLAMA_SPEED_PRESET') or env_vars.get('LLAMA_SPEED_PRESET') or 'balanced').strip().lower()
-            try:
-                req_speed = (data.get('speed') or data.get('speed_preset') or '').strip().lower()
-                if req_speed in ('fast','balanced','quality'):
-                    speed_preset = req_speed
-            except Exception:
-                pass
-            if speed_preset not in ('fast','balanced','quality'):
-                speed_preset = 'balanced'
-
-            temperature = 0.2
-            top_p = 0.9
-            if _LLM_DEVICE == 'cpu':
-                preset_tokens = {'fast': 48, 'balanced': 72, 'quality': 104}
-                default_max_time = {'fast': 4.0, 'balanced': 6.0, 'quality': 8.0}[speed_preset]
-            else:
-                preset_tokens = {'fast': 128, 'balanced': 196, 'quality': 320}
-                default_max_time = {'fast': 8.0, 'balanced': 14.0, 'quality': 22.0}[speed_preset]
-            max_new_tokens = int(os.environ.get('LLAMA_MAX_NEW_TOKENS', str(preset_tokens[speed_preset])))
-            try:
-                if (lang_hint and str(lang_hint).strip().lower().startswith('hi')) or ('कहानी' in (prompt or '')) or ('story' in (prompt or '').lower()):
-                    max_new_tokens = int(max_new_tokens * 1.25)
-            except Exception:
-                pass
-            if age_group == 'kid':
-                temperature = 0.7
-            elif age_group == 'teen':
-                temperature = 0.4
-            max_input_tokens = int(os.environ.get('LLAMA_MAX_INPUT_TOKENS', '1024'))
-            max_time = float(os.environ.get('LLAMA_MAX_TIME', str(default_max_time)))
-
-            if tokenizer is None or llm is None or TextIteratorStreamer is None:
-                def gen_fallback():
-                    text = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-                    yield json.dumps({"delta": text}) + "\n"
-                    meta = {
-                        "done": True,
-                        "retrieved_count": len(retrieved_chunks),
-                        "rag_score": float(rag_score) if rag_score is not None else None,
-                        "source": "rag" if rag_reliable else "general",
-                        "temperature": round(float(temperature),2),
-                        "top_p": round(float(top_p),2),
-                        "used_max_new_tokens": int(max_new_tokens),
-                        "latency_ms": int((time.time() - req_start) * 1000),
-                        "llm_used": False,
-                    }
-                    yield json.dumps(meta) + "\n"
-                from flask import Response
-                return Response(gen_fallback(), mimetype='application/x-ndjson')
-
-            try:
-                import torch
-                no_grad_ctx = torch.inference_mode
-            except Exception:
-                class _NoopCtx:
-                    def __enter__(self):
-                        return None
-                    def __exit__(self, exc_type, exc, tb):
-                        return False
-                def no_grad_ctx():
-                    return _NoopCtx()
-
-            inputs = tokenizer(full_prompt, return_tensors='pt', truncation=True, max_length=max_input_tokens).to(llm.device)
-            do_sample = False if _LLM_DEVICE == 'cpu' else True
-            if (temperature and float(temperature) > 0.0) or (top_p and float(top_p) < 1.0):
-                do_sample = True
-            generate_kwargs = dict(max_new_tokens=max_new_tokens, do_sample=do_sample, use_cache=False if _LLM_DEVICE=='cpu' else True)
-            if do_sample:
-                generate_kwargs.update(temperature=temperature, top_p=top_p)
-            if max_time > 0:
-                generate_kwargs['max_time'] = max_time
-
-            streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
-
-            def run_generate():
-                with no_grad_ctx():
-                    llm.generate(**inputs, streamer=streamer, **generate_kwargs)
-
-            def gen_stream():
-                import threading as _th
-                th = _th.Thread(target=run_generate, daemon=True)
-                th.start()
-                for piece in streamer:
-                    if not piece:
-                        continue
-                    yield json.dumps({"delta": piece}) + "\n"
-                th.join(timeout=0.1)
-                meta = {
-                    "done": True,
-                    "retrieved_count": len(retrieved_chunks),
-                    "rag_score": float(rag_score) if rag_score is not None else None,
-                    "source": "rag" if rag_reliable else "general",
-                    "temperature": round(float(temperature),2),
-                    "top_p": round(float(top_p),2),
-                    "used_max_new_tokens": int(max_new_tokens),
-                    "latency_ms": int((time.time() - req_start) * 1000),
-                    "llm_used": True,
-                }
-                yield json.dumps(meta) + "\n"
-
-            from flask import Response
-            return Response(gen_stream(), mimetype='application/x-ndjson')
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
-
-    return app
-
-app = create_app()
-
-try:
-    skip_tts = (os.environ.get('SKIP_TTS_LOAD') or os.environ.get('SKIP_TTS') or '').strip().lower()
-    if skip_tts in ('1', 'true', 'yes'):
-        logger.info('SKIP_TTS_LOAD set — skipping TTS preload at startup')
-    else:
-        _preload_tts_async()
-except Exception:
-    logger.exception('Failed to evaluate/start TTS preload')
-
-if __name__ == '__main__':  # pragma: no cover
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
-def _kid_story_fallback(topic: str | None, lang: str | None = None) -> str:
-    """Short story-style fallback for kids when RAG is weak or model is missing."""
-    t = (topic or "the Ganga river").strip()
-    # Hindi variant when lang starts with 'hi'
-    try:
-        if lang and str(lang).strip().lower().startswith('hi'):
-            return (
-                "यह बात मेरी स्थानीय नोट्स में साफ़ नहीं मिली, इसलिए एक छोटी-सी कहानी से समझाते हैं। "
-                "एक शाम गंगा किनारे आशा और उसके चचेरे भाई रोहन ने चमकता पानी देखा।"
-                "उन्हें कुछ प्लास्टिक कप तैरते दिखे, तो दोनों ने मिलकर उन्हें उठा लिया। पास के मछुआरे ने मुस्कराकर कहा, ‘जब हम नदी को साफ़ रखते हैं, तो मछलियाँ और डॉल्फ़िन स्वस्थ रहती हैं और हमारे शहर भी बेहतर बनते हैं।’ "
-                "अगले दिन उनकी कक्षा ने एक छोटा-सा बोर्ड लगाया: ‘कचरा डस्टबिन में डालें — हमारी नदी हमारा परिवार।’ "
-                "इतनी-सी पहल से घाट साफ़ दिखने लगा और दूसरे लोग भी मदद करने लगे। क्या मैं बच्चों के लिए एक छोटा-सा काम बताऊँ जो आप आज ही कर सकते हैं?"
-            )
-    except Exception:
-        pass
-    core = (
-        "I couldn't find this in my local notes; here’s a simple story to explain it. "
-        "One evening by the Ganga, Asha and her cousin Rohan watched the water sparkle near their ghat. "
-        "They noticed a few plastic cups floating and decided to pick them up. A fisherman smiled and said, ‘When we keep the river clean, fish and dolphins stay healthy, and our towns do better too.’ "
-        "Next day, their class put up a little sign: ‘Please use the dustbin — our river is family.’ "
-        "That tiny action made the steps look nicer, and more people started helping. Would you like a tiny tip on how kids can care for the river?"
-    )
-    return core
-def _conversational_fallback(topic: str, name: str | None, age_group: str | None, history: list[dict] | None, lang: str | None = None) -> str:
-    """Heuristic, natural-sounding fallback when LLM isn't available.
-    - Warmer tone, short and human.
-    - References known topics with a one-line follow-up question.
-    - Uses recent context lightly (last user message) if present.
-    """
-    t = (topic or "").strip()
-    nm = (name or "friend").strip()
-    ag = (age_group or "").strip().lower() or None
-    lt = t.lower()
-    # Last user message if any
-    last_user = None
-    try:
-        if history:
-            for m in reversed(history[-6:]):
-                if str(m.get('role')) in ('user', 'User'):
-                    last_user = str(m.get('content') or '').strip()
-                    break
-    except Exception:
-        pass
-
-    def _is_expand_request(txt: str) -> bool:
-        txt = (txt or '').lower().strip()
-        hi_keywords = ["विस्तार", "और बताओ", "ज्यादा", "डिटेल", "विस्तृत", "और समझाओ", "थोड़ा और", "और जानकारी", "और बताइए"]
-        en_keywords = ["expand", "elaborate", "more detail", "details", "continue", "tell me more", "go deeper"]
-        return any(k in txt for k in hi_keywords) or any(k in txt for k in en_keywords)
-
-    # Greeting intents
-    greetings = {"hi", "hello", "hey", "yo", "hola", "namaste", "hi!", "hello!", "hey!", "नमस्ते", "नमस्ते!"}
-    if lt in greetings or any(lt.startswith(g+" ") for g in greetings):
-        # Hindi greeting when requested
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                opener_hi = f"नमस्ते {nm}!" if name else "नमस्ते!"
-                return (
-                    f"{opener_hi} मैं चाचा हूँ। "
-                    "आज हम क्या जानें — गंगा, नमामि गंगे, या कुछ और?"
-                )
-        except Exception:
-            pass
-        opener = f"Hey {nm}!" if name else "Hey there!"
-        return (
-            f"{opener} I’m ChaCha. Great to see you. "
-            f"What should we explore today — the Ganga, Namami Gange, or something else you’re curious about?"
-        )
-
-    if "namami gange" in lt or "namami ganga" in lt:
-        # Hindi path
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                core = (
-                    "नमामि गंगे गंगा की सफाई और संरक्षण के लिए भारत का मिशन है — सीवरेज ट्रीटमेंट बनाना, प्रदूषण कम करना, आवास बहाल करना और जनभागीदारी बढ़ाना।"
-                )
-                follow = "क्या किसी शहर की वास्तविक परियोजना का छोटा उदाहरण बताऊँ?"
-                return f"{('हाय ' + nm + ', ') if name else ''}{core} {follow}"
-        except Exception:
-            pass
-        core = (
-            "Namami Gange is India’s mission to clean and protect the Ganga — building sewage treatment, reducing pollution, restoring habitats, and involving people."
-        )
-        follow = "Want a quick example from a real city project?"
-        return f"{f'Hi {nm}, ' if name else ''}{core} {follow}"
-
-    if "river ganga" in lt or "ganga river" in lt or "ganges" in lt or "गंगा" in lt:
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                core = (
-                    "गंगा करोड़ों लोगों की जीवनरेखा है — कईयों के लिए पवित्र, खेती और शहरों के लिए आवश्यक, और गंगेटिक डॉल्फ़िन जैसे अनोखे जीवों का घर।"
-                )
-                follow = "क्या हम वन्यजीव, संस्कृति या नदी को स्वस्थ रखने के तरीक़ों पर बात करें?"
-                return f"{('हाय ' + nm + ', ') if name else ''}{core} {follow}"
-        except Exception:
-            pass
-        core = (
-            "The Ganga is a lifeline for millions — sacred to many, vital for farms and cities, and home to unique wildlife like the Ganges river dolphin."
-        )
-        follow = "Should we talk about wildlife, culture, or how the river is kept healthy?"
-        return f"{f'Hi {nm}, ' if name else ''}{core} {follow}"
-
-    # If user asks to expand/elaborate, give a deeper answer based on recent topic
-    if _is_expand_request(lt):
-        base_topic = last_user if last_user and last_user != t else last_user or t
-        return _detailed_about(base_topic or t, ag, lang)
-
-    # Generic, topic-aware fallback with a hint of continuity
-    if last_user and last_user != t and len(last_user) > 3:
-        # English continuity note
-        continuity = f"You mentioned earlier: '{last_user}'. "
-        # For Hindi mode, avoid leaking English by not quoting the previous text
-        continuity_hi = "आपने पहले यही पूछा था। "
-    else:
-        continuity = ""
-        continuity_hi = ""
-    follow = "Does that help, or should I go deeper with a short example?"
-    follow_hi = "क्या यह मददगार है, या एक छोटा उदाहरण देकर और विस्तार करूँ?"
-    # Slightly simpler phrasing for kids
-    if ag == 'kid':
-        try:
-            if lang and str(lang).strip().lower().startswith('hi'):
-                return (
-                    f"हाय {nm}, मैं {t} के बारे में आसान शब्दों में समझाता हूँ। "
-                    f"{continuity_hi}मैं इसे छोटा और दोस्ताना रखूँगा ताकि आसानी से याद रहे। {follow_hi}"
-                )
-        except Exception:
-            pass
-        return (
-            f"Hi {nm}, here’s the idea about {t} in simple words you can follow. "
-            f"{continuity}I’ll keep it short and friendly so it’s easy to remember. {follow}"
-        )
-    # Adult/teen generic
-    try:
-        if lang and str(lang).strip().lower().startswith('hi'):
-            return (
-                f"{t} की मूल बातें — साफ़ और संक्षेप में। {continuity_hi}{follow_hi}"
-            )
-    except Exception:
-        pass
-    return (
-        f"Here’s the gist of {t}: clear and to the point. {continuity}{follow}"
-    )
-
-def _teen_short_about(topic: str) -> str:
-    lt = (topic or "").lower()
-    if "namami gange" in lt or "namami ganga" in lt:
-        return (
-            "Namami Gange is India’s national mission (launched 2014) to clean and rejuvenate the Ganga: "
-            "sewage treatment plants, river-surface cleaning, industrial effluent control, biodiversity, afforestation, and public participation. "
-            "Goal: sustained reduction in pollution and a healthier river ecosystem."
-        )
-    return (
-        f"Here’s the gist of {topic}: key ideas explained clearly in a few lines, with causes, effects, and one practical example."
-    )
-
-def _adult_short_about(topic: str) -> str:
-    lt = (topic or "").lower()
-    if "namami gange" in lt or "namami ganga" in lt:
-        return (
-            "Namami Gange (2014–) is GoI’s flagship river rejuvenation programme: "
-            "pillars include sewage infrastructure, industrial discharge control, riverfront development, biodiversity conservation, afforestation, and public engagement."
-        )
-    return (
-        f"Summary of {topic}: concise definition, 2–3 pillars, and intended outcomes."
-    )
-
-def _detailed_about(topic: str, age_group: str | None, lang: str | None = None) -> str:
-    """Provide a deeper 5–7-line explanation of a topic in the selected language.
-    Used when the user asks to expand/elaborate.
-    """
-    t = (topic or "").strip()
-    ag = (age_group or "").strip().lower() or None
-    lt = t.lower()
-
-    is_hi = False
-    try:
-        if lang and str(lang).strip().lower().startswith('hi'):
-            is_hi = True
-    except Exception:
-        pass
-
-    if is_hi:
-        if "namami gange" in lt or "namami ganga" in lt or "नमामि गंगे" in lt:
-            return (
-                "नमामि गंगे का उद्देश्य गंगा को दीर्घकाल तक स्वच्छ और अविरल बनाए रखना है। "
-                "मुख्य कार्य: (1) सीवरेज शोधन संयंत्र (STP) का निर्माण और उन्नयन, (2) औद्योगिक अपशिष्ट पर नियंत्रण, "
-                "(3) नदी सतह की सफाई और ठोस कचरा प्रबंधन, (4) जैव-विविधता संरक्षण और तटीय वृक्षारोपण, (5) जनभागीदारी और गंगा प्रहरी। "
-                "उदाहरण: कानपुर/वाराणसी में नए STP से लाखों लीटर असंशोधित जल सीधे नदी में जाने से रुका। "
-                "परिणाम: BOD/DO सूचक बेहतर हुए, डॉल्फ़िन/घड़ियाल आवास में सुधार दिखा, नदी तटीय सौंदर्यीकरण से पर्यटन बढ़ा। "
-                "आप चाहें तो मैं किसी एक शहर की परियोजना का संक्षिप्त केस-स्टडी भी बता सकता हूँ।"
-            )
-        if "ganga" in lt or "ganges" in lt or "गंगा" in lt:
-            return (
-                "गंगा हिमालय से निकलकर मैदानों से होती हुई बंगाल की खाड़ी तक जाती है। "
-                "यह कृषि, पेयजल, नौवहन और आस्था—सबकी केंद्र है। "
-                "चुनौतियाँ: शहरी/औद्योगिक अपशिष्ट, असंगठित ठोस कचरा, तटीय क्षरण, जल-प्रवाह में कमी। "
-                "समाधान: उपचारित सीवरेज का पुनः उपयोग, वर्षा-जल संचयन, जल-मित्र कृषि, तटीय हरियाली, और समुदाय-आधारित निगरानी। "
-                "क्या मैं किसी एक चुनौती (जैसे औद्योगिक प्रदूषण) पर गहराई से समझाऊँ?"
-            )
-        # Generic detailed
-        return (
-            f"{t} को आसान भाषा में विस्तार से समझें: परिभाषा, 3–4 मुख्य बिंदु, एक छोटा उदाहरण, और करने योग्य कदम। "
-            "बताइए किस हिस्से पर और गहराई चाहिए—कारण, प्रभाव, नीतियाँ या ज़मीनी उदाहरण?"
-        )
-
-    # English detailed fallback
-    if "namami gange" in lt or "namami ganga" in lt:
-        return (
-            "Namami Gange aims for long-term river health: (1) STP build/upgrade, (2) industrial effluent control, (3) surface cleaning & solid waste, "
-            "(4) biodiversity & riparian plantations, (5) public participation (Ganga Praharis). Example: new STPs in Kanpur/Varanasi curbed untreated discharge. "
-            "Outcomes: improved BOD/DO, better habitats, cleaner ghats and tourism. I can share a short case study for any one city."
-        )
-    if "ganga" in lt or "ganges" in lt:
-        return (
-            "The Ganga runs from the Himalayas to the Bay of Bengal—vital for farms, drinking water, transport, and culture. "
-            "Challenges: urban/industrial discharge, unmanaged solid waste, bank erosion, reduced flows. "
-            "Solutions: treated reuse, rainwater harvesting, water-smart farming, riparian greens, community monitoring. "
-            "Want me to dive deeper into one challenge (e.g., industrial pollution)?"
-        )
-    return (
-        f"Here’s a deeper look at {t}: definition, 3–4 pillars, one example, and next steps. Tell me which part to expand further."
-    )
-
-# --- Progressive expansion helpers (for multi-message Hindi answers) ---
-def _is_expand_request_text(txt: str | None) -> bool:
-    s = (txt or '').strip().lower()
-    hi_keys = ["विस्तार", "आगे बताइए", "आगे बताओ", "आगे जारी", "जारी रखें", "और बताइए", "और बताओ", "कृपया आगे"]
-    en_keys = ["continue", "more", "elaborate", "expand", "go deeper", "next part"]
-    return any(k in s for k in hi_keys) or any(k in s for k in en_keys)
-
-def _count_prev_parts(history: list[dict] | None, lang: str | None) -> int:
-    if not history:
-        return 0
-    is_hi = str(lang or '').strip().lower().startswith('hi')
-    count = 0
-    try:
-        import re
-        pat = re.compile(r"भाग\s*(\d+)") if is_hi else re.compile(r"Part\s*(\d+)", re.I)
-        for m in history[-10:]:
-            if str(m.get('role','')).lower() != 'assistant':
-                continue
-            text = str(m.get('content') or '')
-            for num in pat.findall(text):
-                try:
-                    n = int(num)
-                    count = max(count, n)
-                except Exception:
-                    continue
-    except Exception:
-        return 0
-    return count
-
-def _last_non_expand_user(history: list[dict] | None) -> str | None:
-    if not history:
-        return None
-    for m in reversed(history[-8:]):
-        try:
-            if str(m.get('role','')).lower() == 'user':
-                txt = str(m.get('content') or '').strip()
-                if not _is_expand_request_text(txt):
-                    return txt
-        except Exception:
-            continue
-    return None
-
-def _detailed_parts(topic: str, lang: str | None) -> list[str]:
-    t = (topic or '').strip() or 'विषय'
-    is_hi = str(lang or '').strip().lower().startswith('hi')
-    if is_hi:
-        return [
-            f"परिचय ({t}): यह क्यों महत्वपूर्ण है, किसे लाभ होता है, और वर्तमान स्थिति क्या है।",
-            "मुख्य स्तंभ/पहल: 3–4 बिंदुओं में — क्या किया जा रहा है, कौन-सी संस्था जुड़ी है, और प्रगति कैसे मापते हैं।",
-            "उदाहरण + आगे के कदम: किसी एक शहर/क्षेत्र का छोटा केस‑स्टडी, फिर नागरिक के रूप में आप क्या कर सकते हैं।",
-        ]
-    else:
-        return [
-            f"Introduction to {t}: why it matters, who benefits, and the present landscape.",
-            "Core pillars/actions in 3–4 bullets: what is being done, by whom, and how progress is measured.",
-            "Example + next steps: a short city case study, then what a citizen can do today.",
-        ]
-
-def create_app_legacy_disabled():
-    app = Flask(__name__)
-
-    # CORS configuration (allow frontend origins; support comma-separated env)
-    frontend_origin = os.environ.get('FRONTEND_URL') or env_vars.get('FRONTEND_URL')
-    if frontend_origin:
-        origins = [o.strip() for o in str(frontend_origin).split(',') if o.strip()]
-    else:
-        # Sensible defaults for local dev and the deployed Vercel app
-        origins = [
-            'http://localhost:5173',
-            'http://127.0.0.1:5173',
-            'http://localhost:3000',
-            'https://cha-cha-chaudari.vercel.app',
-        ]
-    cors_kwargs = dict(
-        origins=origins,
-        allow_headers=["Content-Type", "Authorization"],
-        methods=["GET", "POST", "OPTIONS"],
-        max_age=86400,
-        supports_credentials=True,
-    )
-    CORS(app, **cors_kwargs)
-
-    # Register blueprints (auth, chats)
-    try:
-        # Import as local modules since app.py runs from /workspace/backend
-        from auth import auth_bp
-        from chat_routes import chat_bp
-        app.register_blueprint(auth_bp)
-        app.register_blueprint(chat_bp)
-    except Exception as e:
-        logger.warning(f"Blueprint registration failed (possibly during import stage): {e}")
-
-    # Legacy endpoints kept below
-
-    @app.route('/', methods=['GET'])
-    def root():
-        return jsonify({
-            'service': 'SmartGanga Mascot Backend',
-            'endpoints': ['/health', '/tts (POST)', '/stt (POST)', '/llama-chat (POST)']
-        })
+            if lh:
+                return lh.startswith('en')
+            return INPUT_LANGUAGE.startswith('en')
+        except Exception:
+            return False
 
     @app.route('/tts', methods=['POST'])
+    @_tts_cached
     def tts_endpoint():
-        """Accepts JSON {"text": "..."} and returns an mp3 file to play on client-side.
-        NOTE: The file is generated with a unique name to avoid concurrency issues."""
         data = request.get_json() or {}
         text = data.get('text')
         voice_id = data.get('voice') or None
@@ -2411,9 +3008,7 @@ def create_app_legacy_disabled():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         try:
-            # Allow clients to request a language or locale hint
             lang = (data.get('lang') or data.get('locale') or '').strip()
-            # Optionally accept an explicit playback rate (pyttsx3 absolute rate)
             rate = data.get('rate')
             try:
                 rate = int(rate) if rate is not None else None
@@ -2425,10 +3020,8 @@ def create_app_legacy_disabled():
                 seed = int(seed) if seed is not None else None
             except Exception:
                 seed = None
-            # If language provided and no explicit description, craft a short directive
             if lang and not description:
                 l = lang.lower()
-                # Basic mapping for common cases; description can control speaker/style for some engines
                 lang_map = {
                     'hi': 'Speak in Hindi with a neutral Indian accent.',
                     'hi-in': 'Speak in Hindi with a neutral Indian accent.',
@@ -2441,10 +3034,14 @@ def create_app_legacy_disabled():
                 else:
                     description = base
 
-            # Route to engine-specific generator (prefer offline local-basic for English)
             tts_start = time.time()
+            if TTS_ENGINE in ('edge', 'edge-tts') and _EDGE_LOCAL_AVAILABLE:
+                # Stream MP3 chunks straight through; nothing is written to DATA_DIR
+                try:
+                    return _stream_edge_tts(text, voice_id)
+                except Exception:
+                    logger.exception('edge-tts streaming failed; falling back to local engines')
             use_fast = _EDGE_LOCAL_AVAILABLE and _is_english_hint(lang)
-            # Avoid calling fast helper when voice_id looks engine-specific
             if voice_id:
                 vlow = str(voice_id).strip().lower()
                 if vlow.startswith('piper'):
@@ -2452,65 +3049,32 @@ def create_app_legacy_disabled():
                     use_fast = False
             if use_fast:
                 try:
-                    # Use offline local basic engine and return WAV
                     out_path = tts_local_basic(text, voice=voice_id, rate=rate)
                     mimetype = 'audio/wav'
                     logger.info(f"Fast local-basic TTS used for lang={lang}, out={out_path}")
-                    # If the produced file is suspiciously small (pyttsx3 sometimes
-                    # creates a header-only WAV on some Windows setups), try a
-                    # quick gTTS fallback instead of returning an empty-sounding file.
                     try:
-                        size = os.path.getsize(out_path) if out_path and os.path.exists(out_path) else 0
-                    except Exception:
+                        size = os.stat(out_path).st_size if out_path else 0
+                    except OSError:
                         size = 0
                     if size < 2000:
                         logger.warning('local-basic produced small file (%d bytes); attempting gTTS fallback', size)
+
                         try:
-                            from gtts import gTTS  # type: ignore
-                            fb_out = unique_filename('speech', 'mp3')
-                            tts_obj = gTTS(text, lang='hi' if (lang or '').lower().startswith('hi') else 'en')
-                            tts_obj.save(fb_out)
-                            logger.info('gTTS fallback produced %s', fb_out)
-                            try:
-                                wav_fb = convert_to_wav_file(fb_out)
-                                return _safe_send_file(wav_fb, 'audio/wav', 'gtts', voice_id)
-                            except Exception:
-                                # if conversion fails, still attempt to return original mp3
-                                return _safe_send_file(fb_out, 'audio/mpeg', 'gtts', voice_id)
+                            fb_audio, fb_mime = gtts_audio(text, 'hi' if (lang or '').lower().startswith('hi') else 'en')
+                            logger.info('gTTS fallback produced %s', fb_mime)
+                            return _safe_send_file(fb_audio, fb_mime, 'gtts', voice_id, cleanup=(out_path,))
                         except Exception:
                             logger.exception('gTTS fallback failed after small local-basic file; trying edge-tts fallback')
-                            # Try edge-tts fallback if available (edge_local_tts_stt.tts_edge_sync)
                             try:
-                                from edge_local_tts_stt import tts_edge_sync  # type: ignore
-                                fb_out = unique_filename('speech', 'mp3')
-                                tts_edge_sync(text, out_path=fb_out, voice=voice_id)
-                                logger.info('edge-tts fallback produced %s', fb_out)
-                                try:
-                                    wav_fb2 = convert_to_wav_file(fb_out)
-                                    return _safe_send_file(wav_fb2, 'audio/wav', 'edge-tts', voice_id)
-                                except Exception:
-                                    return _safe_send_file(fb_out, 'audio/mpeg', 'edge-tts', voice_id)
+                                return _stream_edge_tts(text, voice_id)
                             except Exception:
                                 logger.exception('edge-tts fallback also failed; returning original local-basic output')
-                    return _safe_send_file(out_path, mimetype, 'local-basic', voice_id)
+                    return _safe_send_file(out_path, mimetype, 'local-basic', voice_id, size=size)
                 except Exception as e:
                     logger.exception('fast local-basic TTS failed; falling back to configured engine')
-            # If the requested language is Hindi and Piper/local voices are not available,
-            # try a quick online fallback using gTTS (Google TTS) which supports Hindi.
-            # This keeps the UX working when local Piper voices are not installed.
             lhl = (lang or '').strip().lower()
             if lhl.startswith('hi'):
                 try:
-                    # Lazy import so gTTS isn't required unless we need it
-                    from gtts import gTTS  # type: ignore
-                    out_path = unique_filename('speech', 'mp3')
-                    tts_obj = gTTS(text, lang='hi')
-                    tts_obj.save(out_path)
-                    # If caller requested a male-sounding voice, attempt a simple
-                    # pitch-lowering post-process to make the voice deeper. This is
-                    # a lightweight heuristic (not a true male voice) and requires
-                    # pydub + ffmpeg available on the host. We try it if the client
-                    # requested gender:'male' or voice string includes 'male'.
                     want_male = False
                     try:
                         req_gender = (data.get('gender') or data.get('sex') or '').strip().lower()
@@ -2523,40 +3087,13 @@ def create_app_legacy_disabled():
                             want_male = True
                     except Exception:
                         pass
-                    if want_male:
-                        try:
-                            from pydub import AudioSegment  # type: ignore
-                            # Load generated mp3
-                            aud = AudioSegment.from_file(out_path, format='mp3')
-                            # Lower pitch by reducing frame rate then resampling back
-                            # Factor 0.85 gives a modest deeper voice; tweakable.
-                            factor = 0.85
-                            new_rate = int(aud.frame_rate * factor)
-                            deeper = aud._spawn(aud.raw_data, overrides={'frame_rate': new_rate})
-                            deeper = deeper.set_frame_rate(aud.frame_rate)
-                            # Overwrite same path as mp3
-                            deeper.export(out_path, format='mp3')
-                            logger.info('Applied pydub pitch-lowering to approximate male voice')
-                        except Exception:
-                            logger.exception('Failed to apply pitch-lowering postprocess; returning original gTTS audio')
-                    logger.info('Used gTTS fallback for Hindi synthesis (out=%s)', out_path)
-                    try:
-                        wav_path = convert_to_wav_file(out_path)
-                        return _safe_send_file(wav_path, 'audio/wav', 'gtts', voice_id)
-                    except Exception:
-                        return _safe_send_file(out_path, 'audio/mpeg', 'gtts', voice_id)
+                    audio, mimetype = gtts_audio(text, 'hi', 0.85 if want_male else None)
+                    logger.info('Used gTTS fallback for Hindi synthesis')
+                    return _safe_send_file(audio, mimetype, 'gtts', voice_id)
                 except Exception:
                     logger.exception('gTTS fallback for Hindi failed; trying edge-tts fallback')
                     try:
-                        from edge_local_tts_stt import tts_edge_sync  # type: ignore
-                        fb_out = unique_filename('speech', 'mp3')
-                        tts_edge_sync(text, out_path=fb_out, voice=voice_id)
-                        logger.info('edge-tts fallback produced %s', fb_out)
-                        try:
-                            wav_fb = convert_to_wav_file(fb_out)
-                            return _safe_send_file(wav_fb, 'audio/wav', 'edge-tts', voice_id)
-                        except Exception:
-                            return _safe_send_file(fb_out, 'audio/mpeg', 'edge-tts', voice_id)
+                        return _stream_edge_tts(text, voice_id)
                     except Exception:
                         logger.exception('edge-tts fallback for Hindi also failed; returning bundled sample if available')
                         sample = os.path.join(os.getcwd(), 'frontend', 'public', 'assets', 'chacha-cahaudhary', 'Greeting.wav')
@@ -2569,11 +3106,19 @@ def create_app_legacy_disabled():
                             except Exception:
                                 pass
                             return resp
-            # fallback to heavy engines
-            out_path = generate_tts_file(text, voice_id=voice_id)
+            fut = _submit_tts(text, voice_id)
+            if fut is None:
+                return jsonify({'error': 'TTS is busy; retry shortly'}), 503, {'Retry-After': '1'}
+            try:
+                out_path = fut.result(timeout=TTS_QUEUE_TIMEOUT)
+            except FutureTimeoutError:
+                fut.cancel()
+                return jsonify({'error': 'TTS timed out'}), 504
+            if isinstance(out_path, bytes):
+                # Synthesized in memory (no disk cache to fill)
+                return _safe_send_file(out_path, 'audio/wav', 'piper', voice_id)
             tts_latency_ms = int((time.time() - tts_start) * 1000)
             logger.info(f"TTS generation finished in {tts_latency_ms}ms (engine={TTS_ENGINE}, voice={voice_id}, lang={lang})")
-            # Piper produces WAV
             mimetype = 'audio/wav'
             logger.info('Returning generated TTS file: %s', out_path)
             return _safe_send_file(out_path, mimetype, TTS_ENGINE, voice_id)
@@ -2581,27 +3126,70 @@ def create_app_legacy_disabled():
             logger.exception('TTS endpoint error')
             return jsonify({'error': 'TTS generation failed', 'details': str(e)}), 500
 
-    # Lightweight local TTS/STT helpers (fast, offline where possible)
-    try:
-        from edge_local_tts_stt import tts_edge_sync, speech_recognition_once, tts_local_basic, list_local_basic_voices
-        _EDGE_LOCAL_AVAILABLE = True
-    except Exception:
-        _EDGE_LOCAL_AVAILABLE = False
-
-    def _is_english_hint(lang_hint: str | None) -> bool:
-        """Return True if lang_hint or configured InputLanguage indicates English."""
+    @app.route('/tts-stream', methods=['POST'])
+    def tts_stream():
+        """Piper synthesis streamed as one WAV: the header goes out first, then PCM as
+        each sentence is synthesized, so playback starts before the whole text is done.
+        The finished audio is added to the disk cache; cached texts are sent as files."""
+        data = request.get_json() or {}
+        text = data.get('text')
+        voice_id = data.get('voice') or None
+        if not text:
+            return jsonify({'error': 'No text provided'}), 400
+        voice = pick_indian_piper_voice(voice_id)
+        if not voice:
+            return jsonify({'error': 'No Piper voices available; use /tts'}), 503
+        model_path = _piper_model_path(voice)
+        config_path = voice['paths']['config']
+        headers = {'X-TTS-Engine': 'piper', 'X-Voice-Used': voice.get('shortName') or ''}
+        cached = _tts_cache_path('piper', model_path, text) if TTS_DISK_CACHE_MAX > 0 else None
+        if cached and _tts_cache_hit(cached):
+            resp = send_file(cached, mimetype='audio/wav', as_attachment=False, conditional=True)
+            resp.headers.update(headers)
+            resp.headers['X-TTS-Cache'] = 'hit'
+            return resp
+
+        rate = piper_sample_rate(config_path)
+        pcm = _piper_stream(model_path, config_path, text)
         try:
-            lh = (lang_hint or '').strip().lower()
-            if lh:
-                return lh.startswith('en')
-            cfg = (env_vars.get('InputLanguage') or os.environ.get('InputLanguage') or '').strip().lower()
-            return cfg.startswith('en')
-        except Exception:
-            return False
+            first = next(pcm, b'')
+        except Exception as e:
+            logger.exception('Piper streaming failed')
+            return jsonify({'error': 'TTS generation failed', 'details': str(e)}), 500
+        if not first:
+            return jsonify({'error': 'Piper produced no audio'}), 500
+
+        def body():
+            parts = [first]
+            try:
+                yield _streaming_wav_header(16, rate)
+                yield first
+                for chunk in pcm:
+                    parts.append(chunk)
+                    yield chunk
+            except Exception:
+                logger.exception('Piper streaming failed mid-response')
+                return
+            finally:
+                pcm.close()  # stops Piper if the client went away early
+            if cached:
+                # Keep the complete synthesis so repeats are served from disk
+                tmp = unique_filename('speech', 'wav')
+                try:
+                    write_wav_headered(tmp, b''.join(parts), 16, rate)
+                    if _tts_cache_store(tmp, cached) == tmp:
+                        _remove_generated([tmp])
+                except OSError:
+                    logger.warning('Could not cache streamed TTS output')
+                    _remove_generated([tmp])
+
+        resp = Response(body(), mimetype='audio/wav', headers=headers)
+        resp.headers['X-TTS-Cache'] = 'miss'
+        return resp
 
     @app.route('/fast-tts', methods=['POST'])
+    @_tts_cached
     def fast_tts():
-        # Prefer fully offline local-basic TTS (pyttsx3) and return WAV
         if not _EDGE_LOCAL_AVAILABLE:
             return jsonify({'error': 'fast-tts helper not available'}), 503
         data = request.get_json() or {}
@@ -2615,40 +3203,25 @@ def create_app_legacy_disabled():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         try:
-            # Always use offline local-basic here
             out = tts_local_basic(text, out_path=None, voice=voice, rate=rate)
             logger.info('fast-tts produced file: %s', out)
             try:
-                size = os.path.getsize(out) if out and os.path.exists(out) else 0
-            except Exception:
+                size = os.stat(out).st_size if out else 0
+            except OSError:
                 size = 0
             if size < 2000:
                 logger.warning('fast-tts produced small file (%d bytes); attempting gTTS fallback', size)
-    
+
                 try:
-                    from gtts import gTTS  # type: ignore
-                    fb_out = unique_filename('speech', 'mp3')
-                    tts_obj = gTTS(text, lang='en' if not (voice or '').lower().startswith('hi') else 'hi')
-                    tts_obj.save(fb_out)
-                    try:
-                        wav_fb = convert_to_wav_file(fb_out)
-                        return _safe_send_file(wav_fb, 'audio/wav', 'gtts', voice)
-                    except Exception:
-                        return _safe_send_file(fb_out, 'audio/mpeg', 'gtts', voice)
+                    fb_audio, fb_mime = gtts_audio(text, 'en' if not (voice or '').lower().startswith('hi') else 'hi')
+                    return _safe_send_file(fb_audio, fb_mime, 'gtts', voice, cleanup=(out,))
                 except Exception:
                     logger.exception('gTTS fallback failed for fast-tts; trying edge-tts fallback')
                     try:
-                        from edge_local_tts_stt import tts_edge_sync  # type: ignore
-                        fb_out = unique_filename('speech', 'mp3')
-                        tts_edge_sync(text, out_path=fb_out, voice=voice)
-                        try:
-                            wav_fb_e = convert_to_wav_file(fb_out)
-                            return _safe_send_file(wav_fb_e, 'audio/wav', 'edge-tts', voice)
-                        except Exception:
-                            return _safe_send_file(fb_out, 'audio/mpeg', 'edge-tts', voice)
+                        return _stream_edge_tts(text, voice)
                     except Exception:
                         logger.exception('edge-tts fallback failed for fast-tts; returning original')
-            return _safe_send_file(out, 'audio/wav', 'local-basic', voice)
+            return _safe_send_file(out, 'audio/wav', 'local-basic', voice, size=size)
         except Exception as e:
             logger.exception('fast-tts failed')
             return jsonify({'error': 'fast-tts failed', 'details': str(e)}), 500
@@ -2667,17 +3240,12 @@ def create_app_legacy_disabled():
     @app.route('/voices', methods=['GET'])
     def voices_endpoint():
         try:
-            # Prefer returning Piper voices when available (these are the voices
-            # used by the main TTS engine). If no Piper voices are found, fall
-            # back to local OS voices via pyttsx3 so the frontend still has
-            # something to show.
             piper_list = []
             try:
                 piper_list = get_piper_voices() or []
             except Exception:
                 piper_list = []
             if piper_list:
-                # Normalize to { id, shortName, locale }
                 items = []
                 for v in piper_list:
                     try:
@@ -2689,7 +3257,6 @@ def create_app_legacy_disabled():
                     except Exception:
                         continue
                 return jsonify({ 'count': len(items), 'voices': items, 'engine': 'piper' })
-            # Fallback: return local system voices
             items = list_local_basic_voices()
             return jsonify({ 'count': len(items), 'voices': items, 'engine': 'local-basic' })
         except Exception as e:
@@ -2697,43 +3264,25 @@ def create_app_legacy_disabled():
 
     @app.route('/tts-diagnostic', methods=['GET'])
     def tts_diagnostic():
-        """Return diagnostics about TTS availability and configured Piper path.
-        Helps debug why Piper voices may be missing or why synthesize_with_piper is unavailable.
-        """
         try:
             info = {
                 'piper_helper_imported': False,
                 'piper_path': PIPER_PATH,
+                'piper_in_process': PIPER_IN_PROCESS,
+                'piper_cuda': PIPER_CUDA,
                 'piper_voices_dir': PIPER_VOICES_DIR,
                 'piper_voices_count': 0,
                 'piper_voices_sample': [],
             }
-            # If piper helper is available, get cached voices
             try:
                 voices = get_piper_voices(force_refresh=True) or []
                 info['piper_helper_imported'] = True
                 info['piper_voices_count'] = len(voices)
-                # include up to 8 sample entries (id, shortName, locale)
                 info['piper_voices_sample'] = [ { 'id': v.get('id'), 'shortName': v.get('shortName'), 'locale': v.get('locale') } for v in voices[:8] ]
             except Exception as e:
                 info['piper_helper_imported'] = False
                 info['piper_error'] = str(e)
-            # Check for optional audio post-processing availability (pydub + ffmpeg)
-            try:
-                from pydub import AudioSegment  # type: ignore
-                info['pydub_available'] = True
-                # Try to detect ffmpeg by attempting to call AudioSegment.converter
-                try:
-                    ff = AudioSegment.converter
-                    info['ffmpeg_path'] = ff
-                    info['ffmpeg_available'] = bool(ff and os.path.exists(ff))
-                except Exception:
-                    info['ffmpeg_path'] = None
-                    info['ffmpeg_available'] = False
-            except Exception as e:
-                info['pydub_available'] = False
-                info['pydub_error'] = str(e)
-            # Check whether PIPER_PATH points to an executable file
+            info.update(_pydub_status())
             try:
                 info['piper_path_exists'] = os.path.isabs(PIPER_PATH) and os.path.exists(PIPER_PATH)
             except Exception:
@@ -2742,23 +3291,38 @@ def create_app_legacy_disabled():
         except Exception as e:
             return jsonify({'error': 'diagnostic failed', 'details': str(e)}), 500
 
-    # Serve generated audio files saved under Data/
     @app.route('/generated_audio/<path:filename>', methods=['GET'])
     def get_generated_audio(filename: str):
+        # tts_cache/ names hash the request (engine, voice, text), not the audio, and the file
+        # behind one is rewritten after TTS_CACHE_TTL_S or a voice model change: clients must
+        # revalidate (ETag / Last-Modified via conditional=True) and can seek with Range requests
+        pending = _PENDING_AUDIO.get(filename)
+        if pending is not None:
+            # Reply audio still being synthesized: hold the request until it is ready
+            try:
+                wav_path = pending.result(timeout=AUTOTTS_WAIT_S)
+            except FutureTimeoutError:
+                return jsonify({'error': 'audio not ready', 'tts_status': 'pending'}), 504
+            except Exception as e:
+                return jsonify({'error': 'failed to generate audio', 'details': str(e)}), 500
+            filename = os.path.relpath(os.path.abspath(wav_path), os.path.abspath(DATA_DIR)).replace(os.sep, '/')
         try:
-            path = os.path.join(DATA_DIR, filename)
-            if not os.path.isfile(path):
-                return jsonify({'error': 'file not found'}), 404
-            # Default to WAV for local-basic; clients should handle audio/wav
-            return send_file(path, mimetype='audio/wav', as_attachment=False)
+            resp = send_from_directory(DATA_DIR, filename, as_attachment=False, conditional=True,
+                                       mimetype='audio/mpeg' if filename.endswith('.mp3') else 'audio/wav')
+        except NotFound:
+            return jsonify({'error': 'file not found'}), 404
         except Exception as e:
             return jsonify({'error': 'failed to serve audio', 'details': str(e)}), 500
+        resp.headers['Cache-Control'] = 'public, no-cache'
+        return resp
 
     @app.route('/stt', methods=['POST'])
     def stt_endpoint():
+        upload = request.files.get('audio') or request.files.get('file')
+        if upload is not None:
+            return _transcribe_upload(upload)
         data = request.get_json() or {}
         text = data.get('text')
-        # If no text provided and fast STT is available and configured English, run live speech capture
         if not text:
             if _EDGE_LOCAL_AVAILABLE and _is_english_hint(None):
                 try:
@@ -2770,38 +3334,95 @@ def create_app_legacy_disabled():
             return jsonify({'error': 'No text provided'}), 400
         return jsonify({'result': text})
 
+    def _transcribe_upload(upload):
+        """Transcribe a multipart audio upload. Segments stream out as they are decoded:
+        NDJSON lines by default, SSE events for ``Accept: text/event-stream``; form field
+        ``stream=0`` returns one ``{"result": ...}`` instead."""
+        model = _get_whisper()
+        if model is None:
+            return jsonify({'error': 'Server-side STT unavailable (faster-whisper model not loaded)'}), 503
+        lang = (request.form.get('lang') or request.form.get('locale') or '').strip().lower()[:2] or None
+        try:
+            segments, info = model.transcribe(io.BytesIO(upload.read()), language=lang, beam_size=1, vad_filter=True)
+        except Exception as e:
+            logger.exception('STT audio decode failed')
+            return jsonify({'error': 'Could not decode audio', 'details': str(e)}), 400
+        if (request.form.get('stream') or '1').strip().lower() in ('0', 'false', 'no'):
+            text = ' '.join(t for t in (seg.text.strip() for seg in segments) if t)
+            return jsonify({'result': text, 'language': info.language})
+
+        sse = 'text/event-stream' in (request.headers.get('Accept') or '')
+        def frame(obj):
+            return f"data: {json.dumps(obj)}\n\n" if sse else json.dumps(obj) + "\n"
+        def gen():
+            parts = []
+            try:
+                for seg in segments:
+                    text = seg.text.strip()
+                    if text:
+                        parts.append(text)
+                        yield frame({'delta': text, 'start': round(seg.start, 2), 'end': round(seg.end, 2)})
+            except Exception as e:
+                logger.exception('STT decoding failed')
+                yield frame({'error': 'transcription failed', 'details': str(e)})
+            yield frame({'done': True, 'result': ' '.join(parts), 'language': info.language})
+        return Response(gen(), mimetype='text/event-stream' if sse else 'application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     @app.route('/health', methods=['GET'])
     def health():
         return jsonify({
             'status': 'ok',
             'rag_ready': embedder is not None and index is not None and chunks is not None,
-            'llm_ready': tokenizer is not None and llm is not None,
+            'llm_ready': _llm_loaded,
+            'llm_warming': _WARM_LOCK.locked(),
             'llm_device': _LLM_DEVICE,
+            'llm_server': LLAMA_SERVER_URL or None,
+            'llm_gguf': LLAMA_GGUF or None,
             'tts_engine': TTS_ENGINE,
             'tts_ready': _tts_ready(),
             'tts_device': None,
             'db_mode': 'memory' if _USING_IN_MEMORY_DB else 'mongo'
         })
 
+    @app.route('/warmup', methods=['POST'])
+    def warmup():
+        # Explicit preload hook so ops can pay the model load before real traffic
+        start = time.time()
+        ready = _warm_llm()
+        return jsonify({
+            'llm_ready': ready,
+            'llm_device': _LLM_DEVICE,
+            'load_ms': int((time.time() - start) * 1000),
+        })
+
     @app.route('/llm-diagnostic', methods=['GET'])
     def llm_diagnostic():
-        """Return detailed diagnostics about LLM loading/config without forcing a reload."""
         info = {
             'transformers_available': _TRANSFORMERS_AVAILABLE,
-            'llm_ready': tokenizer is not None and llm is not None,
+            'llm_ready': _llm_loaded,
             'llm_device': _LLM_DEVICE,
+            'llm_compiled': _LLM_COMPILED,
+            'llm_quantization': _LLM_QUANTIZATION,
+            'llm_server': LLAMA_SERVER_URL or None,
+            'llm_gguf': LLAMA_GGUF or None,
+            'llm_dtype': str(next(llm.parameters()).dtype).replace('torch.', '') if llm is not None else None,
+            'llm_attention': getattr(getattr(llm, 'config', None), '_attn_implementation', None),
             'env': {
-                'SKIP_LLM_LOAD': os.environ.get('SKIP_LLM_LOAD') or env_vars.get('SKIP_LLM_LOAD'),
+                'SKIP_LLM_LOAD': os.environ.get('SKIP_LLM_LOAD') or _env().get('SKIP_LLM_LOAD'),
                 'LLAMA_FORCE_FALLBACK': os.environ.get('LLAMA_FORCE_FALLBACK'),
-                'LLAMA_USE_BNB': os.environ.get('LLAMA_USE_BNB') or env_vars.get('LLAMA_USE_BNB'),
-                'MODEL_REPO': os.environ.get('MODEL_REPO') or env_vars.get('MODEL_REPO'),
-                'MODEL_REPO_LOCAL_ONLY': os.environ.get('MODEL_REPO_LOCAL_ONLY') or env_vars.get('MODEL_REPO_LOCAL_ONLY'),
+                'LLAMA_USE_BNB': os.environ.get('LLAMA_USE_BNB') or _env().get('LLAMA_USE_BNB'),
+                'LLAMA_TORCH_COMPILE': os.environ.get('LLAMA_TORCH_COMPILE') or _env().get('LLAMA_TORCH_COMPILE'),
+                'LLAMA_CPU_INT8': os.environ.get('LLAMA_CPU_INT8') or _env().get('LLAMA_CPU_INT8'),
+                'LLAMA_DTYPE': os.environ.get('LLAMA_DTYPE') or _env().get('LLAMA_DTYPE'),
+                'LLAMA_ATTN_IMPL': os.environ.get('LLAMA_ATTN_IMPL') or _env().get('LLAMA_ATTN_IMPL'),
+                'MODEL_REPO': os.environ.get('MODEL_REPO') or _env().get('MODEL_REPO'),
+                'MODEL_REPO_LOCAL_ONLY': os.environ.get('MODEL_REPO_LOCAL_ONLY') or _env().get('MODEL_REPO_LOCAL_ONLY'),
                 'HF_HUB_OFFLINE': os.environ.get('HF_HUB_OFFLINE'),
             }
         }
-        # Resolve repository path and basic file checks
         try:
-            repo_hint = (os.environ.get('MODEL_REPO') or env_vars.get('MODEL_REPO') or os.path.join(os.getcwd(), 'models', 'phi-3-mini-4k-instruct'))
+            repo_hint = (os.environ.get('MODEL_REPO') or _env().get('MODEL_REPO') or os.path.join(os.getcwd(), 'models', 'phi-3-mini-4k-instruct'))
             repo_path = None
             if isinstance(repo_hint, str) and (repo_hint.startswith('.') or os.path.isabs(repo_hint) or os.path.sep in repo_hint):
                 cand = os.path.abspath(repo_hint)
@@ -2820,7 +3441,6 @@ def create_app_legacy_disabled():
         except Exception as e:
             info['repo_resolve_error'] = str(e)
 
-        # Torch + CUDA status
         try:
             import torch as _torch  # type: ignore
             info['torch'] = {
@@ -2831,7 +3451,6 @@ def create_app_legacy_disabled():
         except Exception as e:
             info['torch_error'] = str(e)
 
-        # Bitsandbytes availability
         try:
             import bitsandbytes as _bnb  # type: ignore
             info['bitsandbytes'] = {'available': True, 'version': getattr(_bnb, '__version__', None)}
@@ -2845,39 +3464,34 @@ def create_app_legacy_disabled():
         req_start = time.time()
         logging.debug("Request received at /llama-chat")
         if request.method == 'OPTIONS':
-            # Fast CORS preflight response
             return ("", 200)
         if request.method == 'GET':
             return jsonify({
                 'error': 'Use POST with JSON payload {"prompt": "..."}',
                 'example': {'prompt': 'Hello'}
             }), 405
+        if 'text/event-stream' in (request.headers.get('Accept') or ''):
+            # Event-stream clients get tokens as they are generated (the /llama-chat-stream body)
+            return llama_chat_stream()
         if embedder is None or index is None or chunks is None:
-            # Allow running in fallback-only mode when RAG data/components are not present.
-            allow_fallback_without_rag = os.environ.get('LLAMA_ALLOW_FALLBACK_WITHOUT_RAG', '')
-            if allow_fallback_without_rag.strip().lower() in ('1', 'true', 'yes'):
+            if LLAMA_ALLOW_FALLBACK_WITHOUT_RAG:
                 logger.info('RAG components not initialized but LLAMA_ALLOW_FALLBACK_WITHOUT_RAG set — proceeding in fallback-only mode')
             else:
                 return jsonify({"error": "RAG components not initialized"}), 503
-        # If model is missing but we can still respond, use fallback
-        model_missing = tokenizer is None or llm is None
+        tokenizer, llm = _get_llm()
+        model_missing = not _llm_available()
         try:
             data = request.get_json() or {}
             prompt = data.get("prompt")
-            # Optional language hint from client (e.g., 'hi-IN', 'en-IN')
             lang_hint = (data.get('lang') or data.get('locale') or '').strip()
-            # Optional fast/fallback flag from client to bypass LLM entirely
             force_fallback = False
             fb_req = data.get('fallback')
             if isinstance(fb_req, bool):
                 force_fallback = fb_req
             elif isinstance(fb_req, str):
                 force_fallback = fb_req.strip().lower() in ("1", "true", "yes")
-            # Or via environment variable
-            if os.environ.get('LLAMA_FORCE_FALLBACK', '').lower() in ("1", "true", "yes"):
+            if LLAMA_FORCE_FALLBACK:
                 force_fallback = True
-            # Optional personalization info: ageGroup, or explicit age/name
-            # Accept a few common variants to be robust to clients
             age_group = (
                 data.get('ageGroup')
                 or data.get('agegroup')
@@ -2890,45 +3504,55 @@ def create_app_legacy_disabled():
                 or data.get('username')
                 or data.get('user_name')
             )
+            # Both feed lru_cached preface builders: anything but a string/number (a JSON
+            # list or object is unhashable) is ignored
+            if isinstance(age_group, (int, float)) and not isinstance(age_group, bool):
+                age_group = str(age_group)
+            elif not isinstance(age_group, str):
+                age_group = None
             if isinstance(age_group, str):
-                age_group = age_group.strip().lower()
+                raw_age = age_group.strip()
+                age_group = raw_age.lower()
                 if age_group in ('child', 'children', 'kids', 'kiddo'):
                     age_group = 'kid'
-            if isinstance(user_name, str):
-                user_name = user_name.strip()
-            # If Authorization header carries a Bearer token, only use it to backfill missing name/age
-            if not user_name or not age_group:
-                try:
-                    from auth import SECRET_KEY
-                    auth_header = request.headers.get('Authorization')
-                    if auth_header and auth_header.startswith('Bearer '):
-                        import jwt
-                        tok = auth_header.split(' ', 1)[1]
-                        claims = jwt.decode(tok, SECRET_KEY, algorithms=['HS256'])
-                        if not user_name:
-                            user_name = claims.get('name')
-                        if not age_group:
-                            age_claim = claims.get('age')
-                            if isinstance(age_claim, int):
-                                # Treat ages < 12 as 'kid', < 16 as 'teen', else 'adult'
-                                age_group = 'kid' if age_claim < 12 else 'teen' if age_claim < 16 else 'adult'
-                except Exception:
-                    pass
+                else:
+                    # Treat numeric ages up to 12 as kid
+                    try:
+                        n = int(raw_age)
+                        if n <= 12:
+                            age_group = 'kid'
+                    except Exception:
+                        pass
+            user_name = user_name.strip() if isinstance(user_name, str) else None
             if not prompt:
                 return jsonify({"error": "No prompt provided"}), 400
 
-            logging.debug(f"Prompt received: {prompt}")
-            # Accept recent conversational history from client
+            # Strip any explicit chat-log style role tags from the prompt
+            try:
+                for marker in ("<User>:", "<Assistant>:", "User:", "Assistant:"):
+                    prompt = prompt.replace(marker, "")
+            except Exception:
+                pass
+
+            # For Hindi flows, first translate the user prompt to English so that
+            # RAG and the core LLM reasoning always see clean English text.
+            original_prompt = prompt
+            try:
+                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
+                    translated_prompt = _translate_with_llm_to_english(prompt or '')
+                    if translated_prompt:
+                        prompt = translated_prompt
+            except Exception:
+                pass
+
+            logging.debug(f"Prompt received (normalized): {prompt}")
             history = data.get('history')
             if not isinstance(history, list):
                 history = []
-            # Trim to last few messages (send more context for better conversational continuity)
             history = history[-12:]
 
-            # Lightweight intent: special-case simple greetings and welcome message
             kid_greeting_story = False
             simple = (prompt or '').strip().lower()
-            # Welcome detection: explicit flag or trigger text match
             is_welcome = False
             try:
                 wflag = data.get('welcome') or data.get('isWelcome') or data.get('is_welcome')
@@ -2937,50 +3561,34 @@ def create_app_legacy_disabled():
             except Exception:
                 is_welcome = False
             if not is_welcome:
-                # match against configured trigger text (ignoring punctuation/case)
-                def _norm(s: str) -> str:
-                    return ''.join(ch for ch in s.lower() if ch.isalnum() or ch.isspace()).strip()
-                is_welcome = _norm(simple) == _norm(WELCOME_TRIGGER_TEXT)
+                is_welcome = _norm_trigger(simple) == _WELCOME_TRIGGER_NORM
             if is_welcome:
-                # Return a warm, pre-crafted welcome with optional TTS
-                result = WELCOME_MESSAGE
                 audio_url = None
                 if WELCOME_AUTOTTS:
                     try:
-                        out_path = unique_filename('speech', 'wav')
-                        # Sanitize text for TTS so spoken audio doesn't include markdown
-                        tts_text = sanitize_text_for_tts(result)
-                        wav_path = tts_local_basic(tts_text, out_path=out_path, voice=data.get('voice') or None) if _EDGE_LOCAL_AVAILABLE else generate_tts_file(tts_text)
-                        filename = os.path.basename(wav_path)
-                        audio_url = f"/generated_audio/{filename}"
+                        # generate_tts_file() serves repeats (and the preload warmup) from its disk cache
+                        audio_url = _generated_audio_url(generate_tts_file(sanitize_text_for_tts(WELCOME_MESSAGE)))
                     except Exception:
                         logger.exception('Welcome TTS failed')
-                latency_ms = int((time.time() - req_start) * 1000)
-                resp = {
-                    "result": result,
-                    "retrieved_count": 0,
-                    "rag_score": None,
-                    "source": "general",
-                    "temperature": 0.0,
-                    "top_p": 1.0,
-                    "used_max_new_tokens": 0,
-                    "latency_ms": latency_ms,
-                    "wants_long": False,
-                    "llm_used": False,
-                }
+                resp = dict(_WELCOME_RESPONSE, latency_ms=int((time.time() - req_start) * 1000))
                 if audio_url:
                     resp['audio_url'] = audio_url
                 return jsonify(resp)
 
             if simple in ("hi", "hello", "hey", "yo", "hola", "namaste"):
-                # For kids, let the LLM craft a short story instead of a hardcoded template
                 if (age_group or '').strip().lower() == 'kid' and not (force_fallback or model_missing):
-                    kid_greeting_story = True  # handled later in persona
+                    kid_greeting_story = True
                 else:
-                    # Use quick fallback for non-kid or when model is unavailable/forced fallback
                     base = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
+                    audio_url = None
+                    if not user_name and _wants_tts(data):
+                        # Name-less greetings are fixed text: serve the pre-synthesized audio
+                        try:
+                            audio_url = _generated_audio_url(_greeting_audio(lang_hint, data.get('voice') or data.get('ttsVoice') or None))
+                        except Exception:
+                            logger.exception('Greeting TTS failed')
                     latency_ms = int((time.time() - req_start) * 1000)
-                    return jsonify({
+                    resp = {
                         "result": base,
                         "retrieved_count": 0,
                         "temperature": 0.0,
@@ -2988,22 +3596,35 @@ def create_app_legacy_disabled():
                         "used_max_new_tokens": 0,
                         "latency_ms": latency_ms,
                         "wants_long": False,
-                    })
-            # 1) Retrieve context (cheap)
-            query_emb = embedder.encode([prompt])
-            # ensure numpy array with shape (1, D)
-            query_arr = np.array(query_emb, dtype=np.float32)
-            if query_arr.ndim == 1:
-                query_arr = np.expand_dims(query_arr, 0)
-            D, I = index.search(query_arr, k=3)
-            retrieved_chunks = [chunks[i] for i in I[0] if 0 <= i < len(chunks)]
-
-            # Estimate similarity score of the top hit (robust across SimpleIndex and FAISS)
+                    }
+                    if audio_url:
+                        resp['audio_url'] = audio_url
+                    return jsonify(resp)
+            rag_future = _RAG_POOL.submit(_rag_search, prompt)
+            convo_lines = []
+            for m in history:
+                try:
+                    role = str(m.get('role', '')).strip().lower()
+                    content = str(m.get('content', '')).strip()
+                    if not content:
+                        continue
+                    if role == 'user':
+                        convo_lines.append(f"User: {content}")
+                    elif role == 'assistant':
+                        convo_lines.append(f"Assistant: {content}")
+                except Exception:
+                    continue
+            conversation_block = "\n".join(convo_lines)
+
+            D, I = rag_future.result()
+            n_chunks = len(chunks)
+            retrieved_idx = [int(i) for i in I[0] if 0 <= i < n_chunks]
+            retrieved_chunks = [chunks[i] for i in retrieved_idx]
+
             rag_score = None
             try:
                 if D is not None and len(D) > 0 and len(D[0]) > 0:
                     d0 = float(D[0][0])
-                    # SimpleIndex returns D ~= 1 - cos_sim (0..1). FAISS L2 on normalized vectors ~ 2*(1 - cos)
                     if 0.0 <= d0 <= 1.0:
                         rag_score = max(0.0, min(1.0, 1.0 - d0))
                     elif 0.0 <= d0 <= 2.0:
@@ -3011,164 +3632,22 @@ def create_app_legacy_disabled():
             except Exception:
                 rag_score = None
 
-            # Treat score >= 0.70 as reliable RAG hit (stricter to avoid bad chunks from hash embeddings)
             rag_reliable = bool(retrieved_chunks) and (rag_score is not None and rag_score >= 0.70)
-            # --- START PATCH: sanitize retrieved_chunks to remove role-labelled lines/code blocks ---
-            import re
-
-            def _strip_role_lines_and_code(text: str) -> str:
-                """Remove role-labelled lines (User:/Assistant:/<User>:) and code fences, normalize whitespace."""
-                if not text:
-                    return ""
-                s = str(text)
-
-                # Remove entire lines that start with role labels like "User:", "Assistant:", "<User>:", "<Assistant>:"
-                s = re.sub(r'(?im)^[\s]*<(?:user|assistant)>\s*[:\-–]?\s*.*\n?', '', s)  # angle-bracket roles
-                s = re.sub(r'(?im)^[\s]*(?:user|assistant)\s*[:\-–]\s*.*\n?', '', s)       # plain "User:" or "Assistant:"
-                s = re.sub(r'(?im)^[\s]*<\/*(?:user|assistant)[^>]*>\s*.*\n?', '', s)      # other xml-like tags
-
-                # Remove fenced code blocks and inline code ticks
-                s = re.sub(r'```[\s\S]*?```', ' ', s)
-                s = re.sub(r'`([^`]*)`', r'\1', s)
-
-                # Collapse whitespace/newlines and trim
-                s = re.sub(r'\r\n|\r', '\n', s)
-                s = re.sub(r'\n{2,}', '\n\n', s)
-                s = re.sub(r'[ \t]{2,}', ' ', s)
-                s = s.strip()
-                return s
-
-            # Clean top N chunks (protect performance) and overwrite retrieved_chunks
-            cleaned_chunks = []
-            for c in (retrieved_chunks or [])[:8]:   # limit to top 8 retrieved items
-                try:
-                    cleaned = _strip_role_lines_and_code(c)
-                    # keep only reasonably sized chunks to avoid noise
-                    if cleaned and len(cleaned) > 30:
-                        cleaned_chunks.append(cleaned)
-                except Exception:
-                    continue
+            context = _build_context(retrieved_chunks, RAG_CONTEXT_CHARS)
 
-            # Replace retrieved_chunks globally so all downstream code uses sanitized data
-            if cleaned_chunks:
-                retrieved_chunks = list(cleaned_chunks)
-            else:
-                # no cleaned chunks found: set to empty list to avoid accidental raw usage
-                retrieved_chunks = []
-
-            # Provide a top_clean variable for all fallback/snippet code paths to consume
-            top_clean = (retrieved_chunks[0] or "").strip() if retrieved_chunks else ""
-            logger.debug("Sanitized RAG context preview (top 3): %s", (retrieved_chunks[:3] if retrieved_chunks else []))
-            # --- END PATCH ---
-
-            context = "\n\n---\n\n".join(retrieved_chunks) if retrieved_chunks else ""
-
-            # Hard cap context size to avoid excessive input length
-            max_context_chars = int(os.environ.get("RAG_CONTEXT_CHARS", "1200"))
-            if len(context) > max_context_chars:
-                context = context[:max_context_chars] + "\n[context truncated]"
-
-            # Build an age-adaptive system preface
-            persona_lines = []
-            if user_name:
-                persona_lines.append(f"The user's name is {user_name}.")
-            # Natural, human-style guidance by age
-            persona_lines.append("Speak as ChaCha in first person (I/me) with a warm, friendly tone—natural, concise, and human.")
-            # Decide kid story mode only when appropriate, not always
             use_kid_story = False
             if (age_group == 'kid'):
-                # Heuristics: greeting story, conceptual questions (why/how/what), or weak RAG
                 lt_prompt = (prompt or '').strip().lower()
                 if ('kid_greeting_story' in locals() and kid_greeting_story) or any(
                     kw in lt_prompt for kw in ('why', 'how', 'what is', 'tell me', 'story')
                 ) or not rag_reliable:
                     use_kid_story = True
-                if use_kid_story:
-                    persona_lines.append("Use simple, positive language and create a short story example appropriate for kids.")
-                    persona_lines.append("Structure: briefly explain the idea, then tell a small story (setting → action → outcome), and end with one friendly question.")
-                    persona_lines.append("Keep it ~80–140 words, vivid but simple; prefer familiar Indian names/places and Ganga context when it fits naturally.")
-                    persona_lines.append("Avoid headings and lists; write in 3–5 short paragraphs so it’s easy to follow.")
-                else:
-                    persona_lines.append("Use simple, positive language; explain in 1–2 short paragraphs with one concrete example. Avoid lists unless asked.")
-            elif age_group == 'teen':
-                persona_lines.append("Keep it concise, friendly, and practical — one or two short paragraphs.")
-            else:
-                persona_lines.append("Be concise and conversational; prefer short paragraphs (2–4). Avoid lists unless explicitly asked.")
-            persona_lines.append("Ask one brief, tailored follow‑up question to keep the chat flowing, unless the user asks for a one‑shot answer.")
-            persona_lines.append("Use light empathy and clarifying questions when the user’s goal is ambiguous.")
-            persona_lines.append("If the user says ‘continue’, ‘go on’, or answers yes/no, continue naturally from the last assistant reply without restarting or repeating.")
-            persona_lines.append("Do not include role labels or markdown headings in the reply.")
-            # If the user explicitly asks for a story, guide the model to produce one
-            try:
-                _pl = (prompt or '').strip().lower()
-                if ('कहानी' in (prompt or '')) or ('story' in _pl):
-                    if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                        persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story in Hindi (Devanagari). Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
-                    else:
-                        persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story. Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
-            except Exception:
-                pass
-            # If the user explicitly asks for a story (Hindi: 'कहानी', English: 'story'), produce a short narrative
-            try:
-                _pl = (prompt or '').strip().lower()
-                if ('कहानी' in (prompt or '')) or ('story' in _pl):
-                    if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                        persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story in Hindi (Devanagari). Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
-                    else:
-                        persona_lines.append("If the user asks for a story, write a short (120–180 words) engaging story. Keep it simple and vivid, with a beginning–middle–end, and connect naturally to the Ganga/clean river theme if appropriate.")
-            except Exception:
-                pass
-            # Language guidance: honor explicit Hindi selection, else default to English
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    persona_lines.append("Respond entirely in Hindi using Devanagari script. Use natural, simple phrasing; avoid mixing English except proper nouns. When technical terms appear, explain them briefly in Hindi. If the provided context is in English, translate it faithfully to Hindi while answering.")
-                elif lang_hint:
-                    # For any explicit non-Hindi hint, keep to that language family (English variants)
-                    if str(lang_hint).strip().lower().startswith('en'):
-                        persona_lines.append("Respond in English (Indian English tone).")
-            except Exception:
-                pass
-            # Sourcing guidance (keep replies conversational; no disclaimers in text)
-            if rag_reliable:
-                persona_lines.append("Use the context below as your primary source. If you add general knowledge, keep it minimal and integrated naturally.")
-            else:
-                persona_lines.append("Context appears weak or missing. Answer from general knowledge clearly and helpfully without apologies or disclaimers.")
-
-            system_preface = "\n".join(persona_lines)
-
-            # Include the last few conversation turns to maintain continuity
-            convo_lines = []
-            for m in history:
-                try:
-                    role = str(m.get('role', '')).strip().lower()
-                    content = str(m.get('content', '')).strip()
-                    if not content:
-                        continue
-                    # Sanitize user content to prevent prompt injection via role labels
-                    content = _strip_role_lines_and_code(content)
-                    if role == 'user':
-                        convo_lines.append(f"User: {content}")
-                    elif role == 'assistant':
-                        convo_lines.append(f"Assistant: {content}")
-                except Exception:
-                    continue
-            conversation_block = "\n".join(convo_lines)
+            wants_story = ('कहानी' in (prompt or '')) or ('story' in (prompt or '').strip().lower())
+            system_preface = _chat_preface(user_name or None, age_group, use_kid_story, wants_story, _lang_kind(lang_hint), bool(rag_reliable))
 
-            # Build a leak-resistant prompt using explicit tags so the model
-            # is less likely to echo the meta instructions. We also instruct it
-            # not to mention the tags.
-            full_prompt = (
-                "<SYS>\n"
-                + system_preface
-                + "\nNever mention or quote the <SYS>, <CONTEXT>, or <CONV> sections.\n</SYS>\n\n"
-                + "<CONV>\n" + (conversation_block or "") + "\n</CONV>\n\n"
-                + "<CONTEXT>\n" + (context or "") + "\n</CONTEXT>\n\n"
-                + "User: " + prompt + "\nAssistant:"
-            )
-            # 2) If forced fallback or model missing, return a quick templated answer
+            full_prompt = _render_prompt(system_preface, conversation_block, context, prompt)
             if force_fallback or model_missing:
                 logger.info(f"/llama-chat: using fallback (force={force_fallback}, model_missing={model_missing}, age_group={age_group})")
-                # Prefer a RAG-first handcrafted reply if we have usable context, else a clean kid/general fallback
                 result = None
                 if retrieved_chunks:
                     try:
@@ -3176,7 +3655,6 @@ def create_app_legacy_disabled():
                         readable = _is_chunk_readable(top)
                         if age_group == 'kid':
                             if rag_reliable and readable:
-                                # For Hindi requests, avoid injecting English snippets — keep reply pure Hindi
                                 if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
                                     result = (
                                         "मैं इसे एक छोटे उदाहरण या कहानी से समझा सकता हूँ — क्या आप चाहेंगे?"
@@ -3191,9 +3669,7 @@ def create_app_legacy_disabled():
                         else:
                             if rag_reliable and readable:
                                 snippet = _clean_snippet(top)
-                                # Language-aware short template
                                 if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                                    # Avoid showing English snippet in Hindi mode
                                     result = ("हमारी स्थानीय नोट्स के आधार पर जानकारी उपलब्ध है। क्या मैं इसे आगे बढ़ाकर एक छोटा उदाहरण दूँ?")
                                 else:
                                     result = (
@@ -3202,7 +3678,6 @@ def create_app_legacy_disabled():
                             elif readable:
                                 snippet = _clean_snippet(top)
                                 if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                                    # Keep reply purely in Hindi; avoid showing raw English snippet
                                     result = (
                                         "यह बात मेरी स्थानीय नोट्स में साफ़ नहीं मिली। चाहें तो मैं सामान्य रूप से संक्षेप में समझा दूँ?"
                                     )
@@ -3233,10 +3708,7 @@ def create_app_legacy_disabled():
                     "wants_long": False,
                 })
 
-            # 3) Tune generation with latency-aware presets
-            # Speed preset: fast | balanced | quality (request can override env)
-            speed_preset = (os.environ.get('LLAMA_SPEED_PRESET') or env_vars.get('LLAMA_SPEED_PRESET') or 'balanced').strip().lower()
-            # request override
+            speed_preset = LLAMA_SPEED_PRESET
             try:
                 req_speed = (data.get('speed') or data.get('speed_preset') or '').strip().lower()
                 if req_speed in ('fast', 'balanced', 'quality'):
@@ -3246,39 +3718,34 @@ def create_app_legacy_disabled():
             if speed_preset not in ('fast', 'balanced', 'quality'):
                 speed_preset = 'balanced'
 
-            # Base sampling settings
             temperature = 0.2
             top_p = 0.9
-            # Slightly increase creativity for Hindi to improve fluency on English‑tuned models
             try:
                 if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
                     temperature = max(temperature, 0.45)
             except Exception:
                 pass
 
-            # Token budgets by device + preset
             if _LLM_DEVICE == 'cpu':
                 preset_tokens = {'fast': 48, 'balanced': 72, 'quality': 104}
                 kid_tokens_map = {'fast': 100, 'balanced': 140, 'quality': 180}
                 teen_tokens_map = {'fast': 60, 'balanced': 80, 'quality': 100}
                 default_max_time = {'fast': 4.0, 'balanced': 6.0, 'quality': 8.0}[speed_preset]
-            else:  # cuda or other accelerators
+            else:
                 preset_tokens = {'fast': 128, 'balanced': 196, 'quality': 320}
                 kid_tokens_map = {'fast': 200, 'balanced': 300, 'quality': 420}
                 teen_tokens_map = {'fast': 110, 'balanced': 160, 'quality': 220}
                 default_max_time = {'fast': 8.0, 'balanced': 14.0, 'quality': 22.0}[speed_preset]
 
             default_tokens = preset_tokens[speed_preset]
-            max_new_tokens = int(os.environ.get('LLAMA_MAX_NEW_TOKENS', str(default_tokens)))
+            max_new_tokens = int(LLAMA_MAX_NEW_TOKENS or default_tokens)
 
-            # Allow a slightly longer reply for Hindi or when a story is requested
             try:
                 if (lang_hint and str(lang_hint).strip().lower().startswith('hi')) or ('कहानी' in (prompt or '')) or ('story' in (prompt or '').lower()):
                     max_new_tokens = int(max_new_tokens * 1.25)
             except Exception:
                 pass
 
-            # Nudge fluency for Hindi; many English-tuned LLMs produce better Hindi with a bit more randomness
             try:
                 if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
                     temperature = max(temperature, 0.45)
@@ -3287,153 +3754,104 @@ def create_app_legacy_disabled():
             if age_group == 'kid':
                 temperature = 0.7
                 kid_tokens = kid_tokens_map[speed_preset]
-                # Ensure at least kid_tokens but allow manual override to reduce further
                 max_new_tokens = min(max(max_new_tokens, kid_tokens), kid_tokens_map['quality'])
             elif age_group == 'teen':
                 temperature = 0.4
                 teen_tokens = teen_tokens_map[speed_preset]
-                # Teens should stay short even if override is large
                 max_new_tokens = min(max_new_tokens, teen_tokens)
 
-            # Cap input token length as well to reduce memory
-            max_input_tokens = int(os.environ.get("LLAMA_MAX_INPUT_TOKENS", "1024"))
+            max_input_tokens = LLAMA_MAX_INPUT_TOKENS
 
-            try:
-                import torch
-                no_grad_ctx = torch.inference_mode
-            except Exception:
-                # Fallback if torch isn't available for context manager type
-                class _NoopCtx:
-                    def __enter__(self):
-                        return None
-                    def __exit__(self, exc_type, exc, tb):
-                        return False
-                def no_grad_ctx():
-                    return _NoopCtx()
-
-            inputs = tokenizer(
-                full_prompt,
-                return_tensors="pt",
-                truncation=True,
-                max_length=max_input_tokens,
-            ).to(llm.device)
-
-            # Use no grad and optionally disable cache to keep memory low
-            # Default to deterministic on CPU to keep memory/use predictable, but
-            # enable sampling when caller requested non-zero temperature or top_p < 1.0
-            do_sample = False if _LLM_DEVICE == 'cpu' else True
-            # If generation tuning requested non-deterministic behavior, honor it
-            if (temperature and float(temperature) > 0.0) or (top_p and float(top_p) < 1.0):
-                if _LLM_DEVICE == 'cpu':
-                    logger.info('Enabling sampling on CPU because temperature/top_p request sampling (temperature=%s top_p=%s)', temperature, top_p)
-                do_sample = True
-
-            generate_kwargs = dict(
-                max_new_tokens=max_new_tokens,
-                do_sample=do_sample,
-                use_cache=False if _LLM_DEVICE == 'cpu' else True,
-            )
-            if do_sample:
-                # Only pass sampling args when sampling is enabled to avoid warnings
-                generate_kwargs.update(temperature=temperature, top_p=top_p)
-            # Limit wall-clock time for generation to avoid long blocking requests
-            max_time = float(os.environ.get('LLAMA_MAX_TIME', str(default_max_time)))
+            generate_kwargs = _generate_kwargs(max_new_tokens, temperature, top_p)
+            if generate_kwargs['do_sample'] and _LLM_DEVICE == 'cpu':
+                logger.info('Enabling sampling on CPU because temperature requests sampling (temperature=%s top_p=%s)', temperature, top_p)
+            max_time = float(LLAMA_MAX_TIME or default_max_time)
             if max_time > 0:
                 generate_kwargs['max_time'] = max_time
 
-            try:
-                with no_grad_ctx():
-                    output = llm.generate(**inputs, **generate_kwargs)
-                # Decode only newly generated tokens to avoid echoing the prompt
-                input_len = int(inputs["input_ids"].shape[1])
-                gen_tokens = output[0][input_len:]
-                result = tokenizer.decode(gen_tokens, skip_special_tokens=True).strip()
-                # Post-process: strip any leaked meta labels or headings
-                try:
-                    import re as _re
-                    # Remove any accidental echoes of tag headers or "Instruction" lines
-                    lines = [ln for ln in result.split("\n") if not _re.search(r"^(System instructions:|<SYS>|</SYS>|<CONTEXT>|</CONTEXT>|<CONV>|</CONV>|Instruction\b|You are now role-?playing)", ln.strip(), _re.I)]
-                    # Also drop leading "Assistant:" label if present
-                    if lines and lines[0].strip().lower().startswith('assistant:'):
-                        lines[0] = lines[0].split(':',1)[1].strip()
-                    result = "\n".join(lines).strip()
-                except Exception:
-                    pass
-                # If generation hit the token/time cap (likely truncated), attempt one safe continuation
-                try:
-                    gen_token_count = int(gen_tokens.shape[0]) if hasattr(gen_tokens, 'shape') else None
-                except Exception:
-                    gen_token_count = None
-                # Heuristic: if we used up the max_new_tokens or the result ends abruptly
-                truncated_candidate = False
+            if LLAMA_GGUF and not LLAMA_SERVER_URL and not model_missing:
+                full_prompt = _gguf_fit_prompt(system_preface, conversation_block, context, prompt, max_new_tokens)
+
+            # Greedy decoding is deterministic, so identical prompts can reuse the reply
+            cache_key = None
+            if not generate_kwargs['do_sample']:
+                cache_key = (full_prompt, tuple(sorted((k, v) for k, v in generate_kwargs.items() if k != 'max_time')))
+            cached_result = llm_cache.get(cache_key) if cache_key is not None else None
+            if cached_result is not None:
+                result = cached_result
+                logger.info('/llama-chat: served from result cache')
+            else:
+                slot = None if LLAMA_SERVER_URL else _LLM_SLOTS
+                if slot is not None and not slot.acquire(timeout=LLAMA_ADMIT_TIMEOUT):
+                    return jsonify({'error': 'LLM is busy; retry shortly'}), 429, {'Retry-After': '5'}
                 try:
-                    if gen_token_count is not None and max_new_tokens and gen_token_count >= max_new_tokens - 2:
-                        truncated_candidate = True
-                    elif result and result[-1] not in ('.', '!', '?') and len(result) > 40:
-                        # long answer that doesn't end with punctuation — may be truncated
-                        truncated_candidate = True
-                except Exception:
-                    truncated_candidate = False
-                if truncated_candidate and not (force_fallback or model_missing):
-                    try:
-                        logger.info('Generation likely truncated (used %s tokens of %s); attempting one continuation', gen_token_count, max_new_tokens)
-                        # Build a short continuation prompt that avoids labels and duplication
-                        continuation_system = (
-                            "Continue the previous assistant reply smoothly. "
-                            "Do not repeat any text already said. Do not add labels or headings. "
-                            "Finish the thought with complete sentences."
-                        )
-                        continuation_text = (
-                            f"{continuation_system}\n\nPrevious reply:\n{result}\n\nContinue:\n"
-                        )
-                        inputs2 = tokenizer(
-                            continuation_text,
-                            return_tensors="pt",
-                            truncation=True,
-                            max_length=max_input_tokens,
-                        ).to(llm.device)
-                        extra_kwargs = dict(generate_kwargs)
-                        # Allow a one-shot extra budget (capped) and slightly more time
-                        extra_budget = min(max(max_new_tokens * 2, 160), 512)
-                        extra_kwargs['max_new_tokens'] = extra_budget
-                        if max_time:
-                            extra_kwargs['max_time'] = float(max_time) * 1.5
-                        with no_grad_ctx():
-                            out2 = llm.generate(**inputs2, **extra_kwargs)
-                        input_len2 = int(inputs2["input_ids"].shape[1])
-                        gen2 = out2[0][input_len2:]
-                        cont_text = tokenizer.decode(gen2, skip_special_tokens=True).strip()
-                        if cont_text:
-                            # Append continuation (avoid duplicating overlapping text)
-                            result = (result + " " + cont_text).strip()
-                            logger.info('Continuation appended (len now=%d)', len(result))
-                    except Exception:
-                        logger.exception('Continuation generation failed; keeping original truncated result')
-                # Defensive: if model produced no new tokens, log diagnostics and fallback
-                if not result:
+                    result, gen_token_count = _complete(full_prompt, lambda: _llm_prompt_inputs(
+                        system_preface, conversation_block, retrieved_idx, prompt, full_prompt, max_input_tokens, max_new_tokens), generate_kwargs)
                     try:
-                        # Try decoding the full output for debugging (may include prompt)
-                        full_decoded = tokenizer.decode(output[0], skip_special_tokens=True).strip()
+                        raw_lines = result.split("\n")
+                        lines = []
+                        for ln in raw_lines:
+                            stripped = ln.strip()
+                            # If the model starts echoing system/meta sections, stop there
+                            if _META_LINE_RE.match(stripped):
+                                break
+                            lines.append(ln)
+                        if lines and lines[0].strip().lower().startswith('assistant:'):
+                            lines[0] = lines[0].split(':', 1)[1].strip()
+                        # Drop any trailing hallucinated Q&A style turns (User:/Assistant:)
+                        cleaned = []
+                        for ln in lines:
+                            if _TURN_LINE_RE.match(ln.strip()):
+                                break
+                            cleaned.append(ln)
+                        result = "\n".join(cleaned).strip()
                     except Exception:
-                        full_decoded = None
+                        pass
+                    truncated_candidate = False
                     try:
-                        out_tokens = int(output[0].shape[1])
+                        if gen_token_count is not None and max_new_tokens and gen_token_count >= max_new_tokens - 2:
+                            truncated_candidate = True
+                        elif result and result[-1] not in ('.', '!', '?') and len(result) > 40:
+                            truncated_candidate = True
                     except Exception:
-                        out_tokens = None
-                    logger.warning('Empty generation from LLM: input_len=%s output_tokens=%s full_decoded_preview=%r', input_len, out_tokens, (full_decoded or '')[:300])
-                    # Use safe fallback so clients aren't left with an empty result
+                        truncated_candidate = False
+                    if truncated_candidate and not (force_fallback or model_missing):
+                        try:
+                            logger.info('Generation likely truncated (used %s tokens of %s); attempting one continuation', gen_token_count, max_new_tokens)
+                            continuation_system = (
+                                "Continue the previous assistant reply smoothly. "
+                                "Do not repeat any text already said. Do not add labels or headings. "
+                                "Finish the thought with complete sentences."
+                            )
+                            continuation_text = (
+                                f"{continuation_system}\n\nPrevious reply:\n{result}\n\nContinue:\n"
+                            )
+                            extra_budget = min(max(max_new_tokens * 2, 160), 512)
+                            extra_kwargs = dict(generate_kwargs)
+                            extra_kwargs['max_new_tokens'] = extra_budget
+                            if max_time:
+                                extra_kwargs['max_time'] = float(max_time) * 1.5
+                            cont_text, _ = _complete(continuation_text, lambda: _llm_inputs(continuation_text, max_input_tokens, extra_budget), extra_kwargs)
+                            if cont_text:
+                                result = (result + " " + cont_text).strip()
+                                logger.info('Continuation appended (len now=%d)', len(result))
+                        except Exception:
+                            logger.exception('Continuation generation failed; keeping original truncated result')
+                    if cache_key is not None and result:
+                        llm_cache.put(cache_key, result)
+                    if not result:
+                        logger.warning('Empty generation from LLM: generated_tokens=%s', gen_token_count)
+                        result = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
+                        logger.info('Applied conversational fallback due to empty generation; fallback_preview=%s', (result or '')[:200])
+                except Exception as gen_err:
+                    logger.error(f"LLM generation failed, using fallback: {gen_err}")
                     result = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-                    logger.info('Applied conversational fallback due to empty generation; fallback_preview=%s', (result or '')[:200])
-            except Exception as gen_err:
-                # Graceful fallback: short, friendly template answer to avoid request crash
-                logger.error(f"LLM generation failed, using fallback: {gen_err}")
-                result = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-            # Keep responses conversational — do not inject sourcing disclaimers in user-facing text.
-            # We expose 'source' and 'rag_score' in metadata for the UI instead.
-            # Log the generated response at INFO so it's visible in typical server logs.
-            # Final guard: if Hindi requested but text looks English, try translating via LLM.
+                finally:
+                    if slot is not None:
+                        slot.release()
+            # If Hindi is requested, always translate the English LLM answer to Hindi
             try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi') and _is_mostly_english(result or ''):
+                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
                     translated = _translate_with_llm_to_hindi(result or '')
                     if translated:
                         result = translated
@@ -3446,34 +3864,19 @@ def create_app_legacy_disabled():
             logger.info('Generated response (len=%d) preview: %s', len(result or ''), preview)
             latency_ms = int((time.time() - req_start) * 1000)
 
-            # Optionally produce TTS for the assistant reply.
-            # Control via request JSON 'tts' flag (true/false/string) or env 'LLAMA_AUTOTTS'.
-            want_tts = False
-            try:
-                env_autotts = os.environ.get('LLAMA_AUTOTTS', '').strip().lower()
-                if env_autotts in ('1', 'true', 'yes'):
-                    want_tts = True
-                req_tts = data.get('tts')
-                if isinstance(req_tts, bool):
-                    want_tts = req_tts
-                elif isinstance(req_tts, str):
-                    if req_tts.strip().lower() in ('1', 'true', 'yes'):
-                        want_tts = True
-            except Exception:
-                want_tts = False
-
             audio_url = None
             tts_error = None
-            if want_tts:
+            tts_pending = False
+            if _wants_tts(data):
                 try:
                     voice_id = data.get('voice') or data.get('ttsVoice') or None
-                    # Prefer offline local-basic TTS for assistant reply
-                    out_path = unique_filename('speech', 'wav')
-                    # Sanitize model output for TTS so spoken audio doesn't include markdown markers
                     tts_text = sanitize_text_for_tts(result)
-                    wav_path = tts_local_basic(tts_text, out_path=out_path, voice=voice_id)
-                    filename = os.path.basename(wav_path)
-                    audio_url = f"/generated_audio/{filename}"
+                    vec = _tts_embedding(tts_text)
+                    if AUTOTTS_ASYNC:
+                        audio_url = "/generated_audio/" + _submit_reply_audio(tts_text, voice_id, vec)
+                        tts_pending = True
+                    else:
+                        audio_url = _generated_audio_url(_reply_audio(tts_text, voice_id, vec))
                 except Exception as tte:
                     logger.exception('Failed to generate TTS for assistant reply')
                     tts_error = str(tte)
@@ -3492,6 +3895,7 @@ def create_app_legacy_disabled():
             }
             if audio_url:
                 resp['audio_url'] = audio_url
+                resp['tts_status'] = 'pending' if tts_pending else 'ready'
             if tts_error:
                 resp['tts_error'] = tts_error
             return jsonify(resp)
@@ -3499,12 +3903,49 @@ def create_app_legacy_disabled():
             logging.error(f"Error in /llama-chat: {e}")
             return jsonify({"error": str(e)}), 500
 
+    # Background /llama-chat jobs for clients that should not hold a request open
+    chat_jobs = {}
+    chat_jobs_lock = threading.Lock()
+    chat_job_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('LLAMA_JOB_WORKERS', '4')), thread_name_prefix='chat-job')
+    CHAT_JOB_TTL_S = float(os.environ.get('LLAMA_JOB_TTL_S', '900'))
+
+    @app.route('/llama-chat/async', methods=['POST'])
+    def llama_chat_async():
+        request.get_json(silent=True)  # parse now; the copied context reuses it
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with chat_jobs_lock:
+            for jid in [j for j, v in chat_jobs.items() if v['status'] != 'pending' and now - v['created'] > CHAT_JOB_TTL_S]:
+                chat_jobs.pop(jid, None)
+            chat_jobs[job_id] = {'status': 'pending', 'created': now}
+
+        @copy_current_request_context
+        def run_job():
+            try:
+                resp = app.make_response(llama_chat())
+                entry = {'status': 'done' if resp.status_code < 400 else 'error',
+                         'http_status': resp.status_code, 'result': resp.get_json(silent=True)}
+            except Exception as e:
+                logger.exception('/llama-chat job %s failed', job_id)
+                entry = {'status': 'error', 'http_status': 500, 'result': {'error': str(e)}}
+            with chat_jobs_lock:
+                chat_jobs[job_id].update(entry)
+
+        chat_job_pool.submit(run_job)
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+
+    @app.route('/llama-chat/result/<job_id>', methods=['GET'])
+    def llama_chat_result(job_id):
+        with chat_jobs_lock:
+            job = chat_jobs.get(job_id)
+            job = dict(job) if job else None
+        if job is None:
+            return jsonify({'error': 'unknown job'}), 404
+        job.pop('created', None)
+        return jsonify({'job_id': job_id, **job}), 200 if job['status'] != 'pending' else 202
+
     @app.route('/llama-chat-stream', methods=['POST', 'OPTIONS'])
     def llama_chat_stream():
-        """NDJSON streaming endpoint that streams partial text deltas.
-        Each chunk is a JSON line: {"delta": "..."}
-        Final line: {"done": true, ...meta}
-        """
         if request.method == 'OPTIONS':
             return ("", 200)
         req_start = time.time()
@@ -3514,7 +3955,6 @@ def create_app_legacy_disabled():
             if not prompt:
                 return jsonify({"error": "No prompt provided"}), 400
             lang_hint = (data.get('lang') or data.get('locale') or '').strip()
-            # history and personalization
             history = data.get('history')
             if not isinstance(history, list):
                 history = []
@@ -3528,25 +3968,36 @@ def create_app_legacy_disabled():
             user_name = (
                 data.get('name') or data.get('Name') or data.get('username') or data.get('user_name')
             )
+            if isinstance(age_group, (int, float)) and not isinstance(age_group, bool):
+                age_group = str(age_group)
+            elif not isinstance(age_group, str):
+                age_group = None
             if isinstance(age_group, str):
                 agl = age_group.strip().lower()
                 age_group = 'kid' if agl in ('child','children','kids','kiddo') else agl
-            if isinstance(user_name, str):
-                user_name = user_name.strip()
+            user_name = user_name.strip() if isinstance(user_name, str) else None
 
-            # Fallback if RAG unavailable but allowed
             if embedder is None or index is None or chunks is None:
-                allow = os.environ.get('LLAMA_ALLOW_FALLBACK_WITHOUT_RAG','').strip().lower() in ('1','true','yes')
-                if not allow:
+                if not LLAMA_ALLOW_FALLBACK_WITHOUT_RAG:
                     return jsonify({"error": "RAG components not initialized"}), 503
 
-            # Retrieval
-            query_emb = embedder.encode([prompt])
-            query_arr = np.array(query_emb, dtype=np.float32)
-            if query_arr.ndim == 1:
-                query_arr = np.expand_dims(query_arr, 0)
-            D, I = index.search(query_arr, k=3)
-            retrieved_chunks = [chunks[i] for i in I[0] if 0 <= i < len(chunks)]
+            rag_future = _RAG_POOL.submit(_rag_search, prompt)
+            convo_lines = []
+            for m in history:
+                role = str(m.get('role','')).strip().lower()
+                content = str(m.get('content','')).strip()
+                if not content:
+                    continue
+                if role == 'user':
+                    convo_lines.append(f"User: {content}")
+                elif role == 'assistant':
+                    convo_lines.append(f"Assistant: {content}")
+            conversation_block = "\n".join(convo_lines)
+
+            D, I = rag_future.result()
+            n_chunks = len(chunks)
+            retrieved_idx = [int(i) for i in I[0] if 0 <= i < n_chunks]
+            retrieved_chunks = [chunks[i] for i in retrieved_idx]
             rag_score = None
             try:
                 if D is not None and len(D) > 0 and len(D[0]) > 0:
@@ -3558,118 +4009,13 @@ def create_app_legacy_disabled():
             except Exception:
                 rag_score = None
             rag_reliable = bool(retrieved_chunks) and (rag_score is not None and rag_score >= 0.70)
+            context = _build_context(retrieved_chunks, RAG_CONTEXT_CHARS)
 
-            # --- START PATCH: sanitize retrieved_chunks to remove role-labelled lines/code blocks ---
-            import re
-
-            def _strip_role_lines_and_code(text: str) -> str:
-                """Remove role-labelled lines (User:/Assistant:/<User>:) and code fences, normalize whitespace."""
-                if not text:
-                    return ""
-                s = str(text)
-
-                # Remove entire lines that start with role labels like "User:", "Assistant:", "<User>:", "<Assistant>:"
-                s = re.sub(r'(?im)^[\s]*<(?:user|assistant)>\s*[:\-–]?\s*.*\n?', '', s)  # angle-bracket roles
-                s = re.sub(r'(?im)^[\s]*(?:user|assistant)\s*[:\-–]\s*.*\n?', '', s)       # plain "User:" or "Assistant:"
-                s = re.sub(r'(?im)^[\s]*<\/*(?:user|assistant)[^>]*>\s*.*\n?', '', s)      # other xml-like tags
-
-                # Remove fenced code blocks and inline code ticks
-                s = re.sub(r'```[\s\S]*?```', ' ', s)
-                s = re.sub(r'`([^`]*)`', r'\1', s)
-
-                # Collapse whitespace/newlines and trim
-                s = re.sub(r'\r\n|\r', '\n', s)
-                s = re.sub(r'\n{2,}', '\n\n', s)
-                s = re.sub(r'[ \t]{2,}', ' ', s)
-                s = s.strip()
-                return s
-
-            # Clean top N chunks (protect performance) and overwrite retrieved_chunks
-            cleaned_chunks = []
-            for c in (retrieved_chunks or [])[:8]:   # limit to top 8 retrieved items
-                try:
-                    cleaned = _strip_role_lines_and_code(c)
-                    # keep only reasonably sized chunks to avoid noise
-                    if cleaned and len(cleaned) > 30:
-                        cleaned_chunks.append(cleaned)
-                except Exception:
-                    continue
+            system_preface = _stream_preface(user_name or None, age_group, _lang_kind(lang_hint), bool(rag_reliable))
 
-            # Replace retrieved_chunks globally so all downstream code uses sanitized data
-            if cleaned_chunks:
-                retrieved_chunks = list(cleaned_chunks)
-            else:
-                # no cleaned chunks found: set to empty list to avoid accidental raw usage
-                retrieved_chunks = []
-
-            # Provide a top_clean variable for all fallback/snippet code paths to consume
-            top_clean = (retrieved_chunks[0] or "").strip() if retrieved_chunks else ""
-            logger.debug("Sanitized RAG context preview (top 3): %s", (retrieved_chunks[:3] if retrieved_chunks else []))
-            # --- END PATCH ---
-
-            context = "\n\n---\n\n".join(retrieved_chunks) if retrieved_chunks else ""
-            max_context_chars = int(os.environ.get('RAG_CONTEXT_CHARS', '1200'))
-            if len(context) > max_context_chars:
-                context = context[:max_context_chars] + "\n[context truncated]"
-
-            # Persona (match non-streaming route semantics)
-            persona_lines = []
-            if user_name:
-                persona_lines.append(f"The user's name is {user_name}.")
-            persona_lines.append("Speak as ChaCha in first person (I/me) with a warm, friendly tone—natural, concise, and human.")
-            if age_group == 'kid':
-                persona_lines.append("Use simple, positive language; short example or story; end with one friendly question.")
-            elif age_group == 'teen':
-                persona_lines.append("Keep it concise, friendly, and practical — one or two short paragraphs.")
-            else:
-                persona_lines.append("Be concise and conversational; prefer short paragraphs (2–4). Avoid lists unless asked.")
-            persona_lines.append("Ask one brief, tailored follow‑up question to keep the chat flowing, unless the user asks for a one‑shot answer.")
-            persona_lines.append("Use light empathy and clarifying questions when the user’s goal is ambiguous.")
-            persona_lines.append("Do not include role labels or markdown headings in the reply.")
-            # Language guidance (streaming): enforce Hindi when requested
-            try:
-                if lang_hint and str(lang_hint).strip().lower().startswith('hi'):
-                    persona_lines.append("Respond entirely in Hindi using Devanagari script. Keep it natural and simple; avoid English mixing except proper nouns. If the context is in English, translate it into Hindi as you answer.")
-                elif lang_hint:
-                    if str(lang_hint).strip().lower().startswith('en'):
-                        persona_lines.append("Respond in English (Indian English tone).")
-            except Exception:
-                pass
-            if rag_reliable:
-                persona_lines.append("Use the context below as your primary source. If you add general knowledge, keep it minimal and integrated naturally.")
-            else:
-                persona_lines.append("Context appears weak or missing. Answer from general knowledge clearly and helpfully without apologies or disclaimers.")
-            # Phi-3 Standard Prompt Format
-            system_preface = "\n".join(persona_lines)
-            
-            full_prompt = f"<|system|>\n{system_preface}<|end|>\n"
-            
-            for m in history:
-                role = str(m.get('role','')).strip().lower()
-                content = str(m.get('content','')).strip()
-                if not content:
-                    continue
-                # Sanitize user content to prevent prompt injection via role labels
-                content = _strip_role_lines_and_code(content)
-                if role == 'user':
-                    full_prompt += f"<|user|>\n{content}<|end|>\n"
-                elif role == 'assistant':
-                    full_prompt += f"<|assistant|>\n{content}<|end|>\n"
-            
-            # Add RAG context as a system or user message? 
-            # For Phi-3, it's often best to put context in the system or the last user message.
-            # Let's append it to the last user message or a specific context block.
-            # Here we'll put it before the final user prompt.
-            
-            if context:
-                full_prompt += f"<|user|>\nContext:\n{context}\n\nQuestion:\n{prompt}<|end|>\n"
-            else:
-                full_prompt += f"<|user|>\n{prompt}<|end|>\n"
-            
-            full_prompt += "<|assistant|>\n"
+            full_prompt = _render_prompt(system_preface, conversation_block, context, prompt)
 
-            # Speed preset handling
-            speed_preset = (os.environ.get('LLAMA_SPEED_PRESET') or env_vars.get('LLAMA_SPEED_PRESET') or 'balanced').strip().lower()
+            speed_preset = LLAMA_SPEED_PRESET
             try:
                 req_speed = (data.get('speed') or data.get('speed_preset') or '').strip().lower()
                 if req_speed in ('fast','balanced','quality'):
@@ -3682,13 +4028,12 @@ def create_app_legacy_disabled():
             temperature = 0.2
             top_p = 0.9
             if _LLM_DEVICE == 'cpu':
-                preset_tokens = {'fast': 128, 'balanced': 256, 'quality': 512}
-                default_max_time = {'fast': 10.0, 'balanced': 20.0, 'quality': 40.0}[speed_preset]
+                preset_tokens = {'fast': 48, 'balanced': 72, 'quality': 104}
+                default_max_time = {'fast': 4.0, 'balanced': 6.0, 'quality': 8.0}[speed_preset]
             else:
-                preset_tokens = {'fast': 256, 'balanced': 600, 'quality': 1200}
-                default_max_time = {'fast': 15.0, 'balanced': 45.0, 'quality': 90.0}[speed_preset]
-            max_new_tokens = int(os.environ.get('LLAMA_MAX_NEW_TOKENS', str(preset_tokens[speed_preset])))
-            # Allow slightly longer replies for Hindi or story requests to reduce truncation
+                preset_tokens = {'fast': 128, 'balanced': 196, 'quality': 320}
+                default_max_time = {'fast': 8.0, 'balanced': 14.0, 'quality': 22.0}[speed_preset]
+            max_new_tokens = int(LLAMA_MAX_NEW_TOKENS or preset_tokens[speed_preset])
             try:
                 if (lang_hint and str(lang_hint).strip().lower().startswith('hi')) or ('कहानी' in (prompt or '')) or ('story' in (prompt or '').lower()):
                     max_new_tokens = int(max_new_tokens * 1.25)
@@ -3698,14 +4043,24 @@ def create_app_legacy_disabled():
                 temperature = 0.7
             elif age_group == 'teen':
                 temperature = 0.4
-            max_input_tokens = int(os.environ.get('LLAMA_MAX_INPUT_TOKENS', '1024'))
-            max_time = float(os.environ.get('LLAMA_MAX_TIME', str(default_max_time)))
-
-            # If no LLM or transformers streamer unavailable, stream fallback as one chunk
-            if tokenizer is None or llm is None or TextIteratorStreamer is None:
+            max_input_tokens = LLAMA_MAX_INPUT_TOKENS
+            max_time = float(LLAMA_MAX_TIME or default_max_time)
+
+            # Same payloads either way: NDJSON lines by default, SSE ``data:`` events when the
+            # client asks for text/event-stream (Accept header or {"format": "sse"})
+            sse = 'text/event-stream' in (request.headers.get('Accept') or '') or str(data.get('format') or '').lower() == 'sse'
+            def frame(obj):
+                return f"data: {json.dumps(obj)}\n\n" if sse else json.dumps(obj) + "\n"
+            def stream_response(body):
+                # no-cache / X-Accel-Buffering keep proxies from holding back partial output
+                return Response(body, mimetype='text/event-stream' if sse else 'application/x-ndjson',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+            tokenizer, llm = _get_llm()
+            if not _llm_available():
                 def gen_fallback():
                     text = _conversational_fallback(prompt, user_name, age_group, history, lang_hint)
-                    yield json.dumps({"delta": text}) + "\n"
+                    yield frame({"delta": text})
                     meta = {
                         "done": True,
                         "retrieved_count": len(retrieved_chunks),
@@ -3717,78 +4072,59 @@ def create_app_legacy_disabled():
                         "latency_ms": int((time.time() - req_start) * 1000),
                         "llm_used": False,
                     }
-                    yield json.dumps(meta) + "\n"
-                from flask import Response
-                return Response(gen_fallback(), mimetype='application/x-ndjson')
+                    yield frame(meta)
+                return stream_response(gen_fallback())
 
-            # Build inputs and streamer
-            try:
-                import torch
-                no_grad_ctx = torch.inference_mode
-            except Exception:
-                class _NoopCtx:
-                    def __enter__(self):
-                        return None
-                    def __exit__(self, exc_type, exc, tb):
-                        return False
-                def no_grad_ctx():
-                    return _NoopCtx()
-
-            inputs = tokenizer(full_prompt, return_tensors='pt', truncation=True, max_length=max_input_tokens).to(llm.device)
-            do_sample = False if _LLM_DEVICE == 'cpu' else True
-            if (temperature and float(temperature) > 0.0) or (top_p and float(top_p) < 1.0):
-                do_sample = True
-            generate_kwargs = dict(max_new_tokens=max_new_tokens, do_sample=do_sample, use_cache=False if _LLM_DEVICE=='cpu' else True)
-            if do_sample:
-                generate_kwargs.update(temperature=temperature, top_p=top_p)
+            generate_kwargs = _generate_kwargs(max_new_tokens, temperature, top_p)
             if max_time > 0:
                 generate_kwargs['max_time'] = max_time
+            if LLAMA_GGUF and not LLAMA_SERVER_URL:
+                full_prompt = _gguf_fit_prompt(system_preface, conversation_block, context, prompt, max_new_tokens)
 
-            streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
-            
-            # Stop tokens for Phi-3
-            # Phi-3 uses <|end|> as EOS.
-            try:
-                generate_kwargs['eos_token_id'] = tokenizer.eos_token_id
-                generate_kwargs['pad_token_id'] = tokenizer.eos_token_id
-            except Exception:
-                pass
+            def server_pieces():
+                try:
+                    if LLAMA_GGUF and not LLAMA_SERVER_URL:
+                        yield from _gguf_stream(full_prompt, generate_kwargs)
+                        return
+                    yield from _server_stream(full_prompt, generate_kwargs)
+                except Exception:
+                    logger.exception('/llama-chat-stream server generation failed')
+
+            def local_pieces():
+                try:
+                    import torch
+                    no_grad_ctx = torch.inference_mode
+                except Exception:
+                    class _NoopCtx:
+                        def __enter__(self):
+                            return None
+                        def __exit__(self, exc_type, exc, tb):
+                            return False
+                    def no_grad_ctx():
+                        return _NoopCtx()
+
+                inputs = _llm_prompt_inputs(system_preface, conversation_block, retrieved_idx, prompt, full_prompt, max_input_tokens, max_new_tokens)
+                from transformers import TextIteratorStreamer  # type: ignore
+                streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+                def run_generate():
+                    try:
+                        with no_grad_ctx():
+                            llm.generate(**inputs, streamer=streamer, **generate_kwargs)
+                    except Exception:
+                        logger.exception('/llama-chat-stream generation failed')
+                        streamer.end()  # unblock the response iterator instead of hanging on the queue
+                    finally:
+                        _after_generate()
 
-            # Custom Stopping Criteria to prevent hallucinations
-            class StopStringCriteria(StoppingCriteria):
-                def __init__(self, tokenizer, stop_strings):
-                    self.tokenizer = tokenizer
-                    self.stop_strings = stop_strings
-
-                def __call__(self, input_ids, scores, **kwargs):
-                    # Decode the last few tokens to check for stop strings
-                    # We only check the newly generated part, but input_ids includes prompt.
-                    # Optimization: just check the end of the decoded text.
-                    text = self.tokenizer.decode(input_ids[0], skip_special_tokens=False)
-                    # print(f"DEBUG: Generated text end: {text[-50:]!r}") # Too noisy
-                    for s in self.stop_strings:
-                        if text.endswith(s):
-                            print(f"DEBUG: Stopping on string: {s!r}")
-                            return True
-                    return False
-
-            stop_strings = ["<|user|>", "<|assistant|>", "User:", "Assistant:", "<|end|>", "\nUser:", "\nAssistant:"]
-            stopping_criteria = StoppingCriteriaList([StopStringCriteria(tokenizer, stop_strings)])
-            generate_kwargs['stopping_criteria'] = stopping_criteria
-
-            def run_generate():
-                with no_grad_ctx():
-                    llm.generate(**inputs, streamer=streamer, **generate_kwargs)
+                _LLM_POOL.submit(run_generate)
+                yield from streamer
 
             def gen_stream():
-                import threading as _th
-                th = _th.Thread(target=run_generate, daemon=True)
-                th.start()
-                for piece in streamer:
+                for piece in (server_pieces() if LLAMA_SERVER_URL or LLAMA_GGUF else local_pieces()):
                     if not piece:
                         continue
-                    yield json.dumps({"delta": piece}) + "\n"
-                th.join(timeout=0.1)
+                    yield frame({"delta": piece})
                 meta = {
                     "done": True,
                     "retrieved_count": len(retrieved_chunks),
@@ -3800,18 +4136,56 @@ def create_app_legacy_disabled():
                     "latency_ms": int((time.time() - req_start) * 1000),
                     "llm_used": True,
                 }
-                yield json.dumps(meta) + "\n"
+                yield frame(meta)
 
-            from flask import Response
-            return Response(gen_stream(), mimetype='application/x-ndjson')
+            if LLAMA_SERVER_URL:
+                return stream_response(gen_stream())
+            if not _LLM_SLOTS.acquire(timeout=LLAMA_ADMIT_TIMEOUT):
+                return jsonify({'error': 'LLM is busy; retry shortly'}), 429, {'Retry-After': '5'}
+            try:
+                resp = stream_response(gen_stream())
+            except BaseException:
+                _LLM_SLOTS.release()
+                raise
+            # Held until the stream is finished or the client goes away
+            resp.call_on_close(_LLM_SLOTS.release)
+            return resp
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     return app
-app_legacy_disabled = None
 
-# Legacy TTS preload disabled
-pass
+app = create_app()
+
+def _start_tts_preload():
+    """Start the background TTS/RAG preload unless SKIP_TTS_LOAD is set.
 
-# Legacy __main__ block disabled
-pass
+    Called per worker after the fork (gunicorn.conf.py ``post_worker_init``) or from
+    ``__main__``, never at import: the preload holds the embedder and Piper voice locks
+    while it runs, and a worker forked from a master mid-preload would inherit them held.
+    """
+    try:
+        skip_tts = (os.environ.get('SKIP_TTS_LOAD') or os.environ.get('SKIP_TTS') or '').strip().lower()
+        if skip_tts in ('1', 'true', 'yes'):
+            logger.info('SKIP_TTS_LOAD set — skipping TTS preload at startup')
+        else:
+            _preload_tts_async()
+    except Exception:
+        logger.exception('Failed to evaluate/start TTS preload')
+
+if __name__ == '__main__':  # pragma: no cover
+    _start_tts_preload()
+    _start_audio_janitor()
+    # Same background model load gunicorn.conf.py starts per worker; the server is up meanwhile
+    if os.environ.get('LLM_WARMUP_ON_START', '1').strip().lower() in ('1', 'true', 'yes'):
+        _warm_llm_async()
+    # gunicorn (gunicorn.conf.py) does not run on Windows; waitress is the threaded WSGI
+    # server there. The werkzeug dev server is only a last resort.
+    try:
+        from waitress import serve  # type: ignore
+    except ImportError:
+        serve = None
+    if serve is not None:
+        serve(app, host='0.0.0.0', port=5000, threads=int(os.environ.get('WAITRESS_THREADS', '8')))
+    else:
+        app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=True)
@@ -1,6 +1,7 @@
 import os
+import time
 import jwt
-from functools import wraps
+from functools import lru_cache, wraps
 from datetime import datetime, timedelta, timezone
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -38,6 +39,22 @@ def create_token(user: dict):
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
 
+@lru_cache(maxsize=1024)
+def _verified_claims(token: str) -> dict:
+    # Signature check only; expiry is re-checked on every use in decode_token()
+    return jwt.decode(token, SECRET_KEY, algorithms=['HS256'], options={'verify_exp': False})
+
+
+def decode_token(token: str) -> dict:
+    """Decode and verify a JWT from create_token().
+    Repeat requests with the same token reuse the cached HMAC verification."""
+    data = _verified_claims(token)
+    exp = data.get('exp')
+    if exp is not None and exp < time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+    return data
+
+
 def token_required(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -46,7 +63,7 @@ def token_required(f):
             return jsonify({'error': 'Authorization header missing'}), 401
         token = auth_header.split(' ', 1)[1]
         try:
-            data = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+            data = decode_token(token)
             email = data.get('email')
             if not email:
                 raise jwt.InvalidTokenError('No email in token')
@@ -1,6 +1,9 @@
 import os
 import asyncio
+import queue
+import threading
 import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from dotenv import dotenv_values
 from flask import current_app
 
@@ -17,13 +20,47 @@ def _ensure_selenium_imports():
     return webdriver, By, Service, Options, ChromeDriverManager
 
 
-async def _edge_save(text: str, voice: str | None, out_path: str):
+def _edge_communicate(text: str, voice: str | None):
     # Lazy import to avoid startup cost
     import edge_tts
     voice_name = voice or (env_vars.get('AssistantVoice') or os.environ.get('AssistantVoice'))
     # Use a slightly slower default rate to improve clarity; pitch adjusted mildly
-    communicate = edge_tts.Communicate(text, voice_name or '', pitch='-2Hz', rate='-15%')
-    await communicate.save(out_path)
+    return edge_tts.Communicate(text, voice_name or '', pitch='-2Hz', rate='-15%')
+
+
+async def _edge_save(text: str, voice: str | None, out_path: str):
+    async with _edge_slots():
+        communicate = _edge_communicate(text, voice)
+        await communicate.save(out_path)
+
+
+_EDGE_LOOP = None
+_EDGE_LOOP_LOCK = threading.Lock()
+_EDGE_SEMAPHORE = None
+# Upper bound on concurrent edge-tts connections and on how long a caller waits for one
+EDGE_TTS_MAX_CONCURRENCY = int(os.environ.get('EDGE_TTS_MAX_CONCURRENCY', '4'))
+EDGE_TTS_TIMEOUT_S = float(os.environ.get('EDGE_TTS_TIMEOUT_S', '30'))
+
+
+def _edge_slots() -> asyncio.Semaphore:
+    # Created on first use from inside the edge-tts loop, so it binds to that loop
+    global _EDGE_SEMAPHORE
+    if _EDGE_SEMAPHORE is None:
+        _EDGE_SEMAPHORE = asyncio.Semaphore(max(1, EDGE_TTS_MAX_CONCURRENCY))
+    return _EDGE_SEMAPHORE
+
+
+def _edge_loop():
+    """Return the shared background event loop for edge-tts, starting it on first use.
+    Reusing one loop avoids per-request loop setup/teardown and lets concurrent
+    requests overlap their network waits."""
+    global _EDGE_LOOP
+    with _EDGE_LOOP_LOCK:
+        if _EDGE_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='edge-tts-loop', daemon=True).start()
+            _EDGE_LOOP = loop
+        return _EDGE_LOOP
 
 
 def tts_edge_sync(text: str, out_path: str = None, voice: str | None = None) -> str:
@@ -36,10 +73,49 @@ def tts_edge_sync(text: str, out_path: str = None, voice: str | None = None) ->
             os.remove(out_path)
     except Exception:
         pass
-    asyncio.run(_edge_save(text, voice, out_path))
+    fut = asyncio.run_coroutine_threadsafe(_edge_save(text, voice, out_path), _edge_loop())
+    try:
+        fut.result(timeout=EDGE_TTS_TIMEOUT_S)
+    except FutureTimeoutError:  # not the builtin TimeoutError before Python 3.11
+        fut.cancel()
+        raise
     return out_path
 
 
+def tts_edge_stream(text: str, voice: str | None = None):
+    """Yield MP3 chunks from edge-tts as they arrive, without writing a file.
+    The async stream runs on the shared edge-tts loop; errors are re-raised to the caller.
+    """
+    chunks = queue.Queue()
+    done = object()
+
+    async def _pump():
+        async with _edge_slots():
+            communicate = _edge_communicate(text, voice)
+            async for chunk in communicate.stream():
+                if chunk.get('type') == 'audio' and chunk.get('data'):
+                    chunks.put(chunk['data'])
+
+    def _finished(fut):
+        if not fut.cancelled() and fut.exception() is not None:
+            chunks.put(fut.exception())
+        chunks.put(done)
+
+    fut = asyncio.run_coroutine_threadsafe(_pump(), _edge_loop())
+    fut.add_done_callback(_finished)
+    while True:
+        try:
+            item = chunks.get(timeout=EDGE_TTS_TIMEOUT_S)
+        except queue.Empty:
+            fut.cancel()
+            raise TimeoutError('edge-tts stream stalled')
+        if item is done:
+            return
+        if isinstance(item, BaseException):
+            raise item
+        yield item
+
+
 # --- Local basic TTS using system voices (offline) ---
 def tts_local_basic(text: str, out_path: str | None = None, voice: str | None = None, rate: int | None = None) -> str:
     """Synthesize speech using pyttsx3 and save to WAV.
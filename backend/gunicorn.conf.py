@@ -0,0 +1,31 @@
+"""Gunicorn settings for the backend: ``gunicorn -c gunicorn.conf.py app:app``.
+
+One process with a thread pool: the LLM is held once in memory, while /health,
+/tts and /stt keep being served during a long /llama-chat generate (torch releases
+the GIL inside its kernels). ``preload_app`` imports app.py in the master before
+forking; the LLM itself is loaded lazily, so each worker loads (and warms) it after
+the fork, which keeps CUDA initialization out of the parent process.
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+preload_app = True
+# CPU generation plus a continuation pass can run well past the 30s default
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "180"))
+
+
+def post_worker_init(worker):
+    import app as backend_app
+
+    # Background threads start here, after the fork: threads do not survive it, and no
+    # worker should inherit a lock the master's TTS/RAG preload thread was holding.
+    backend_app._start_tts_preload()
+    backend_app._start_audio_janitor()
+    # Load the model and run a one-token generate in the background so the first
+    # /llama-chat request does not pay for it; /health answers meanwhile.
+    if os.environ.get("LLM_WARMUP_ON_START", "1").strip().lower() in ("1", "true", "yes"):
+        backend_app._warm_llm_async()
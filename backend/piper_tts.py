@@ -5,6 +5,15 @@ Provides:
 - list_piper_voices(voices_dir): scan voices directory for model/config pairs
 - synthesize_with_piper(piper_path, model_path, config_path, text, out_wav):
   invoke Piper CLI and write a WAV file
+- synthesize_batch_with_piper(piper_path, model_path, config_path, items):
+  write several WAV files from one Piper process
+- stream_with_piper(piper_path, model_path, config_path, text): yield raw PCM
+  sentence by sentence as Piper produces it
+- stream_in_process(model_path, config_path, text) / synthesize_in_process(...):
+  the same through the piper-tts Python package, reusing one loaded ONNX session
+  per voice instead of starting the CLI (and reloading the model) every call
+- quantize_voice(model_path): write an int8 copy of a voice model next to it
+  (<name>.q8.onnx); listed voices report it as paths['model_q8']
 
 Expected layout under voices_dir (default used in app.py: voices/piper/):
   voices/piper/
@@ -20,10 +29,42 @@ the environment (PIPER_PATH) or .env. The backend/app.py resolves it.
 """
 from __future__ import annotations
 
+import importlib.util
 import json
 import os
 import subprocess
-from typing import Dict, List
+import threading
+import wave
+from typing import Dict, Iterator, List
+
+
+QUANTIZED_SUFFIX = '.q8.onnx'
+
+
+def quantized_model_path(model_path: str) -> str:
+    """Where quantize_voice writes the int8 copy of `model_path`."""
+    return os.path.splitext(model_path)[0] + QUANTIZED_SUFFIX
+
+
+def quantize_voice(model_path: str) -> str:
+    """Write an int8 (dynamic, per-channel) copy of a voice model unless it exists.
+
+    Returns the quantized model's path. Written to a temp file first so a crash never
+    leaves a truncated model that later loads would pick up.
+    """
+    q8_path = quantized_model_path(model_path)
+    if os.path.exists(q8_path):
+        return q8_path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp = q8_path + '.tmp'
+    try:
+        quantize_dynamic(model_path, tmp, weight_type=QuantType.QInt8, per_channel=True, reduce_range=False)
+        os.replace(tmp, q8_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return q8_path
 
 
 def _pair_models_with_configs(voices_dir: str) -> List[Dict]:
@@ -31,7 +72,8 @@ def _pair_models_with_configs(voices_dir: str) -> List[Dict]:
     if not os.path.isdir(voices_dir):
         return items
     for root, _dirs, files in os.walk(voices_dir):
-        onnx_files = [f for f in files if f.lower().endswith('.onnx')]
+        # int8 copies written by quantize_voice are attached to their source voice below
+        onnx_files = [f for f in files if f.lower().endswith('.onnx') and not f.lower().endswith(QUANTIZED_SUFFIX)]
         for onnx_name in onnx_files:
             base = onnx_name
             cfg_name = onnx_name + '.json'  # common convention
@@ -57,11 +99,15 @@ def _pair_models_with_configs(voices_dir: str) -> List[Dict]:
             except Exception:
                 cfg = {}
 
+            paths = {'model': model_path, 'config': cfg_path}
+            q8_path = quantized_model_path(model_path)
+            if os.path.exists(q8_path):
+                paths['model_q8'] = q8_path
             items.append({
                 'id': short_name,
                 'shortName': short_name,
                 'locale': locale,
-                'paths': {'model': model_path, 'config': cfg_path},
+                'paths': paths,
             })
     return items
 
@@ -130,3 +176,211 @@ def synthesize_with_piper(
 
     if proc.returncode != 0:
         raise subprocess.CalledProcessError(proc.returncode, cmd, proc.stdout, proc.stderr)
+
+
+
+def synthesize_batch_with_piper(
+    piper_path: str,
+    model_path: str,
+    config_path: str,
+    items: List[tuple],
+) -> None:
+    """Synthesize several ``(text, out_wav)`` pairs with one Piper process.
+
+    Each stdin line is a JSON object naming its own output file (``--json-input``), so the
+    voice model is loaded once for the whole batch instead of once per utterance.
+    Raises CalledProcessError if Piper returns non-zero.
+    """
+    lines = []
+    for text, out_wav in items:
+        if not text or not text.strip():
+            raise ValueError('Text is empty')
+        os.makedirs(os.path.dirname(out_wav) or '.', exist_ok=True)
+        lines.append(json.dumps({'text': text, 'output_file': out_wav}, ensure_ascii=False))
+    if not lines:
+        return
+
+    cmd = [piper_path, '-m', model_path, '-c', config_path, '--json-input']
+    creationflags = 0
+    if os.name == 'nt':
+        creationflags = 0x08000000  # CREATE_NO_WINDOW
+
+    proc = subprocess.run(
+        cmd,
+        input=('\n'.join(lines) + '\n').encode('utf-8'),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        creationflags=creationflags,
+    )
+
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, proc.stdout, proc.stderr)
+
+def piper_sample_rate(config_path: str, default: int = 22050) -> int:
+    """Output sample rate declared in a Piper voice config (``audio.sample_rate``)."""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('audio', {}).get('sample_rate') or default)
+    except Exception:
+        return default
+
+
+def stream_with_piper(
+    piper_path: str,
+    model_path: str,
+    config_path: str,
+    text: str,
+    *,
+    chunk_size: int = 8192,
+) -> Iterator[bytes]:
+    """Yield raw 16-bit mono PCM from Piper as it is synthesized.
+
+    With ``--output_raw`` Piper writes each sentence's audio to stdout as soon as it is
+    ready, so the first bytes arrive after the first sentence rather than the whole text.
+    The process is killed if the consumer stops early.
+    Raises CalledProcessError if Piper returns non-zero.
+    """
+    if not text or not text.strip():
+        raise ValueError('Text is empty')
+
+    cmd = [piper_path, '-m', model_path, '-c', config_path, '--output_raw']
+    creationflags = 0
+    if os.name == 'nt':
+        creationflags = 0x08000000  # CREATE_NO_WINDOW
+
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        creationflags=creationflags,
+    )
+    def _feed():
+        # Written from a thread: a long text could otherwise fill the stdin pipe while
+        # Piper is blocked on a full stdout pipe
+        try:
+            proc.stdin.write(text.encode('utf-8'))
+        except OSError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+
+    threading.Thread(target=_feed, name='piper-stdin', daemon=True).start()
+    try:
+        while True:
+            chunk = proc.stdout.read1(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+
+def in_process_available() -> bool:
+    """True when the piper-tts package (and onnxruntime) can be imported.
+
+    A spec without an origin is a namespace package, e.g. the ``piper/`` folder holding
+    the CLI binary next to this file, not the piper-tts package.
+    """
+    specs = [importlib.util.find_spec(m) for m in ('piper', 'onnxruntime')]
+    return all(spec is not None and spec.origin is not None for spec in specs)
+
+
+def cuda_available() -> bool:
+    """True when onnxruntime can run Piper models on an NVIDIA GPU."""
+    try:
+        import onnxruntime
+        return 'CUDAExecutionProvider' in onnxruntime.get_available_providers()
+    except Exception:
+        return False
+
+
+# Loaded voices keyed by (model_path, config_path, use_cuda); sessions live for the process
+_VOICES: Dict[tuple, object] = {}
+_VOICES_LOCK = threading.Lock()
+# espeak-ng phonemization is process-global C state; onnxruntime sessions are thread-safe
+_PHONEMIZE_LOCK = threading.Lock()
+
+
+def load_piper_voice(model_path: str, config_path: str, *, use_cuda: bool = False):
+    """Return the cached ``PiperVoice`` for a model, creating its session on first use.
+
+    With ``use_cuda`` the session runs on the GPU (CPU for any op CUDA lacks).
+    """
+    key = (model_path, config_path, use_cuda)
+    voice = _VOICES.get(key)
+    if voice is not None:
+        return voice
+    with _VOICES_LOCK:
+        voice = _VOICES.get(key)
+        if voice is None:
+            import onnxruntime
+            from piper import PiperConfig, PiperVoice
+
+            opts = onnxruntime.SessionOptions()
+            opts.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            opts.intra_op_num_threads = os.cpu_count() or 1
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = PiperConfig.from_dict(json.load(f))
+            providers = ['CPUExecutionProvider']
+            if use_cuda:
+                providers.insert(0, ('CUDAExecutionProvider', {'cudnn_conv_algo_search': 'HEURISTIC'}))
+            session = onnxruntime.InferenceSession(model_path, sess_options=opts, providers=providers)
+            voice = PiperVoice(session=session, config=config)
+            _VOICES[key] = voice
+    return voice
+
+
+def stream_in_process(
+    model_path: str,
+    config_path: str,
+    text: str,
+    *,
+    length_scale: float | None = None,
+    use_cuda: bool = False,
+) -> Iterator[bytes]:
+    """Yield raw 16-bit mono PCM per sentence from the cached in-process voice."""
+    if not text or not text.strip():
+        raise ValueError('Text is empty')
+    from piper import SynthesisConfig
+
+    voice = load_piper_voice(model_path, config_path, use_cuda=use_cuda)
+    syn_config = None
+    if length_scale is not None:
+        syn_config = SynthesisConfig(length_scale=min(max(float(length_scale), 0.5), 2.0))
+    chunks = iter(voice.synthesize(text, syn_config))
+    # The whole text is phonemized when the first sentence is produced
+    with _PHONEMIZE_LOCK:
+        first = next(chunks, None)
+    if first is None:
+        return
+    yield first.audio_int16_bytes
+    for chunk in chunks:
+        yield chunk.audio_int16_bytes
+
+
+def synthesize_in_process(
+    model_path: str,
+    config_path: str,
+    text: str,
+    out_wav: str,
+    *,
+    length_scale: float | None = None,
+    use_cuda: bool = False,
+) -> None:
+    """Synthesize `text` into `out_wav` with the cached in-process voice."""
+    os.makedirs(os.path.dirname(out_wav) or '.', exist_ok=True)
+    pcm = b''.join(stream_in_process(model_path, config_path, text, length_scale=length_scale, use_cuda=use_cuda))
+    with wave.open(out_wav, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(load_piper_voice(model_path, config_path, use_cuda=use_cuda).config.sample_rate)
+        wf.writeframes(pcm)
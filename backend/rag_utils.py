@@ -16,10 +16,11 @@ Trade-offs in default mode:
 
 import os
 import json
-import pdfplumber
 import warnings
 import sys
 import hashlib
+import importlib.util
+import threading
 import numpy as np
 try:
     import faiss  # type: ignore
@@ -28,12 +29,9 @@ except Exception:
     faiss = None  # type: ignore
     _FAISS_OK = False
 
-try:
-    from sentence_transformers import SentenceTransformer
-    _ST_OK = True
-except ImportError:
-    _ST_OK = False
-    SentenceTransformer = None
+# sentence-transformers pulls in torch/transformers; only probe for it here and import it
+# when the embedder first encodes (see SimpleEmbedder.model)
+_ST_OK = importlib.util.find_spec("sentence_transformers") is not None
 
 ###############################################################################
 # Configuration
@@ -42,6 +40,15 @@ except ImportError:
 # Embedding dimensionality used throughout this module (kept small/lightweight)
 EMBED_DIM = int(os.environ.get("RAG_EMBED_DIM", "384"))
 
+# FAISS index layout: exact flat search below RAG_ANN_MIN vectors, HNSW above it, and
+# IVF-PQ once there are enough vectors to train 256 codewords per sub-quantizer.
+# RAG_NPROBE is the number of IVF lists scanned per query, RAG_EF_SEARCH the HNSW
+# candidate list size per query.
+RAG_ANN_MIN = int(os.environ.get("RAG_ANN_MIN", "4096"))
+RAG_NPROBE = int(os.environ.get("RAG_NPROBE", "8"))
+RAG_EF_SEARCH = int(os.environ.get("RAG_EF_SEARCH", "32"))
+_PQ_MIN_TRAIN = 39 * 256
+
 # Where to read/write persisted artifacts
 _THIS_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(_THIS_DIR, "Data")
@@ -49,6 +56,7 @@ os.makedirs(DATA_DIR, exist_ok=True)
 CHUNKS_PATH = os.path.join(DATA_DIR, "rag_chunks.json")
 EMB_PATH = os.path.join(DATA_DIR, "rag_embeddings.npy")
 FAISS_PATH = os.path.join(DATA_DIR, "rag_faiss.index")
+CHUNK_TOKENS_PATH = os.path.join(DATA_DIR, "rag_chunk_tokens.npz")
 
 # Where to look for PDFs by default (docs/ at repo root and backend/Data)
 DEFAULT_PDF_DIRS = [
@@ -78,6 +86,8 @@ def extract_pdf_text(pdf_path: str) -> str:
         if not os.path.isfile(pdf_path):
             # File missing; return empty text to keep pipeline alive
             return ""
+        import pdfplumber  # only needed when (re)building from PDFs
+
         with pdfplumber.open(pdf_path) as pdf:
             for page in pdf.pages:
                 page_text = page.extract_text() or ""
@@ -99,11 +109,9 @@ def hash_embed(text: str, dim: int = EMBED_DIM) -> np.ndarray:
     without bringing in numba/librosa heavy deps through transformers Trainer.
     """
 
-    vec = np.zeros(dim, dtype=np.float32)
-    for token in text.split():
-        h = int(hashlib.sha1(token.encode("utf-8")).hexdigest(), 16)
-        idx = h % dim
-        vec[idx] += 1.0
+    # Bucket every token first, then count them in one bincount instead of per-token adds
+    buckets = [int.from_bytes(hashlib.sha1(token.encode("utf-8")).digest(), "big") % dim for token in text.split()]
+    vec = np.bincount(buckets, minlength=dim).astype(np.float32)
     # L2 normalize
     norm = np.linalg.norm(vec)
     if norm > 0:
@@ -119,24 +127,56 @@ class SimpleEmbedder:
 
     def __init__(self, dim: int = EMBED_DIM):
         self.dim = dim
-        self.model = None
-        if _ST_OK:
-            try:
-                # Use a small, fast model by default
-                self.model = SentenceTransformer('all-MiniLM-L6-v2')
-                self.dim = self.model.get_sentence_embedding_dimension()
-            except Exception:
-                pass
+        self._model = None
+        self._model_tried = not _ST_OK
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """The SentenceTransformer, loaded on first use; ``None`` when unavailable."""
+        if not self._model_tried:
+            with self._lock:
+                if not self._model_tried:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                        # Use a small, fast model by default
+                        model = SentenceTransformer('all-MiniLM-L6-v2')
+                        self.dim = model.get_sentence_embedding_dimension()
+                        self._model = model
+                    except Exception:
+                        pass
+                    self._model_tried = True
+        return self._model
 
     def encode(self, texts):
         if isinstance(texts, str):
             texts = [texts]
         if not texts:
             return np.zeros((0, self.dim), dtype=np.float32)
-        if self.model:
-            return self.model.encode(texts)
-        vecs = [hash_embed(t, dim=self.dim) for t in texts]
-        return np.vstack(vecs)
+        model = self.model
+        if model:
+            vecs = model.encode(
+                texts,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False,
+                batch_size=min(len(texts), 32),
+            )
+        elif len(texts) == 1:
+            # Single query: a (1, D) view of the vector instead of a vstack copy
+            vecs = hash_embed(texts[0], dim=self.dim)[np.newaxis, :]
+        else:
+            vecs = np.vstack([hash_embed(t, dim=self.dim) for t in texts])
+        # FAISS wants a contiguous (N, D) float32 matrix; this is a no-op when it already is one.
+        # Rows are unit-length, so L2 distance ranks neighbours exactly as cosine similarity.
+        return np.ascontiguousarray(vecs, dtype=np.float32)
+
+
+def _l2_normalize(mat: np.ndarray) -> np.ndarray:
+    mat = np.ascontiguousarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
 
 
 # Expose an embedder compatible with app.py: from rag_utils import embedder, index, chunks
@@ -151,29 +191,80 @@ class SimpleIndex:
     """
 
     def __init__(self, embeddings: np.ndarray):
-        self.embeddings = embeddings.astype(np.float32) if embeddings is not None else None
+        # Contiguous float32 rows so search is a single BLAS matmul; no copy when already so
+        self.embeddings = np.ascontiguousarray(embeddings, dtype=np.float32) if embeddings is not None else None
 
     def search(self, query_mat: np.ndarray, k: int = 3):
         if self.embeddings is None or self.embeddings.shape[0] == 0:
             D = np.zeros((query_mat.shape[0], 0), dtype=np.float32)
             I = -np.ones((query_mat.shape[0], 0), dtype=np.int64)
             return D, I
-        # Ensure L2-normalized query rows
-        Q = query_mat.astype(np.float32)
-        norms = np.linalg.norm(Q, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0
-        Q = Q / norms
+        # Queries from SimpleEmbedder are already unit-length; only rescale rows that are not.
+        # Squared norms via einsum: one small vector, no (N, D) temporaries.
+        Q = np.asarray(query_mat, dtype=np.float32)
+        sq = np.einsum("ij,ij->i", Q, Q)
+        if np.any(np.abs(sq - 1.0) > 2e-4):
+            norms = np.sqrt(sq)[:, np.newaxis]
+            norms[norms == 0] = 1.0
+            Q = Q / norms
         sims = Q @ self.embeddings.T  # cosine similarity
         # Convert to pseudo-distances similar to FAISS L2 ordering
         # Higher sim => lower distance
-        order = np.argsort(-sims, axis=1)
-        topk = order[:, :k]
+        k = min(k, sims.shape[1])
+        # Select the top k without sorting every row, then order just those k
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k] if k < sims.shape[1] else np.argsort(-sims, axis=1)
+        order = np.argsort(-np.take_along_axis(sims, part, axis=1), axis=1)
+        topk = np.take_along_axis(part, order, axis=1)
         top_sim = np.take_along_axis(sims, topk, axis=1)
-        D = (1.0 - top_sim).astype(np.float32)
-        I = topk.astype(np.int64)
+        # Already float32/int64 here: astype(copy=False) avoids a second copy of each
+        D = (1.0 - top_sim).astype(np.float32, copy=False)
+        I = topk.astype(np.int64, copy=False)
         return D, I
 
 
+def _pq_subquantizers(dim: int) -> int:
+    # Largest divisor of dim that is at most dim // 4 (about 4 dims per 8-bit code)
+    for m in range(max(1, dim // 4), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _tune_faiss_index(index_inst):
+    if _FAISS_OK and isinstance(index_inst, faiss.IndexIVF):
+        index_inst.nprobe = max(1, min(RAG_NPROBE, index_inst.nlist))
+    elif _FAISS_OK and isinstance(index_inst, faiss.IndexHNSW):
+        index_inst.hnsw.efSearch = max(1, RAG_EF_SEARCH)
+    return index_inst
+
+
+def make_faiss_index(mat: np.ndarray):
+    """FAISS index over unit-length rows of ``mat``.
+
+    Small corpora get an exact ``IndexFlatL2``; from ``RAG_ANN_MIN`` rows on, an
+    ``IndexHNSWFlat`` graph is used, and once there are enough rows to train 8-bit
+    product quantizers an ``IndexIVFPQ`` (sqrt(N) lists, ~4 dims per code byte) keeps
+    the scan cache-resident.
+    """
+    n, dim = mat.shape
+    if n >= max(RAG_ANN_MIN, _PQ_MIN_TRAIN):
+        try:
+            quantizer = faiss.IndexFlatL2(dim)
+            index_inst = faiss.IndexIVFPQ(quantizer, dim, max(1, int(np.sqrt(n))), _pq_subquantizers(dim), 8)
+            index_inst.train(mat)
+            index_inst.add(mat)
+            return _tune_faiss_index(index_inst)
+        except Exception:
+            pass
+    if n >= RAG_ANN_MIN:
+        index_inst = faiss.IndexHNSWFlat(dim, 32)
+        index_inst.add(mat)
+        return _tune_faiss_index(index_inst)
+    index_inst = faiss.IndexFlatL2(dim)
+    index_inst.add(mat)
+    return index_inst
+
+
 def build_index(chunks_list, dim: int = EMBED_DIM):
     if not chunks_list:
         if _FAISS_OK:
@@ -187,8 +278,7 @@ def build_index(chunks_list, dim: int = EMBED_DIM):
     mat = embedder.encode(chunks_list)
     
     if _FAISS_OK:
-        index_inst = faiss.IndexFlatL2(mat.shape[1])
-        index_inst.add(mat)
+        index_inst = make_faiss_index(mat)
     else:
         index_inst = SimpleIndex(mat)
     return index_inst, mat
@@ -304,18 +394,91 @@ if _chunks is None or _emb is None or (_FAISS_OK and _faiss_idx is None) or _reb
     # --- END PATCH ---
 
     index, embeddings = build_index(chunks, dim=embedder.dim)
-    # Persist artifacts (FAISS only if present)
-    _save_artifacts(chunks, embeddings, index if _FAISS_OK else None)
+    # Persist artifacts (FAISS only if present) on first run only; importing this module
+    # never overwrites existing ones (tools/build_rag_index.py rebuilds them)
+    if _chunks is None or _emb is None:
+        _save_artifacts(chunks, embeddings, index if _FAISS_OK else None)
 else:
     # 3) Use loaded artifacts
     chunks = _chunks
     embeddings = _emb
+    if embeddings.size and not np.allclose(np.linalg.norm(embeddings, axis=1), 1.0, atol=1e-3):
+        # Saved before embeddings were unit-length: normalize and re-index in memory without
+        # re-encoding (tools/build_rag_index.py writes unit-length artifacts)
+        embeddings = _l2_normalize(embeddings)
+        _faiss_idx = make_faiss_index(embeddings) if _FAISS_OK else None
+    elif (_FAISS_OK and isinstance(_faiss_idx, faiss.IndexFlat)
+          and embeddings.shape[0] >= RAG_ANN_MIN and embeddings.shape[0] == _faiss_idx.ntotal):
+        # Flat index persisted before the corpus crossed RAG_ANN_MIN: use HNSW/IVF-PQ in memory
+        _faiss_idx = make_faiss_index(embeddings)
     if _FAISS_OK and _faiss_idx is not None:
-        index = _faiss_idx
+        index = _tune_faiss_index(_faiss_idx)
     else:
         index = SimpleIndex(embeddings)
 
 
+###############################################################################
+# Pre-tokenized chunks (for splicing retrieved context into LLM prompts)
+###############################################################################
+
+def encode_after(tokenizer, anchor: str, text: str):
+    """Token ids of ``text`` as they appear right after ``anchor`` in a longer string.
+
+    Encodes ``anchor + text`` and drops the anchor's own ids, which sidesteps the
+    leading-space handling tokenizers apply at the start of an input. Returns ``None``
+    if the anchor's ids are not a prefix (i.e. it merged with ``text``).
+    """
+    base = tokenizer(anchor, add_special_tokens=False)["input_ids"]
+    ids = tokenizer(anchor + text, add_special_tokens=False)["input_ids"]
+    if ids[: len(base)] != base:
+        return None
+    return ids[len(base):]
+
+
+_TOKEN_TABLES = {}
+
+
+def chunk_token_table(tokenizer):
+    """CSR token table for ``chunks``: ``(flat, offsets)`` where chunk ``i`` is
+    ``flat[offsets[i]:offsets[i + 1]]`` (int32), encoded as it appears after a newline.
+
+    Built once per tokenizer/corpus pair and persisted next to the other RAG artifacts.
+    Returns ``None`` if a chunk cannot be encoded independently.
+    """
+    digest = hashlib.sha1()
+    digest.update(str(getattr(tokenizer, "name_or_path", "")).encode("utf-8"))
+    for c in chunks or []:
+        digest.update(b"\x00")
+        digest.update(c.encode("utf-8"))
+    key = digest.hexdigest()
+    if key in _TOKEN_TABLES:
+        return _TOKEN_TABLES[key]
+    table = None
+    try:
+        if os.path.exists(CHUNK_TOKENS_PATH):
+            with np.load(CHUNK_TOKENS_PATH) as z:
+                if str(z["key"]) == key:
+                    table = (z["flat"], z["offsets"])
+    except Exception:
+        table = None
+    if table is None:
+        pieces = [encode_after(tokenizer, "\n", c) for c in chunks or []]
+        if any(p is None for p in pieces):
+            _TOKEN_TABLES[key] = None
+            return None
+        offsets = np.zeros(len(pieces) + 1, dtype=np.int64)
+        if pieces:
+            np.cumsum([len(p) for p in pieces], out=offsets[1:])
+        flat = np.fromiter((t for p in pieces for t in p), dtype=np.int32, count=int(offsets[-1]))
+        table = (flat, offsets)
+        try:
+            np.savez(CHUNK_TOKENS_PATH, key=np.array(key), flat=flat, offsets=offsets)
+        except Exception:
+            pass
+    _TOKEN_TABLES[key] = table
+    return table
+
+
 def query(text: str, top_k: int = 3):
     q = embedder.encode([text])[0]
     results = []
@@ -330,7 +493,10 @@ def query(text: str, top_k: int = 3):
     if embeddings is None or embeddings.shape[0] == 0:
         return []
     sims = embeddings @ q  # since vectors are L2-normalized, dot approximates cosine
-    top_idx = np.argsort(-sims)[:top_k]
+    # Select the top k in O(n), then order only those
+    top_k = min(top_k, sims.shape[0])
+    top_idx = np.argpartition(-sims, top_k - 1)[:top_k] if top_k < sims.shape[0] else np.arange(sims.shape[0])
+    top_idx = top_idx[np.argsort(-sims[top_idx])]
     for idx in top_idx:
         results.append({"chunk": chunks[int(idx)], "distance": float(1.0 - sims[int(idx)])})
     return results
@@ -349,5 +515,7 @@ def get_status() -> dict:
             "embeddings": os.path.exists(EMB_PATH),
             "faiss_index": os.path.exists(FAISS_PATH),
         },
-        "embedder": "SentenceTransformer" if embedder.model else "Hash",
+        # Report without triggering the lazy model load
+        "embedder": "SentenceTransformer" if embedder._model is not None else (
+            "SentenceTransformer (not loaded)" if not embedder._model_tried else "Hash"),
     }
@@ -103,8 +103,7 @@ def main():
     faiss_index = None
     if _FAISS_OK:
         try:
-            faiss_index = faiss.IndexFlatL2(embeddings.shape[1])
-            faiss_index.add(embeddings)
+            faiss_index = rag_utils.make_faiss_index(embeddings)
         except Exception as e:
             print(f"[warn] Failed to build FAISS index: {e}")
             faiss_index = None
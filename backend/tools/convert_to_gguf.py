@@ -0,0 +1,65 @@
+"""
+Convert a local HF model folder to a quantized GGUF file for the llama.cpp backend (one-time).
+
+Runs llama.cpp's convert_hf_to_gguf.py to write an f16 GGUF, then llama-quantize to
+produce the quantized file (Q4_K_M by default) and removes the f16 intermediate.
+Needs a llama.cpp checkout (for the converter script and its gguf requirements) and
+a built llama-quantize binary.
+
+Usage (PowerShell from backend/):
+
+  python tools/convert_to_gguf.py --src models/my-model --llama-cpp C:/src/llama.cpp
+
+Then set LLAMA_GGUF to the printed .gguf path and install llama-cpp-python.
+"""
+from __future__ import annotations
+import argparse
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an HF model folder to a quantized GGUF file.")
+    parser.add_argument("--src", required=True, help="Local model folder (config.json + weights)")
+    parser.add_argument("--llama-cpp", required=True, help="Path to a llama.cpp checkout")
+    parser.add_argument("--dst", help="Output .gguf file (default: <src>-<quant>.gguf)")
+    parser.add_argument("--quant", default="Q4_K_M", help="llama-quantize type (default Q4_K_M)")
+    parser.add_argument("--quantize-bin", help="llama-quantize binary (default: found in the checkout's build/bin or on PATH)")
+    args = parser.parse_args()
+
+    src = Path(args.src).resolve()
+    llama_cpp = Path(args.llama_cpp).resolve()
+    dst = Path(args.dst).resolve() if args.dst else src.with_name(f"{src.name}-{args.quant}.gguf")
+    if not (src / "config.json").exists():
+        print(f"No config.json in {src}", file=sys.stderr)
+        sys.exit(1)
+    converter = llama_cpp / "convert_hf_to_gguf.py"
+    if not converter.exists():
+        print(f"No convert_hf_to_gguf.py in {llama_cpp}", file=sys.stderr)
+        sys.exit(1)
+    quantize = args.quantize_bin
+    if not quantize:
+        for cand in (llama_cpp / "build" / "bin" / "llama-quantize", llama_cpp / "build" / "bin" / "Release" / "llama-quantize.exe"):
+            if cand.exists():
+                quantize = str(cand)
+                break
+        else:
+            quantize = shutil.which("llama-quantize")
+    if not quantize:
+        print("Error: llama-quantize not found; build llama.cpp or pass --quantize-bin", file=sys.stderr)
+        sys.exit(1)
+
+    f16 = dst.with_name(dst.stem + "-f16.gguf")
+    print(f"Converting '{src}' to {f16} ...")
+    subprocess.run([sys.executable, str(converter), str(src), "--outfile", str(f16), "--outtype", "f16"], check=True)
+    print(f"Quantizing to {args.quant} ...")
+    subprocess.run([quantize, str(f16), str(dst), args.quant], check=True)
+    f16.unlink(missing_ok=True)
+    print(f"Saved GGUF model to: {dst}")
+    print(f"  - Set LLAMA_GGUF to: {dst}")
+
+
+if __name__ == "__main__":
+    main()
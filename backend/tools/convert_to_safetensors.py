@@ -0,0 +1,56 @@
+"""
+Re-save a local HF model folder with .safetensors weights (one-time conversion).
+
+app.py loads the LLM with low_cpu_mem_usage; with safetensors shards the weights are
+memory-mapped and copied straight to their target device instead of unpickling whole
+.bin files into RAM first. Folders downloaded with download_local_llm.py usually
+ship safetensors already; use this for checkpoints that only have pytorch_model*.bin.
+
+Usage (PowerShell from backend/):
+
+  python tools/convert_to_safetensors.py --src models/my-model --dst models/my-model-st
+
+Then point MODEL_REPO at the --dst folder.
+"""
+from __future__ import annotations
+import argparse
+import sys
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-save an HF model folder with safetensors weights.")
+    parser.add_argument("--src", required=True, help="Local model folder (config.json + pytorch_model*.bin)")
+    parser.add_argument("--dst", required=True, help="Output folder for the converted model")
+    parser.add_argument("--max-shard-size", default="2GB", help="Shard size for the saved weights (default 2GB)")
+    args = parser.parse_args()
+
+    src = Path(args.src).resolve()
+    dst = Path(args.dst).resolve()
+    if not (src / "config.json").exists():
+        print(f"No config.json in {src}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+    except Exception:
+        print("Error: transformers is required. Install with: pip install transformers", file=sys.stderr)
+        raise
+
+    print(f"Loading '{src}' ...")
+    # torch_dtype='auto' keeps the checkpoint's stored precision
+    model = AutoModelForCausalLM.from_pretrained(
+        str(src), torch_dtype="auto", low_cpu_mem_usage=True, trust_remote_code=True, local_files_only=True
+    )
+    dst.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(str(dst), safe_serialization=True, max_shard_size=args.max_shard_size)
+    try:
+        AutoTokenizer.from_pretrained(str(src), local_files_only=True).save_pretrained(str(dst))
+    except Exception as e:
+        print(f"[warn] Tokenizer not copied: {e}")
+    print(f"Saved safetensors model to: {dst}")
+    print(f"  - Set MODEL_REPO to: {dst}")
+
+
+if __name__ == "__main__":
+    main()
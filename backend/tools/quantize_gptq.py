@@ -0,0 +1,80 @@
+"""
+Export a local HF model folder as a 4-bit GPTQ checkpoint (one-time, needs a CUDA GPU).
+
+app.py otherwise quantizes to NF4 with bitsandbytes at every load, and NF4 dequantizes
+each weight to fp16 inside every matmul. A GPTQ export instead runs on fused int4 kernels
+(ExLlama/Marlin) and loads without re-quantizing; app.py detects it from config.json.
+Requires: pip install optimum gptqmodel
+
+Calibration text defaults to the RAG chunks in Data/rag_chunks.json (the domain the
+model answers about); pass --dataset c4 to use the generic C4 sample instead.
+
+Usage (PowerShell from backend/):
+
+  python tools/quantize_gptq.py --src models/my-model --dst models/my-model-gptq
+
+Then point MODEL_REPO at the --dst folder.
+"""
+from __future__ import annotations
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def _calibration_texts(dataset: str, limit: int):
+    if dataset != "rag":
+        return dataset
+    chunks_path = Path(__file__).resolve().parent.parent / "Data" / "rag_chunks.json"
+    try:
+        chunks = json.loads(chunks_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        print(f"[warn] No RAG chunks at {chunks_path}; using the c4 sample")
+        return "c4"
+    texts = [c for c in chunks if isinstance(c, str) and c.strip()][:limit]
+    return texts or "c4"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export an HF model folder as a 4-bit GPTQ checkpoint.")
+    parser.add_argument("--src", required=True, help="Local model folder (config.json + weights)")
+    parser.add_argument("--dst", required=True, help="Output folder for the quantized model")
+    parser.add_argument("--group-size", type=int, default=128, help="Quantization group size (default 128)")
+    parser.add_argument("--dataset", default="rag", help="'rag' (Data/rag_chunks.json, default) or a dataset name such as c4")
+    parser.add_argument("--samples", type=int, default=128, help="Max calibration texts taken from the RAG chunks")
+    args = parser.parse_args()
+
+    src = Path(args.src).resolve()
+    dst = Path(args.dst).resolve()
+    if not (src / "config.json").exists():
+        print(f"No config.json in {src}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        from transformers import AutoModelForCausalLM, AutoTokenizer, GPTQConfig
+    except Exception:
+        print("Error: transformers is required. Install with: pip install transformers optimum gptqmodel", file=sys.stderr)
+        raise
+
+    tokenizer = AutoTokenizer.from_pretrained(str(src), use_fast=True, local_files_only=True)
+    config = GPTQConfig(
+        bits=4,
+        group_size=args.group_size,
+        desc_act=True,  # act-order: better accuracy at the same int4 size
+        dataset=_calibration_texts(args.dataset, args.samples),
+        tokenizer=tokenizer,
+    )
+    print(f"Quantizing '{src}' to 4-bit GPTQ (group size {args.group_size}) ...")
+    model = AutoModelForCausalLM.from_pretrained(
+        str(src), quantization_config=config, device_map="auto", torch_dtype="auto",
+        trust_remote_code=True, local_files_only=True
+    )
+    dst.mkdir(parents=True, exist_ok=True)
+    model.save_pretrained(str(dst), safe_serialization=True)
+    tokenizer.save_pretrained(str(dst))
+    print(f"Saved GPTQ model to: {dst}")
+    print(f"  - Set MODEL_REPO to: {dst}")
+
+
+if __name__ == "__main__":
+    main()